@@ -1,8 +1,8 @@
 import asyncio
 from google.adk import Agent
 from dotenv import load_dotenv
-from google.adk.sessions import InMemorySessionService
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai import types
 from google.adk.events import Event, EventActions
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset, SseServerParams
@@ -12,90 +12,191 @@ import os
 import logging
 from tools.crontab_tool import schedule_task, remove_task, list_tasks
 from tools.time_tool import get_current_time
+from tools.search_tool import search_messages
+from session_store import SqliteSessionService
+from sharding import owns_chat
+from budgets import user_budgets
+from compaction import compact_session, inject_conversation_summary
+from context_cache import ContextCache, PromptFile
+from mcp_cache import CachingMCPToolset
+from mcp_connection import ManagedMCPToolset
+from metrics import model_call_timing, record_model_start, record_model_end, record_tool_start, record_tool_end
+from tracing import Trace, start_trace, finish_trace, trace_model_start, trace_model_end, trace_tool_start, trace_tool_end
+from streaming import StreamingReply
+from tool_executor import off_loop, prefetch_parallel_calls, remember_tools, use_prefetched_call
 
-session_service = InMemorySessionService()
+session_service = SqliteSessionService(owns=owns_chat)
 
 APP_NAME = "WhatsAppButler"
 
 load_dotenv()
 
+# Reread when the file changes; the static part is served from the context cache
+agent_prompt = PromptFile(os.path.join(os.path.dirname(__file__), "prompts", "prompt.md"))
+context_cache = ContextCache(agent_prompt)
+
 def load_agent_prompt():
     """Load the agent prompt from the prompts directory."""
-    prompt_path = os.path.join(os.path.dirname(__file__), "prompts", "prompt.md")
-    try:
-        with open(prompt_path, "r") as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        logging.error(f"Prompt file not found at {prompt_path}")
-        raise
+    return agent_prompt.text()
 
 # Set up the model
 AGENT_MODEL = os.getenv("AGENT_MODEL", "gemini-2.0-flash")
+MCP_URL = os.getenv("WHATSAPP_MCP_URL", "http://whatsapp-mcp:3001/mcp")
+MCP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MCP_CONNECT_TIMEOUT_SECONDS", "5"))
+
+
+def create_mcp_toolset():
+    """Open a new connection to the WhatsApp MCP server."""
+    return MCPToolset(
+        connection_params=SseServerParams(url=MCP_URL, timeout=MCP_CONNECT_TIMEOUT_SECONDS)
+    )
+
+# Connected in the background; see ManagedMCPToolset
+whatsapp_mcp = ManagedMCPToolset(create_mcp_toolset)
 
 
 async def initialize_agent_and_runner():
     """
     Initializes the agent (with MCP tools) and the runner.
-    Returns: (runner, agent, exit_stack)
+    The MCP connection is opened in the background, so this does not wait on
+    the WhatsApp MCP server.
+    Returns: (runner, agent)
     """
-    mcp_url = os.getenv("WHATSAPP_MCP_URL", "http://whatsapp-mcp:3001/mcp")
+    whatsapp_mcp.start()
+    # Fail at startup rather than on the first query if the prompt is missing
+    load_agent_prompt()
 
+    # Synchronous tools run on a thread pool so they never stall other chats
     tools = [
-        MCPToolset(
-            connection_params=SseServerParams(url=mcp_url)
-        ),
-        schedule_task,
-        remove_task,
-        list_tasks,
-        get_current_time
+        CachingMCPToolset(whatsapp_mcp),
+        off_loop(schedule_task),
+        off_loop(remove_task),
+        off_loop(list_tasks),
+        off_loop(get_current_time),
+        off_loop(search_messages)
     ]   
 
     agent = Agent(
         model=AGENT_MODEL,
         name=APP_NAME,
         description="WhatsApp Butler, an intelligent assistant specializing in helping users find and understand information from their WhatsApp conversations.",
-        instruction=load_agent_prompt(),
+        instruction=agent_prompt.instruction,
         tools=tools,
         output_key="final_response_text",
+        before_model_callback=[inject_conversation_summary, record_model_start, trace_model_start, remember_tools, context_cache.apply],
+        after_model_callback=[record_model_end, trace_model_end, context_cache.record_usage, prefetch_parallel_calls],
+        before_tool_callback=[record_tool_start, trace_tool_start, use_prefetched_call],
+        after_tool_callback=[record_tool_end, trace_tool_end],
     )
     runner = Runner(
         agent=agent,
         app_name=APP_NAME,
         session_service=session_service
     )
-    print(f"Loaded {len(tools)} tools from WhatsApp MCP server at {mcp_url}.")
+    print(f"Loaded {len(tools)} tools; connecting to WhatsApp MCP server at {MCP_URL} in the background.")
     return runner, agent
 
 
-async def call_agent_async(query: str, runner, user_id, session_id) -> str:
-    """Sends a query to the agent and prints the final response."""
+async def record_exchange(user_id: str, session_id: str, query: str, reply: str):
+    """
+    Add a query answered without the agent, and its reply, to the session so
+    later turns see it.
+
+    Args:
+        user_id (str): The user the query is from
+        session_id (str): The user's session
+        query (str): The query text
+        reply (str): The reply sent
+    """
+    session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    if session is None:
+        session = await session_service.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    invocation_id = Event.new_id()
+    for author, role, text in (("user", "user", query), (APP_NAME, "model", reply)):
+        await session_service.append_event(session, Event(
+            invocation_id=invocation_id,
+            author=author,
+            content=types.Content(role=role, parts=[types.Part(text=text)]),
+            timestamp=time.time(),
+        ))
+
+
+async def call_agent_async(query: str, runner, user_id, session_id, stream: Optional[StreamingReply] = None) -> str:
+    """Sends a query to the agent and prints the final response.
+
+    If `stream` is given, the model is run in streaming mode and partial text
+    is handed to it as it arrives; the caller then delivers the reply through
+    the stream instead of sending the returned text.
+
+    Each call is traced; see /debug/traces. Model tokens and tool calls are
+    charged to the user's budget.
+    """
+    trace = start_trace(user_id, query)
+    error = None
+    try:
+        with model_call_timing():
+            return await _run_agent_turn(query, runner, user_id, session_id, stream, trace)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        finish_trace(trace, error)
+
+
+async def _run_agent_turn(query: str, runner, user_id, session_id, stream: Optional[StreamingReply], trace: Optional[Trace]) -> str:
+    """Runs one agent turn for call_agent_async."""
     print(f"\n>>> User Query: {query}")
 
+    if trace is not None:
+        trace.open_span("session", "session_lookup", "session")
     session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
     if session is None:
         # Create a new session if it doesn't exist
         session = await session_service.create_session(app_name = APP_NAME, user_id=user_id, session_id=session_id)
         logging.info(f"  [Session] Created new session for user {user_id} with session ID {session_id}.")
 
-    state_changes = {"user_id": user_id}
-    actions_with_update = EventActions(state_delta=state_changes)
-    system_event = Event(
-    invocation_id="user_id_update",
-    author="system",
-    actions=actions_with_update,
-    timestamp=time.time()
-    )
-    await session_service.append_event(session, system_event)
+    if session.state.get("user_id") != user_id:
+        state_changes = {"user_id": user_id}
+        actions_with_update = EventActions(state_delta=state_changes)
+        system_event = Event(
+        invocation_id="user_id_update",
+        author="system",
+        actions=actions_with_update,
+        timestamp=time.time()
+        )
+        await session_service.append_event(session, system_event)
+    if trace is not None:
+        trace.close_span("session")
 
     final_response_text = ""
     partial_response_text = ""
     content = types.Content(role='user', parts=[types.Part(text=query)])
-    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
-        # You can uncomment the line below to see *all* events during execution
-        print(f"  [Event] Author: {event.author}, Type: {type(event).__name__}, Final: {event.is_final_response()}, Content: {event.content}")
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE) if stream is not None else RunConfig()
+    # Formatting every event is expensive; only do it when DEBUG logging is on
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content, run_config=run_config):
+        if trace is not None:
+            trace.add_event(event)
+        if not event.partial:
+            # Charged as the turn goes, so a turn that fails halfway still counts
+            usage = event.usage_metadata
+            user_budgets.charge(
+                user_id,
+                tokens=(usage.total_token_count or 0) if usage is not None else 0,
+                tool_calls=len(event.get_function_calls()),
+            )
+            if stream is not None and not event.is_final_response():
+                # A step that ends in tool calls (or a tool's response): the next model step starts over
+                parts = event.content.parts if event.content and event.content.parts else []
+                await stream.on_step_text("".join(part.text for part in parts if part.text))
+        if debug:
+            logging.debug(f"  [Event] Author: {event.author}, Type: {type(event).__name__}, Final: {event.is_final_response()}, Content: {event.content}")
         if event.partial and event.content and event.content.parts and event.content.parts[0].text:
             partial_response_text += event.content.parts[0].text
-            logging.info(f"  [Partial] {partial_response_text}")
+            if debug:
+                logging.debug(f"  [Partial] {partial_response_text}")
+            if stream is not None:
+                await stream.on_partial(event.content.parts[0].text)
 
         # Key Concept: is_final_response() marks the concluding message for the turn.
         if event.is_final_response():
@@ -105,6 +206,19 @@ async def call_agent_async(query: str, runner, user_id, session_id) -> str:
             elif event.actions and event.actions.escalate: # Handle potential errors/escalations
                 final_response_text = f"Agent escalated: {event.error_message or 'No specific message.'}"
             # Add more checks here if needed (e.g., specific error codes)
-            break # Stop processing events once the final response is found
+            if stream is None:
+                break # Stop processing events once the final response is found
+            # When streaming, text written before a tool call also looks final; keep going
+            if final_response_text:
+                await stream.on_step_text(final_response_text)
     logging.info(f"Final response text: {final_response_text}")
+
+    # Fold old turns into the stored summary so the next prompt stays bounded
+    if trace is not None:
+        trace.open_span("compaction", "compaction", "session")
+    session = await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    if session is not None:
+        await compact_session(session_service, session)
+    if trace is not None:
+        trace.close_span("compaction")
     return final_response_text
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Measure webhook ingest throughput on one core.
+
+Drives the FastAPI app in-process (no network, no agent) with a mix of
+non-query group chatter and the occasional agent query, and reports
+messages/sec for the full /webhook endpoint next to the cost of the old
+"decode everything, log everything at INFO" intake.
+
+The endpoint runs with the default settings: the message index is on (its
+batched writes, done on the same core, are included in the time) and the
+MCP result cache holds entries, so every message invalidates it.
+
+Usage (from the agent directory):
+    python bench/ingest_bench.py [--messages 20000] [--query-ratio 0.01]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="ingest-bench-"))
+os.environ.setdefault("GOOGLE_API_KEY", "bench")
+
+
+def make_payloads(count: int, query_ratio: float) -> list:
+    """Build realistic webhook bodies: mostly group chatter, a few queries."""
+    rng = random.Random(42)
+    words = "ok lol see you tomorrow did anyone bring the charger photos from the party".split()
+    payloads = []
+    for i in range(count):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 40)))
+        if rng.random() < query_ratio:
+            text = "/query " + text
+        payloads.append(json.dumps({
+            "id": f"msg-{i}",
+            "from": f"{rng.randint(1, 50)}@g.us",
+            "name": "Someone",
+            "message": text,
+            "timestamp": 1700000000 + i,
+            "isGroup": True,
+            "hasMedia": False,
+        }).encode())
+    return payloads
+
+
+async def post(app, body: bytes):
+    """Send one POST /webhook through the ASGI app and return the status code."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/webhook", "raw_path": b"/webhook", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 8000),
+    }
+    status = {}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status["code"]
+
+
+async def bench_endpoint(payloads: list) -> float:
+    import webhook_server
+    from dedup import IdempotencyCache
+    from job_queue import JobQueue
+
+    from mcp_cache import tool_result_cache
+    from message_index import MESSAGE_INDEX_ENABLED, message_index
+
+    webhook_server.app.state.idempotency = IdempotencyCache()
+    job_queue = JobQueue(maxsize=len(payloads))
+    job_queue.open()
+    webhook_server.app.state.job_queue = job_queue
+    # A cached result for a chat outside the traffic, so the cache stays non-empty
+    tool_result_cache.put(tool_result_cache.key("get_messages", {"chatId": "0@c.us"}), ["message"], 3600, {"0@c.us"})
+    if MESSAGE_INDEX_ENABLED:
+        message_index.start()
+    started = time.perf_counter()
+    for body in payloads:
+        await post(webhook_server.app, body)
+    await message_index.stop()
+    elapsed = time.perf_counter() - started
+    message_index.close()
+    await job_queue.close()
+    return len(payloads) / elapsed
+
+
+def bench_legacy_intake(payloads: list) -> float:
+    """The old intake: stdlib json decode and an f-string INFO log per message."""
+    logger = logging.getLogger("legacy_intake")
+    started = time.perf_counter()
+    for body in payloads:
+        data = json.loads(body)
+        logger.info(f"Received webhook: {data}")
+        data.get("message", "").startswith("/query ")
+    return len(payloads) / (time.perf_counter() - started)
+
+
+def bench_triage(payloads: list) -> float:
+    """The new intake decision: prefix check on raw bytes, decode only candidates."""
+    from ingest import loads, log_dropped, might_be_query
+    started = time.perf_counter()
+    for body in payloads:
+        if might_be_query(body):
+            loads(body)
+        else:
+            log_dropped(body, decoded=False)
+    return len(payloads) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--query-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.messages, args.query_ratio)
+    import webhook_server  # noqa: F401  (configures logging)
+    # Keep log formatting costs but send the output nowhere
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setStream(open(os.devnull, "w"))
+
+    print(f"{args.messages} messages, {args.query_ratio:.1%} queries, one core")
+    print(f"  legacy intake (json + INFO log): {bench_legacy_intake(payloads):>10.0f} msgs/sec")
+    print(f"  triage (bytes check + sampling): {bench_triage(payloads):>10.0f} msgs/sec")
+    print(f"  full /webhook endpoint:          {asyncio.run(bench_endpoint(payloads)):>10.0f} msgs/sec")
+
+
+if __name__ == "__main__":
+    main()
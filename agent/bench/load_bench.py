@@ -0,0 +1,463 @@
+"""
+Offline load test of the webhook service: no Gemini quota, no phone.
+
+Starts a webhook process whose model is a fake with a fixed latency and a
+scripted list of tool calls per turn, an SSE MCP stub with wweb-mcp-shaped
+tools and a WhatsApp API stub that receives the replies. Then replays
+webhook traffic, either recorded with WEBHOOK_RECORD_PATH or generated, and
+reports throughput, reply latency percentiles and memory per active session.
+
+The replayed traffic arrives at a fixed rate, so its throughput can never
+exceed that rate. After it, a closed loop of --saturation-clients chats, each
+sending its next query as soon as the previous one is answered, keeps every
+turn slot busy for --saturation-seconds; the replies per second it gets are
+the service's capacity, reported as saturation_throughput.
+
+With --baseline, the run is compared with a saved result and the script exits
+with status 1 if capacity, latency or memory got worse by more than the
+tolerance, so it can gate CI.
+
+Usage (from the agent directory):
+    python bench/load_bench.py [--rate 20] [--duration 20] [--traffic recorded.jsonl]
+    python bench/load_bench.py --set STREAM_REPLIES=true --set MAX_CONCURRENT_TURNS=8
+    python bench/load_bench.py --tool-seconds 0.2 --script '[[{"name": "list_tasks"}, {"name": "get_chats"}]]'
+    python bench/load_bench.py --save-baseline bench/baseline.json
+    python bench/load_bench.py --baseline bench/baseline.json [--tolerance 0.25]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+QUERY_PREFIX = os.getenv("QUERY_PREFIX", "/query ")
+DEFAULT_SCRIPT = '[{"name": "get_chats", "args": {"limit": 20}}]'
+# Result keys compared with the baseline, and whether higher is better
+GATED = {
+    "saturation_throughput": True,
+    "p95_ms": False,
+    "p99_ms": False,
+    "memory_per_session_kib": False,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_worker():
+    """Run the webhook service with the fake model in place of Gemini."""
+    import agent
+    from stubs import GeminiCacheStub, fake_llm_from_env
+
+    if os.getenv("BENCH_CONTEXT_CACHE") == "true":
+        caches = GeminiCacheStub()
+        agent.context_cache.client = caches
+        agent.AGENT_MODEL = fake_llm_from_env(model="gemini-bench-fake", caches=caches)
+    else:
+        agent.AGENT_MODEL = fake_llm_from_env()
+    tool_seconds = float(os.getenv("BENCH_TOOL_SECONDS", "0"))
+    if tool_seconds:
+        # Stand-in for a slow disk (or the crontab shell-out list_tasks used to make)
+        from task_scheduler import TaskScheduler
+
+        listing = TaskScheduler.listing
+
+        def slow_listing(self, user_id: str):
+            time.sleep(tool_seconds)
+            return listing(self, user_id)
+
+        TaskScheduler.listing = slow_listing
+    import uvicorn
+    import webhook_server
+
+    uvicorn.run(webhook_server.app, host="127.0.0.1", port=int(os.environ["WEBHOOK_PORT"]), log_level="warning")
+
+
+def generate_traffic(messages: int, chats: int, query_ratio: float, rate: float) -> List[Tuple[float, bytes]]:
+    """Build (offset, body) pairs of group chatter with some agent queries, `rate` per second."""
+    rng = random.Random(42)
+    words = "ok lol see you tomorrow did anyone bring the charger photos from the party".split()
+    traffic = []
+    for i in range(messages):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 30)))
+        if rng.random() < query_ratio:
+            text = QUERY_PREFIX + text
+        body = json.dumps({
+            "id": f"load-{i}",
+            "from": f"{rng.randrange(chats)}@c.us",
+            "name": "Someone",
+            "message": text,
+            "timestamp": 1700000000 + i,
+            "hasMedia": False,
+        }).encode()
+        traffic.append((i / rate, body))
+    return traffic
+
+
+def load_traffic(path: str, rate: Optional[float], speed: float) -> List[Tuple[float, bytes]]:
+    """
+    Read traffic recorded with WEBHOOK_RECORD_PATH.
+
+    Args:
+        path (str): The recording
+        rate (Optional[float]): Replay evenly at this many messages/sec instead of the recorded timing
+        speed (float): Speed-up of the recorded timing
+
+    Returns:
+        List[Tuple[float, bytes]]: (offset, body) pairs
+    """
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        raise ValueError(f"No traffic in {path}")
+    first = records[0]["at"]
+    return [
+        (i / rate if rate else (record["at"] - first) / speed, record["body"].encode())
+        for i, record in enumerate(records)
+    ]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile; 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def rss_kib(pid: int) -> Optional[int]:
+    """Resident memory of a process in KiB, where /proc is available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def wait_until_ready(client, url: str, timeout: float = 120):
+    """Wait until the webhook service has its agent and MCP connection up."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{url}/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError("webhook service did not become ready")
+
+
+async def replay(traffic: List[Tuple[float, bytes]], args) -> Dict:
+    """Start the stubs and the webhook service, replay `traffic` and return the results."""
+    import httpx
+    import uvicorn
+    from stubs import WhatsAppApiStub
+
+    api = WhatsAppApiStub()
+    api_port, mcp_port, port = free_port(), free_port(), free_port()
+    api_server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=api_port, log_level="warning"))
+    api_task = asyncio.create_task(api_server.serve())
+
+    env = dict(os.environ)
+    env.update({
+        "DATA_DIR": tempfile.mkdtemp(prefix="load-bench-"),
+        "GOOGLE_API_KEY": "bench",
+        "WEBHOOK_PORT": str(port),
+        "WHATSAPP_API_URL": f"http://127.0.0.1:{api_port}/api",
+        "WHATSAPP_MCP_URL": f"http://127.0.0.1:{mcp_port}/sse",
+        "BENCH_MODEL_LATENCY": str(args.model_latency),
+        "BENCH_MODEL_CPU_MS": str(args.model_cpu_ms),
+        "BENCH_MODEL_SCRIPT": args.script,
+        "BENCH_TOOL_SECONDS": str(args.tool_seconds),
+        "BENCH_CONTEXT_CACHE": "true" if args.context_cache else "false",
+        "CONTEXT_CACHE_ENABLED": "true" if args.context_cache else "false",
+    })
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        env[key] = value
+
+    # Reply latency: a query's clock starts when it is posted and stops at the first message to its chat
+    waiting: Dict[str, collections.deque] = collections.defaultdict(collections.deque)
+    latencies: List[float] = []
+    done = asyncio.Event()
+    expected = 0
+
+    # Saturation clients wait on a future per chat instead
+    saturation_waiting: Dict[str, asyncio.Future] = {}
+
+    def on_send(message: Dict):
+        reply = saturation_waiting.pop(message.get("number"), None)
+        if reply is not None and not reply.done():
+            reply.set_result(message)
+            return
+        queue = waiting.get(message.get("number"))
+        if queue:
+            latencies.append(message["time"] - queue.popleft())
+            if expected and len(latencies) >= expected:
+                done.set()
+
+    api.on_send = on_send
+
+    mcp = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "stubs.py"), "mcp", str(mcp_port)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--role", "worker"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            await wait_until_ready(client, url)
+            rss_before = rss_kib(server.pid)
+            statuses: collections.Counter = collections.Counter()
+            accept_latencies: List[float] = []
+            query_chats = set()
+
+            async def post(body: bytes):
+                nonlocal expected
+                payload = json.loads(body)
+                chat = payload.get("from")
+                query = str(payload.get("message", "")).startswith(QUERY_PREFIX)
+                sent = time.perf_counter()
+                # Registered before posting, as the reply may beat the webhook response
+                if query:
+                    waiting[chat].append(sent)
+                response = await client.post(f"{url}/webhook", content=body,
+                                             headers={"content-type": "application/json"})
+                accept_latencies.append(time.perf_counter() - sent)
+                statuses[response.status_code] += 1
+                if response.status_code == 202:
+                    query_chats.add(chat)
+                    expected += 1
+                elif query and sent in waiting[chat]:
+                    waiting[chat].remove(sent)
+
+            started = time.perf_counter()
+            posts = []
+            for offset, body in traffic:
+                delay = started + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                posts.append(asyncio.create_task(post(body)))
+            await asyncio.gather(*posts)
+            if len(latencies) < expected:
+                done.clear()
+                try:
+                    await asyncio.wait_for(done.wait(), args.drain_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            elapsed = time.perf_counter() - started
+            rss_after = rss_kib(server.pid)
+            service_stats = (await client.get(f"{url}/stats")).json()
+
+            saturation_latencies: List[float] = []
+            saturation_end = time.perf_counter() + args.saturation_seconds
+
+            async def saturation_client(index: int):
+                chat = f"saturation-{index}@c.us"
+                sequence = 0
+                while time.perf_counter() < saturation_end:
+                    sequence += 1
+                    reply = asyncio.get_running_loop().create_future()
+                    saturation_waiting[chat] = reply
+                    body = json.dumps({
+                        "id": f"saturation-{index}-{sequence}",
+                        "from": chat,
+                        "name": "Someone",
+                        "message": f"{QUERY_PREFIX}what did I miss",
+                        "timestamp": 1800000000 + sequence,
+                        "hasMedia": False,
+                    }).encode()
+                    sent = time.perf_counter()
+                    response = await client.post(f"{url}/webhook", content=body,
+                                                 headers={"content-type": "application/json"})
+                    if response.status_code != 202:
+                        saturation_waiting.pop(chat, None)
+                        await asyncio.sleep(0.1)
+                        continue
+                    await asyncio.wait_for(reply, args.drain_timeout)
+                    # Replies that land after the window are left out, as are the turns they took
+                    if time.perf_counter() <= saturation_end:
+                        saturation_latencies.append(time.perf_counter() - sent)
+
+            saturation_started = time.perf_counter()
+            if args.saturation_seconds > 0:
+                await asyncio.gather(*(saturation_client(i) for i in range(args.saturation_clients)))
+            saturation_elapsed = min(time.perf_counter(), saturation_end) - saturation_started
+            final_stats = (await client.get(f"{url}/stats")).json()
+    finally:
+        server.terminate()
+        server.wait()
+        mcp.kill()
+        mcp.wait()
+        api_server.should_exit = True
+        await api_task
+
+    sessions = len(query_chats)
+    memory_per_session = None
+    if rss_before is not None and rss_after is not None and sessions:
+        memory_per_session = round((rss_after - rss_before) / sessions, 1)
+    return {
+        "config": {
+            "traffic": args.traffic or "generated",
+            "model_latency": args.model_latency,
+            "model_cpu_ms": args.model_cpu_ms,
+            "script": json.loads(args.script),
+            "tool_seconds": args.tool_seconds,
+            "context_cache": args.context_cache,
+            "set": args.set,
+            "saturation_seconds": args.saturation_seconds,
+            "saturation_clients": args.saturation_clients,
+        },
+        "messages": len(traffic),
+        "offered_rate": round(len(traffic) / traffic[-1][0], 1) if traffic[-1][0] else None,
+        "queries": expected,
+        "replies": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "saturation_throughput": saturation_throughput(saturation_latencies, saturation_elapsed,
+                                                       service_stats, final_stats),
+        "saturation_p50_ms": round(percentile(saturation_latencies, 0.50) * 1000, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "webhook_p99_ms": round(percentile(accept_latencies, 0.99) * 1000, 2),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "sessions": sessions,
+        "rss_mib": round(rss_after / 1024, 1) if rss_after is not None else None,
+        "memory_per_session_kib": memory_per_session,
+        "prompt_tokens_per_reply": round(service_stats["context_cache"]["prompt_tokens_total"] / max(len(latencies), 1)),
+        "cached_token_ratio": round(service_stats["context_cache"]["cached_token_ratio"], 3),
+        "failed_jobs": final_stats["queue"]["failed_total"],
+        "failed_sends": final_stats["sender"]["failures_total"],
+    }
+
+
+def saturation_throughput(latencies: List[float], elapsed: float, before: Dict, after: Dict) -> Optional[float]:
+    """
+    Agent replies per second in the saturation phase.
+
+    Busy and over-budget replies arrive like answers but skip the model, so
+    the ones the service counted during the phase are taken off.
+
+    Args:
+        latencies (List[float]): Reply latencies of the queries answered within the phase
+        elapsed (float): Length of the phase in seconds
+        before (Dict): /stats at the start of the phase
+        after (Dict): /stats at the end of the phase
+
+    Returns:
+        Optional[float]: Replies per second; None if the phase did not run
+    """
+    if elapsed <= 0:
+        return None
+    skipped = (after["turns"]["shed_total"] - before["turns"]["shed_total"]
+               + after["budgets"]["refused_total"] - before["budgets"]["refused_total"])
+    return round(max(len(latencies) - skipped, 0) / elapsed, 2)
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of `result` against `baseline`.
+
+    Args:
+        result (Dict): This run
+        baseline (Dict): A saved run
+        tolerance (float): Allowed relative change for the worse
+
+    Returns:
+        List[str]: One line per regressed figure; empty if there is none
+    """
+    if result["config"] != baseline.get("config") or result["messages"] != baseline.get("messages"):
+        print("Warning: the baseline was recorded with different settings")
+    regressions = []
+    for key, higher_is_better in GATED.items():
+        value, reference = result.get(key), baseline.get(key)
+        if value is None or not reference:
+            continue
+        if higher_is_better and value < reference * (1 - tolerance):
+            regressions.append(f"{key} dropped from {reference} to {value}")
+        elif not higher_is_better and value > reference * (1 + tolerance):
+            regressions.append(f"{key} rose from {reference} to {value}")
+    if result["replies"] < result["queries"]:
+        regressions.append(f"only {result['replies']} of {result['queries']} queries were answered")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--role", choices=["driver", "worker"], default="driver")
+    parser.add_argument("--traffic", help="JSON lines recorded with WEBHOOK_RECORD_PATH; generated if omitted")
+    parser.add_argument("--rate", type=float, help="Messages/sec (default 20 for generated traffic, recorded timing otherwise)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up of recorded timing")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of generated traffic")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--query-ratio", type=float, default=0.25)
+    parser.add_argument("--model-latency", type=float, default=0.1, help="Seconds per model step")
+    parser.add_argument("--model-cpu-ms", type=float, default=2.0)
+    parser.add_argument("--script", default=DEFAULT_SCRIPT,
+                        help="Tool calls per turn, as a JSON list; a nested list is one step of parallel calls")
+    parser.add_argument("--context-cache", action="store_true",
+                        help="Enable the context cache and name the fake model like Gemini so requests go through it (stubbed)")
+    parser.add_argument("--tool-seconds", type=float, default=0,
+                        help="Make list_tasks block its thread this long, like a slow disk")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment setting for the webhook service")
+    parser.add_argument("--saturation-seconds", type=float, default=15,
+                        help="Length of the closed-loop capacity phase after the replay; 0 skips it")
+    parser.add_argument("--saturation-clients", type=int, default=16,
+                        help="Chats in the closed loop; more than MAX_CONCURRENT_TURNS keeps every slot busy")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        return run_worker()
+
+    if args.traffic:
+        traffic = load_traffic(args.traffic, args.rate, args.speed)
+    else:
+        rate = args.rate or 20
+        traffic = generate_traffic(int(rate * args.duration), args.chats, args.query_ratio, rate)
+    print(f"Replaying {len(traffic)} messages over {traffic[-1][0]:.1f}s, model {args.model_latency}s/step, "
+          f"{os.cpu_count()} CPU(s)")
+    result = asyncio.run(replay(traffic, args))
+    print(json.dumps(result, indent=2))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(result, f, indent=2)
+                f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Measure agent-turn throughput as the number of webhook processes grows.
+
+For each process count, starts the dispatcher (which starts the webhook
+processes, each with a fake model), an SSE MCP stub and a WhatsApp API stub,
+then posts queries from many chats and times how long it takes until every
+reply has been sent.
+
+Usage (from the agent directory):
+    python bench/scaleout_bench.py [--processes 1 2 4] [--queries 400] [--chats 64]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_worker():
+    """Run one webhook process with the fake model in place of Gemini."""
+    import agent
+    from stubs import fake_llm_from_env
+
+    agent.AGENT_MODEL = fake_llm_from_env()
+    import uvicorn
+    import webhook_server
+
+    uvicorn.run(webhook_server.app, host="127.0.0.1", port=int(os.environ["WEBHOOK_PORT"]), log_level="warning")
+
+
+def run_dispatcher():
+    """Run the dispatcher, starting webhook processes in worker mode."""
+    import uvicorn
+    from dispatcher import WorkerPool, create_app
+
+    pool = WorkerPool(command=[sys.executable, os.path.abspath(__file__), "--role", "worker"])
+    uvicorn.run(create_app(pool), host="127.0.0.1", port=int(os.environ["WEBHOOK_PORT"]), log_level="warning")
+
+
+async def wait_until_up(client, url: str, processes: int, timeout: float = 120):
+    """Wait until every webhook process answers /stats through the dispatcher."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            workers = (await client.get(f"{url}/stats")).json()["workers"]
+            if len(workers) == processes and all("queue" in worker for worker in workers):
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("webhook processes did not come up")
+
+
+async def run_round(processes: int, args) -> float:
+    """Start the system with `processes` webhook processes and return replies/sec."""
+    import httpx
+    import uvicorn
+    from stubs import WhatsAppApiStub
+
+    api = WhatsAppApiStub()
+    api_port, mcp_port, port = free_port(), free_port(), free_port()
+    api_server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=api_port, log_level="warning"))
+    api_task = asyncio.create_task(api_server.serve())
+
+    env = dict(os.environ)
+    env.update({
+        "DATA_DIR": tempfile.mkdtemp(prefix="scaleout-bench-"),
+        "GOOGLE_API_KEY": "bench",
+        "WEBHOOK_PORT": str(port),
+        "WORKER_BASE_PORT": str(free_port()),
+        "WEBHOOK_PROCESSES": str(processes),
+        "WHATSAPP_API_URL": f"http://127.0.0.1:{api_port}/api",
+        "WHATSAPP_MCP_URL": f"http://127.0.0.1:{mcp_port}/sse",
+        "MAX_CONCURRENT_TURNS": "64",
+        "MAX_PENDING_TURNS": str(args.queries * 2),
+        "QUEUE_MAXSIZE": str(args.queries * 2),
+        "WORKER_COUNT": "16",
+        "BENCH_MODEL_LATENCY": str(args.model_latency),
+        "BENCH_MODEL_CPU_MS": str(args.model_cpu_ms),
+    })
+    mcp = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "stubs.py"), "mcp", str(mcp_port)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--role", "dispatcher"],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            await wait_until_up(client, url, processes)
+            api.expect(args.queries)
+            semaphore = asyncio.Semaphore(50)
+
+            async def post(i: int):
+                async with semaphore:
+                    await client.post(f"{url}/webhook", json={
+                        "id": f"bench-{i}",
+                        "from": f"{i % args.chats}@c.us",
+                        "name": "Bench",
+                        "message": f"/query what did we say about item {i}?",
+                    })
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(i) for i in range(args.queries)))
+            await asyncio.wait_for(api.arrived.wait(), args.timeout)
+            return args.queries / (time.perf_counter() - started)
+    finally:
+        server.terminate()
+        server.wait()
+        mcp.kill()
+        api_server.should_exit = True
+        await api_task
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--role", choices=["driver", "dispatcher", "worker"], default="driver")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--chats", type=int, default=64)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    parser.add_argument("--model-cpu-ms", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        return run_worker()
+    if args.role == "dispatcher":
+        return run_dispatcher()
+
+    print(f"{args.queries} queries from {args.chats} chats, model latency {args.model_latency}s, "
+          f"{os.cpu_count()} CPU(s)")
+    if max(args.processes) > (os.cpu_count() or 1):
+        print("Warning: more processes than CPUs, so those rounds can only show the dispatcher's overhead")
+    baseline = None
+    for processes in args.processes:
+        rate = asyncio.run(run_round(processes, args))
+        baseline = baseline or rate
+        print(f"  {processes} process(es): {rate:8.1f} replies/sec  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
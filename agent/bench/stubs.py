@@ -0,0 +1,225 @@
+"""
+Stand-ins for the external services, for benchmarks.
+
+- A WhatsApp API stub that accepts POST /api/send and records what was sent.
+- An SSE MCP server exposing a few read-only wweb-mcp tools with canned data.
+- A fake model that answers after a fixed latency without calling any API,
+  optionally calling a scripted list of tools first.
+- A stand-in for Gemini's context cache API, which the fake model honours.
+
+Run the MCP stub on its own with:
+    python bench/stubs.py mcp 3002
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class WhatsAppApiStub:
+    """Records every message the butler sends, with its arrival time."""
+
+    def __init__(self):
+        self.sent: List[Dict] = []
+        self.arrived = asyncio.Event()
+        self.expected = 0
+        # Called with each message as it arrives
+        self.on_send = None
+        self.app = Starlette(routes=[Route("/api/send", self.send, methods=["POST"])])
+
+    async def send(self, request: Request):
+        body = await request.json()
+        message = {"time": time.perf_counter(), **body}
+        self.sent.append(message)
+        if self.on_send is not None:
+            self.on_send(message)
+        if self.expected and len(self.sent) >= self.expected:
+            self.arrived.set()
+        return JSONResponse({"success": True})
+
+    def expect(self, count: int):
+        """Arm `arrived` to fire once `count` messages have been sent in total."""
+        self.expected = count
+        self.arrived.clear()
+        if len(self.sent) >= count:
+            self.arrived.set()
+
+
+def estimate_tokens(*values: Any) -> int:
+    """Rough token count of some text or pydantic objects, at four characters a token."""
+    size = 0
+    for value in values:
+        if value is None:
+            continue
+        if hasattr(value, "model_dump_json"):
+            value = value.model_dump_json(exclude_none=True)
+        elif not isinstance(value, str):
+            value = json.dumps(value, default=str)
+        size += len(value)
+    return size // 4
+
+
+class GeminiCacheStub:
+    """
+    In-memory stand-in for `google.genai.Client().aio.caches`.
+
+    Pass it as the ContextCache client and to `make_fake_llm`, which then
+    counts a cached prefix as cached tokens.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.created = 0
+        self.aio = SimpleNamespace(caches=SimpleNamespace(create=self.create, update=self.update, delete=self.delete))
+
+    async def create(self, *, model: str, config):
+        self.created += 1
+        name = f"cachedContents/stub-{self.created}"
+        self.entries[name] = {
+            "model": model,
+            "tokens": estimate_tokens(config.system_instruction, *(config.tools or [])),
+            "expires_at": time.time() + float(config.ttl.rstrip("s")),
+        }
+        return SimpleNamespace(name=name)
+
+    async def update(self, *, name: str, config):
+        self.entries[name]["expires_at"] = time.time() + float(config.ttl.rstrip("s"))
+
+    async def delete(self, *, name: str):
+        self.entries.pop(name, None)
+
+    def tokens(self, name: str) -> int:
+        """Size of a live cache; raises like the API does for an unknown or expired one."""
+        entry = self.entries.get(name)
+        if entry is None or entry["expires_at"] < time.time():
+            raise ValueError(f"Cached content {name} not found")
+        return entry["tokens"]
+
+
+def make_fake_llm(latency: float = 0.05, cpu_ms: float = 0.0, reply: str = "Done.",
+                  script: Optional[List] = None, model: str = "bench-fake",
+                  caches: Optional[GeminiCacheStub] = None):
+    """
+    Build a model that answers every request with `reply`.
+
+    With a `script`, each turn first calls the listed tools, one per model
+    step, and answers once all of their results are in. A step that is a
+    list of calls makes them all in one response, as parallel function calls.
+
+    Args:
+        latency (float): Seconds spent waiting, like a network round trip
+        cpu_ms (float): Milliseconds of CPU burnt per call, like decoding a response
+        reply (str): The answer text
+        script (Optional[List]): Tool calls per turn, each {"name": ..., "args": {...}} or a list of them
+        model (str): Model name; one starting with "gemini" makes the agent use the context cache
+        caches (Optional[GeminiCacheStub]): Context caches the requests may refer to
+
+    Returns:
+        BaseLlm: The fake model
+    """
+    from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+    from google.genai import types
+
+    steps = [step if isinstance(step, list) else [step] for step in script or []]
+
+    def next_calls(llm_request: LlmRequest) -> List[types.Part]:
+        """The scripted calls for this step; none once the script is done."""
+        done = 0
+        for content in reversed(llm_request.contents):
+            if content.role == "user" and any(part.text for part in content.parts or []):
+                break
+            done += sum(1 for part in content.parts or [] if part.function_response)
+        for step in steps:
+            if done < len(step):
+                return [types.Part(function_call=types.FunctionCall(name=call["name"], args=call.get("args", {})))
+                        for call in step]
+            done -= len(step)
+        return []
+
+    def usage(llm_request: LlmRequest) -> types.GenerateContentResponseUsageMetadata:
+        """Token counts estimated from the request, as Gemini reports them."""
+        config = llm_request.config
+        prompt = estimate_tokens(config.system_instruction, *(config.tools or []), *llm_request.contents)
+        cached = 0
+        if config.cached_content and caches is not None:
+            cached = caches.tokens(config.cached_content)
+        return types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt + cached,
+            cached_content_token_count=cached or None,
+            candidates_token_count=20,
+            total_token_count=prompt + cached + 20,
+        )
+
+    class FakeLlm(BaseLlm):
+        async def generate_content_async(
+            self, llm_request: LlmRequest, stream: bool = False
+        ) -> AsyncGenerator[LlmResponse, None]:
+            await asyncio.sleep(latency)
+            deadline = time.perf_counter() + cpu_ms / 1000
+            while time.perf_counter() < deadline:
+                pass
+            calls = next_calls(llm_request)
+            yield LlmResponse(
+                content=types.Content(role="model", parts=calls or [types.Part(text=reply)]),
+                usage_metadata=usage(llm_request),
+            )
+
+    return FakeLlm(model=model)
+
+
+def fake_llm_from_env(**kwargs):
+    """
+    Build the fake model from BENCH_MODEL_LATENCY, BENCH_MODEL_CPU_MS and
+    BENCH_MODEL_SCRIPT (a JSON list of tool calls), for webhook processes
+    started by a benchmark. Other `make_fake_llm` arguments are passed on.
+    """
+    return make_fake_llm(
+        latency=float(os.getenv("BENCH_MODEL_LATENCY", "0.05")),
+        cpu_ms=float(os.getenv("BENCH_MODEL_CPU_MS", "0")),
+        script=json.loads(os.getenv("BENCH_MODEL_SCRIPT", "[]")),
+        **kwargs,
+    )
+
+
+def run_mcp_stub(port: int):
+    """Serve a few read-only wweb-mcp tools over SSE until killed."""
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP("whatsapp-stub", host="127.0.0.1", port=port, log_level="WARNING")
+
+    @mcp.tool()
+    async def get_status() -> str:
+        """Get the WhatsApp client status"""
+        return "connected"
+
+    @mcp.tool()
+    async def get_chats(limit: int = 20) -> str:
+        """List recent chats"""
+        return "\n".join(f"Chat {i}: {i}@c.us" for i in range(limit))
+
+    @mcp.tool()
+    async def get_messages(number: str, limit: int = 20) -> str:
+        """Get recent messages of a chat"""
+        return "\n".join(f"[{number}] message {i}" for i in range(limit))
+
+    @mcp.tool()
+    async def search_contacts(query: str) -> str:
+        """Search contacts by name or number"""
+        return f"{query.title()}: 5511999999999@c.us"
+
+    mcp.run(transport="sse")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "mcp":
+        run_mcp_stub(int(sys.argv[2]))
+    else:
+        print(__doc__)
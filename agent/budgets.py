@@ -0,0 +1,225 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-user accounting of model tokens and tool calls over a rolling window
+BUDGETS_ENABLED = os.getenv("BUDGETS_ENABLED", "true").lower() == "true"
+BUDGET_WINDOW_SECONDS = float(os.getenv("BUDGET_WINDOW_SECONDS", "3600"))
+# Above the soft limits a user's turns wait behind everyone else's; above the hard limits they get BUDGET_REPLY. 0 disables a limit
+BUDGET_SOFT_TOKENS = int(os.getenv("BUDGET_SOFT_TOKENS", "200000"))
+BUDGET_HARD_TOKENS = int(os.getenv("BUDGET_HARD_TOKENS", "500000"))
+BUDGET_SOFT_TOOL_CALLS = int(os.getenv("BUDGET_SOFT_TOOL_CALLS", "100"))
+BUDGET_HARD_TOOL_CALLS = int(os.getenv("BUDGET_HARD_TOOL_CALLS", "300"))
+# Admission weight of users over a soft limit, relative to their normal weight
+BUDGET_SOFT_WEIGHT = float(os.getenv("BUDGET_SOFT_WEIGHT", "0.25"))
+# Per-user admission weights, e.g. "5511999999999@c.us=2,5511888888888@c.us=0.5"; everyone else has 1
+BUDGET_USER_WEIGHTS = os.getenv("BUDGET_USER_WEIGHTS", "")
+BUDGET_REPLY = os.getenv(
+    "BUDGET_REPLY",
+    "You've asked me for a lot recently, so I can only handle simple commands such as "
+    "\"list my reminders\" right now. Please try again in about {minutes} min.",
+)
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """
+    Parse BUDGET_USER_WEIGHTS.
+
+    Args:
+        spec (str): Comma-separated `user_id=weight` pairs
+
+    Returns:
+        Dict[str, float]: Weight by user ID
+    """
+    weights = {}
+    for item in spec.split(","):
+        user_id, _, weight = item.strip().rpartition("=")
+        if not user_id:
+            continue
+        try:
+            weights[user_id] = float(weight)
+        except ValueError:
+            logger.warning(f"Ignoring invalid budget weight {item.strip()!r}")
+    return weights
+
+
+class _Usage:
+    """One user's charges within the window, oldest first, with running totals."""
+
+    def __init__(self):
+        self.charges: Deque[Tuple[float, int, int]] = deque()
+        self.tokens = 0
+        self.tool_calls = 0
+
+
+class UserBudgets:
+    """
+    Rolling per-user budgets for model tokens and tool calls.
+
+    `call_agent_async` charges every model response and tool call to the
+    user; charges older than `window` seconds drop out. A user over a soft
+    limit keeps being served, but with a lower admission weight, so their
+    turns wait behind other chats' when all turn slots are busy. A user over
+    a hard limit gets a fixed reply without a model call until enough of
+    their usage has aged out.
+    """
+
+    def __init__(
+        self,
+        window: float = BUDGET_WINDOW_SECONDS,
+        soft_tokens: int = BUDGET_SOFT_TOKENS,
+        hard_tokens: int = BUDGET_HARD_TOKENS,
+        soft_tool_calls: int = BUDGET_SOFT_TOOL_CALLS,
+        hard_tool_calls: int = BUDGET_HARD_TOOL_CALLS,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.window = window
+        self.soft_tokens = soft_tokens
+        self.hard_tokens = hard_tokens
+        self.soft_tool_calls = soft_tool_calls
+        self.hard_tool_calls = hard_tool_calls
+        self.weights = weights if weights is not None else parse_weights(BUDGET_USER_WEIGHTS)
+        # Ordered by last charge, so users who went quiet are dropped from the front
+        self._users: "OrderedDict[str, _Usage]" = OrderedDict()
+        self._tokens_total = 0
+        self._tool_calls_total = 0
+        self._refused_total = 0
+
+    def _expire(self, usage: _Usage, now: float):
+        while usage.charges and usage.charges[0][0] <= now - self.window:
+            _, tokens, tool_calls = usage.charges.popleft()
+            usage.tokens -= tokens
+            usage.tool_calls -= tool_calls
+
+    def _usage(self, user_id: str) -> Optional[_Usage]:
+        usage = self._users.get(user_id)
+        if usage is not None:
+            self._expire(usage, time.time())
+        return usage
+
+    def charge(self, user_id: str, tokens: int = 0, tool_calls: int = 0):
+        """
+        Add model tokens and tool calls to a user's usage.
+
+        Args:
+            user_id (str): The user the turn belongs to
+            tokens (int): Tokens reported by the model
+            tool_calls (int): Number of tool calls requested
+        """
+        if not BUDGETS_ENABLED or not (tokens or tool_calls):
+            return
+        now = time.time()
+        usage = self._users.get(user_id)
+        if usage is None:
+            usage = self._users[user_id] = _Usage()
+        self._users.move_to_end(user_id)
+        usage.charges.append((now, tokens, tool_calls))
+        usage.tokens += tokens
+        usage.tool_calls += tool_calls
+        self._tokens_total += tokens
+        self._tool_calls_total += tool_calls
+        while self._users:
+            oldest_id, oldest = next(iter(self._users.items()))
+            if oldest.charges[-1][0] > now - self.window:
+                break
+            del self._users[oldest_id]
+
+    def usage(self, user_id: str) -> Tuple[int, int]:
+        """A user's (tokens, tool calls) within the window."""
+        usage = self._usage(user_id)
+        return (usage.tokens, usage.tool_calls) if usage is not None else (0, 0)
+
+    @staticmethod
+    def _over(used: int, limit: int) -> bool:
+        return limit > 0 and used >= limit
+
+    def over_soft_limit(self, user_id: str) -> bool:
+        """Whether a user has reached a soft limit."""
+        tokens, tool_calls = self.usage(user_id)
+        return self._over(tokens, self.soft_tokens) or self._over(tool_calls, self.soft_tool_calls)
+
+    def over_hard_limit(self, user_id: str) -> bool:
+        """Whether a user has reached a hard limit."""
+        tokens, tool_calls = self.usage(user_id)
+        return self._over(tokens, self.hard_tokens) or self._over(tool_calls, self.hard_tool_calls)
+
+    def priority(self, user_id: str) -> float:
+        """
+        Admission priority of a user's next turn; lower goes first.
+
+        The share of their budget a user has used recently, divided by their
+        weight, so light users overtake heavy ones when turn slots are scarce.
+        """
+        if not BUDGETS_ENABLED:
+            return 0.0
+        tokens, tool_calls = self.usage(user_id)
+        share = max(
+            tokens / self.hard_tokens if self.hard_tokens > 0 else 0.0,
+            tool_calls / self.hard_tool_calls if self.hard_tool_calls > 0 else 0.0,
+        )
+        weight = self.weights.get(user_id, 1.0)
+        if self.over_soft_limit(user_id):
+            weight *= BUDGET_SOFT_WEIGHT
+        return share / weight if weight > 0 else math.inf
+
+    def retry_after(self, user_id: str) -> float:
+        """Seconds until a user is back under their hard limits."""
+        usage = self._usage(user_id)
+        if usage is None:
+            return 0.0
+        tokens, tool_calls = usage.tokens, usage.tool_calls
+        if not self._over(tokens, self.hard_tokens) and not self._over(tool_calls, self.hard_tool_calls):
+            return 0.0
+        # Find the charge whose expiry brings the user back under the limits
+        for at, charged_tokens, charged_tool_calls in usage.charges:
+            tokens -= charged_tokens
+            tool_calls -= charged_tool_calls
+            if not self._over(tokens, self.hard_tokens) and not self._over(tool_calls, self.hard_tool_calls):
+                return max(at + self.window - time.time(), 0.0)
+        return 0.0
+
+    def admit(self, user_id: str) -> Optional[str]:
+        """
+        Check a user's budget before an agent turn.
+
+        Args:
+            user_id (str): The user the query is from
+
+        Returns:
+            Optional[str]: None if the turn may use the model, otherwise the
+                degraded reply to send instead
+        """
+        if not BUDGETS_ENABLED or not self.over_hard_limit(user_id):
+            return None
+        return self.degraded_reply(user_id)
+
+    def degraded_reply(self, user_id: str) -> str:
+        """The reply sent instead of a model turn to a user over a hard limit."""
+        self._refused_total += 1
+        tokens, tool_calls = self.usage(user_id)
+        logger.warning(f"User {user_id} is over budget ({tokens} tokens, {tool_calls} tool calls); sending the degraded reply")
+        minutes = max(math.ceil(self.retry_after(user_id) / 60), 1)
+        return BUDGET_REPLY.format(minutes=minutes)
+
+    def stats(self) -> Dict[str, Any]:
+        """Usage and limit figures for monitoring."""
+        top = sorted(self._users, key=lambda user_id: self.usage(user_id)[0], reverse=True)[:5]
+        return {
+            "enabled": BUDGETS_ENABLED,
+            "window_seconds": self.window,
+            "users": len(self._users),
+            "soft_limited_users": sum(1 for user_id in list(self._users) if self.over_soft_limit(user_id)),
+            "hard_limited_users": sum(1 for user_id in list(self._users) if self.over_hard_limit(user_id)),
+            "refused_total": self._refused_total,
+            "tokens_total": self._tokens_total,
+            "tool_calls_total": self._tool_calls_total,
+            "top_users": {user_id: dict(zip(("tokens", "tool_calls"), self.usage(user_id))) for user_id in top},
+        }
+
+
+user_budgets = UserBudgets()
@@ -0,0 +1,140 @@
+import inspect
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+from metrics import ROUTED_QUERIES
+from tools.crontab_tool import list_tasks, remove_task
+from tools.time_tool import get_current_time
+from task_scheduler import task_scheduler
+from tool_executor import off_loop
+
+logger = logging.getLogger(__name__)
+
+QUERY_PREFIX = os.getenv("QUERY_PREFIX", "/query ")
+# Answer simple commands (list reminders, current time, cancel a reminder) without the model
+COMMAND_ROUTER_ENABLED = os.getenv("COMMAND_ROUTER_ENABLED", "true").lower() == "true"
+
+router_stats = {
+    "routed_total": 0,
+    "fallthrough_total": 0,
+    "hit_rate": 0.0,
+}
+
+
+@dataclass
+class CommandRule:
+    """
+    A command answered without the model.
+
+    `handler` gets the regex match and the user ID and returns the reply, or
+    None to hand the query to the agent after all. Handlers call the
+    synchronous scheduling tools, so they run on the tool threads.
+    """
+    name: str
+    pattern: re.Pattern
+    handler: Callable[[re.Match, str], Optional[str]]
+
+
+def _context(user_id: str) -> SimpleNamespace:
+    """The part of a ToolContext the scheduling tools read."""
+    return SimpleNamespace(state={"user_id": user_id})
+
+
+def _list_reminders(match: re.Match, user_id: str) -> Optional[str]:
+    result = list_tasks(_context(user_id))
+    if result["status"] != "success":
+        return None
+    if not result["result"]:
+        return "You have no scheduled messages or reminders."
+    return "Your scheduled messages and reminders:\n" + "\n".join(result["result"])
+
+
+def _current_time(match: re.Match, user_id: str) -> Optional[str]:
+    result = get_current_time()
+    if result["status"] != "success":
+        return None
+    now = datetime.strptime(result["result"]["datetime"], "%Y-%m-%d %H:%M:%S")
+    return f"It's {now:%H:%M} on {now:%A, %B} {now.day}, {now.year}."
+
+
+def _cancel_reminder(match: re.Match, user_id: str) -> Optional[str]:
+    identifier = match.group("identifier").strip().strip("'\"")
+    # Only exact IDs or messages are removed here; anything vaguer is left to the model
+    tasks = task_scheduler.find(user_id, identifier)
+    if not tasks:
+        return None
+    rendered = "\n".join(task.render() for task in tasks)
+    result = remove_task(identifier, _context(user_id))
+    if result["status"] != "success" or not result["result"]:
+        return None
+    return f"Removed:\n{rendered}"
+
+
+COMMAND_RULES: List[CommandRule] = [
+    CommandRule(
+        "list_reminders",
+        re.compile(r"(?:list|show)(?: me)?(?: all)?(?: of)? my (?:reminders|tasks|scheduled (?:tasks|messages))"
+                   r"|what are my (?:reminders|scheduled (?:tasks|messages))", re.IGNORECASE),
+        _list_reminders,
+    ),
+    CommandRule(
+        "current_time",
+        re.compile(r"what(?: time is it|'s the time| is the time)(?: now)?|(?:current )?time", re.IGNORECASE),
+        _current_time,
+    ),
+    CommandRule(
+        "cancel_reminder",
+        re.compile(r"(?:cancel|remove|delete) (?:the )?(?:reminder|task|scheduled message) (?P<identifier>.+)", re.IGNORECASE),
+        _cancel_reminder,
+    ),
+]
+
+
+def _normalize(query: str) -> str:
+    """Drop the prefix, extra spaces and trailing punctuation; case is kept for task messages."""
+    if query.startswith(QUERY_PREFIX):
+        query = query[len(QUERY_PREFIX):]
+    return " ".join(query.split()).rstrip("?!. ")
+
+
+async def route_command(query: str, user_id: str) -> Optional[str]:
+    """
+    Answer a query directly if it is one of the simple commands in COMMAND_RULES.
+
+    Args:
+        query (str): The query text, with or without QUERY_PREFIX
+        user_id (str): The user the query is from
+
+    Returns:
+        Optional[str]: The reply, or None if the query should go to the agent
+    """
+    if not COMMAND_ROUTER_ENABLED:
+        return None
+    text = _normalize(query)
+    reply = None
+    for rule in COMMAND_RULES:
+        match = rule.pattern.fullmatch(text)
+        if match is None:
+            continue
+        try:
+            reply = off_loop(rule.handler)(match, user_id)
+            if inspect.isawaitable(reply):
+                reply = await reply
+        except Exception as e:
+            logger.error(f"Command rule {rule.name} failed: {str(e)}")
+        if reply is not None:
+            logger.info(f"Answered query from {user_id} with command rule {rule.name}")
+            ROUTED_QUERIES.labels(rule.name).inc()
+            router_stats["routed_total"] += 1
+            break
+    else:
+        ROUTED_QUERIES.labels("agent").inc()
+        router_stats["fallthrough_total"] += 1
+    total = router_stats["routed_total"] + router_stats["fallthrough_total"]
+    router_stats["hit_rate"] = router_stats["routed_total"] / total if total else 0.0
+    return reply
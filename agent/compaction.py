@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.events import Event
+from google.adk.models import LlmRequest
+from google.adk.sessions import Session
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent turns kept verbatim in the session
+COMPACTION_KEEP_TURNS = int(os.getenv("COMPACTION_KEEP_TURNS", "6"))
+# Estimated history size (tokens) above which old turns are folded into the summary
+COMPACTION_MAX_HISTORY_TOKENS = int(os.getenv("COMPACTION_MAX_HISTORY_TOKENS", "8000"))
+COMPACTION_SUMMARY_MAX_TOKENS = int(os.getenv("COMPACTION_SUMMARY_MAX_TOKENS", "1000"))
+# Tool results larger than this are truncated in the kept turns
+COMPACTION_TOOL_RESULT_MAX_CHARS = int(os.getenv("COMPACTION_TOOL_RESULT_MAX_CHARS", "2000"))
+# Characters of each user query / agent answer carried into the summary
+SUMMARY_LINE_MAX_CHARS = 300
+
+SUMMARY_STATE_KEY = "conversation_summary"
+
+compaction_stats = {
+    "compactions_total": 0,
+    "turns_folded_total": 0,
+    "tool_results_truncated_total": 0,
+    "tokens_saved_total": 0,
+}
+
+
+@dataclass
+class CompactionResult:
+    """Outcome of compacting one session."""
+    tokens_before: int
+    tokens_after: int
+    turns_folded: int
+    tool_results_truncated: int
+
+
+def estimate_tokens(events: List[Event]) -> int:
+    """
+    Roughly estimate how many prompt tokens a list of events costs.
+
+    Args:
+        events (List[Event]): Session events
+
+    Returns:
+        int: Estimated tokens, at about four characters per token
+    """
+    chars = 0
+    for event in events:
+        if event.content:
+            chars += len(event.content.model_dump_json(exclude_none=True))
+    return chars // 4
+
+
+def split_turns(events: List[Event]) -> List[List[Event]]:
+    """
+    Group session events into turns, each starting at a user message.
+
+    Events before the first user message are attached to the first turn.
+
+    Args:
+        events (List[Event]): Session events in order
+
+    Returns:
+        List[List[Event]]: The events of each turn
+    """
+    turns: List[List[Event]] = []
+    has_user = False
+    for event in events:
+        if not turns or (event.author == "user" and has_user):
+            turns.append([])
+            has_user = False
+        has_user = has_user or event.author == "user"
+        turns[-1].append(event)
+    return turns
+
+
+def _first_text(event: Event) -> str:
+    if event.content and event.content.parts:
+        for part in event.content.parts:
+            if part.text:
+                return part.text
+    return ""
+
+
+def _summarize_turn(turn: List[Event]) -> str:
+    """Render a turn as a short "User: ... / Butler: ..." exchange."""
+    query = next((_first_text(e) for e in turn if e.author == "user"), "")
+    answer = next((_first_text(e) for e in reversed(turn) if e.author != "user" and _first_text(e)), "")
+    lines = []
+    if query:
+        lines.append(f"User: {query[:SUMMARY_LINE_MAX_CHARS]}")
+    if answer:
+        lines.append(f"Butler: {answer[:SUMMARY_LINE_MAX_CHARS]}")
+    return "\n".join(lines)
+
+
+def _truncate_tool_results(event: Event, max_chars: int) -> bool:
+    """Truncate oversized function responses in place. Returns True if anything changed."""
+    changed = False
+    if not event.content or not event.content.parts:
+        return changed
+    for part in event.content.parts:
+        response = part.function_response
+        if response is None or response.response is None:
+            continue
+        if response.response.get("truncated"):
+            continue
+        text = json.dumps(response.response, default=str)
+        if len(text) > max_chars:
+            response.response = {"truncated": True, "original_chars": len(text), "preview": text[:max_chars]}
+            changed = True
+    return changed
+
+
+def compact_events(
+    events: List[Event],
+    summary: str,
+    keep_turns: int = COMPACTION_KEEP_TURNS,
+    max_history_tokens: int = COMPACTION_MAX_HISTORY_TOKENS,
+    summary_max_tokens: int = COMPACTION_SUMMARY_MAX_TOKENS,
+    tool_result_max_chars: int = COMPACTION_TOOL_RESULT_MAX_CHARS,
+) -> Optional[tuple]:
+    """
+    Fold old turns into the summary and truncate large tool results.
+
+    Args:
+        events (List[Event]): Session events in order
+        summary (str): The summary stored so far
+        keep_turns (int): Most recent turns to keep verbatim
+        max_history_tokens (int): History size that triggers folding
+        summary_max_tokens (int): Budget for the summary; oldest lines go first
+        tool_result_max_chars (int): Size above which tool results are truncated
+
+    Returns:
+        Optional[tuple]: (kept events, new summary, CompactionResult), or None
+        if the history is already within budget
+    """
+    tokens_before = estimate_tokens(events) + len(summary) // 4
+    turns = split_turns(events)
+
+    folded = 0
+    if len(turns) > keep_turns or estimate_tokens(events) > max_history_tokens:
+        # Always fold down to keep_turns; fold further while still over budget
+        folded = max(len(turns) - keep_turns, 0)
+        while folded < len(turns) - 1 and estimate_tokens([e for t in turns[folded:] for e in t]) > max_history_tokens:
+            folded += 1
+
+    kept = [event for turn in turns[folded:] for event in turn]
+    truncated = sum(_truncate_tool_results(event, tool_result_max_chars) for event in kept)
+    if not folded and not truncated:
+        return None
+
+    if folded:
+        lines = [line for line in summary.split("\n") if line] if summary else []
+        for turn in turns[:folded]:
+            exchange = _summarize_turn(turn)
+            if exchange:
+                lines.extend(exchange.split("\n"))
+        while lines and len("\n".join(lines)) // 4 > summary_max_tokens:
+            lines.pop(0)
+        summary = "\n".join(lines)
+
+    result = CompactionResult(
+        tokens_before=tokens_before,
+        tokens_after=estimate_tokens(kept) + len(summary) // 4,
+        turns_folded=folded,
+        tool_results_truncated=truncated,
+    )
+    return kept, summary, result
+
+
+async def compact_session(session_service, session: Session) -> Optional[CompactionResult]:
+    """
+    Compact a session's history in place and persist the result.
+
+    Args:
+        session_service: A session service providing `rewrite_events`
+        session (Session): The session to compact
+
+    Returns:
+        Optional[CompactionResult]: What was compacted, or None if nothing was
+    """
+    compacted = compact_events(session.events, session.state.get(SUMMARY_STATE_KEY, ""))
+    if compacted is None:
+        return None
+    kept, summary, result = compacted
+    await session_service.rewrite_events(session, kept, {SUMMARY_STATE_KEY: summary})
+
+    saved = max(result.tokens_before - result.tokens_after, 0)
+    compaction_stats["compactions_total"] += 1
+    compaction_stats["turns_folded_total"] += result.turns_folded
+    compaction_stats["tool_results_truncated_total"] += result.tool_results_truncated
+    compaction_stats["tokens_saved_total"] += saved
+    logger.info(
+        f"  [Compaction] Session {session.id}: folded {result.turns_folded} turn(s), "
+        f"truncated {result.tool_results_truncated} tool result(s), "
+        f"~{result.tokens_before} -> ~{result.tokens_after} input tokens (saved ~{saved})"
+    )
+    return result
+
+
+def inject_conversation_summary(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """
+    before_model_callback that puts the stored summary in front of the history.
+
+    The summary is added to the request only, never to the session events,
+    so it is not duplicated turn after turn.
+    """
+    summary = callback_context.state.get(SUMMARY_STATE_KEY)
+    if not summary:
+        return None
+    llm_request.contents.insert(0, types.Content(
+        role="user",
+        parts=[types.Part(text=f"Summary of our earlier conversation:\n{summary}")],
+    ))
+    return None
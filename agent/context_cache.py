@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Keep the system prompt and tool schemas in a Gemini context cache instead of resending them every turn.
+# Off by default: cached content is a billed Gemini resource, charged for as long as it is kept alive
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "false").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# The cache's TTL is extended once it gets this close to expiring
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 120
+# After a failed creation (e.g. a prompt below the model's minimum), wait this long before trying again
+CONTEXT_CACHE_RETRY_SECONDS = 300
+
+# State placeholders in the prompt, e.g. {user_id}
+PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+PLACEHOLDER_NOTE = "Values in braces, such as {user_id}, are given in the session details at the start of the conversation."
+
+context_cache_stats = {
+    "requests_cached_total": 0,
+    "requests_uncached_total": 0,
+    "creates_total": 0,
+    "refreshes_total": 0,
+    "failures_total": 0,
+    "prompt_tokens_total": 0,
+    "cached_tokens_total": 0,
+    "prompt_reloads_total": 0,
+}
+
+
+class PromptFile:
+    """
+    The agent prompt, reread whenever the file changes.
+
+    Used as the agent's instruction provider, it fills in the `{name}`
+    placeholders from session state the way ADK does for a plain string.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime: Optional[int] = None
+        self._text = ""
+
+    def text(self) -> str:
+        """The prompt template, reloaded if the file has changed since the last call."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            logger.error(f"Prompt file not found at {self.path}")
+            raise
+        if mtime != self._mtime:
+            with open(self.path, "r") as f:
+                self._text = f.read().strip()
+            if self._mtime is not None:
+                logger.info(f"Reloaded agent prompt from {self.path}")
+                context_cache_stats["prompt_reloads_total"] += 1
+            self._mtime = mtime
+        return self._text
+
+    def render(self, state: Mapping[str, Any]) -> str:
+        """The prompt with placeholders filled in from `state`; unknown ones are left as they are."""
+        return PLACEHOLDER.sub(
+            lambda match: str(state[match.group(1)]) if match.group(1) in state else match.group(0),
+            self.text(),
+        )
+
+    def instruction(self, readonly_context: ReadonlyContext) -> str:
+        """Instruction provider for the agent."""
+        return self.render(readonly_context.state)
+
+
+@dataclass
+class _CacheEntry:
+    key: str
+    name: str
+    expires_at: float
+
+
+class ContextCache:
+    """
+    Serves the static prefix of every request (system prompt and tool
+    schemas) from a Gemini context cache.
+
+    The prompt template, with its placeholders unfilled, and the tools go
+    into the cache; the per-user values are sent as a short "session
+    details" message instead. A new cache is created when the prompt file,
+    the tool set or the model changes, and the TTL is extended while it is
+    in use. Creating and extending happen in a background task, so a model
+    call never waits on them; until a cache is ready, requests go out
+    uncached.
+    """
+
+    def __init__(self, prompt: PromptFile, ttl: int = CONTEXT_CACHE_TTL_SECONDS, client: Any = None):
+        self.prompt = prompt
+        self.ttl = ttl
+        # A google.genai Client, or a stand-in with the same `aio.caches` methods
+        self.client = client
+        self._entry: Optional[_CacheEntry] = None
+        self._failed_key: Optional[str] = None
+        self._retry_at = 0.0
+        self._maintenance: Optional[asyncio.Task] = None
+
+    def _client(self):
+        if self.client is None:
+            from google.genai import Client
+            self.client = Client()
+        return self.client
+
+    @staticmethod
+    def cache_key(model: str, instruction: str, tools: List[types.Tool]) -> str:
+        """Hash of everything stored in the cache."""
+        payload = json.dumps({
+            "model": model,
+            "instruction": instruction,
+            "tools": [tool.model_dump(mode="json", exclude_none=True) for tool in tools],
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _cache_name(self, key: str, model: str, instruction: str, tools: List[types.Tool]) -> Optional[str]:
+        """
+        Name of a live cache for `key`; None if there is none yet.
+
+        If the cache is missing or close to expiring, `_maintain` is started
+        in the background, unless it is already running or the last attempt
+        for this key failed less than CONTEXT_CACHE_RETRY_SECONDS ago. A cache
+        being extended keeps being used until it is half-way into its margin.
+        """
+        now = time.time()
+        entry = self._entry
+        current = entry is not None and entry.key == key
+        if current and now < entry.expires_at - CONTEXT_CACHE_REFRESH_MARGIN_SECONDS:
+            return entry.name
+        idle = self._maintenance is None or self._maintenance.done()
+        if idle and (key != self._failed_key or now >= self._retry_at):
+            self._maintenance = asyncio.create_task(self._maintain(key, model, instruction, tools))
+        if current and now < entry.expires_at - CONTEXT_CACHE_REFRESH_MARGIN_SECONDS / 2:
+            return entry.name
+        return None
+
+    async def _maintain(self, key: str, model: str, instruction: str, tools: List[types.Tool]):
+        """Extend the cache for `key`, or create it (replacing the old one) if there is none or extending fails."""
+        now = time.time()
+        entry = self._entry
+        if entry is not None and entry.key == key:
+            try:
+                await self._client().aio.caches.update(
+                    name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+                entry.expires_at = now + self.ttl
+                context_cache_stats["refreshes_total"] += 1
+                return
+            except Exception as e:
+                logger.warning(f"Could not extend context cache {entry.name}: {type(e).__name__}: {e}")
+        if PLACEHOLDER.search(instruction):
+            instruction += "\n\n" + PLACEHOLDER_NOTE
+        try:
+            cache = await self._client().aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+                display_name="whatsapp-butler",
+                system_instruction=instruction,
+                tools=tools or None,
+                ttl=f"{self.ttl}s",
+            ))
+        except Exception as e:
+            logger.warning(f"Could not create context cache for {model}: {type(e).__name__}: {e}")
+            context_cache_stats["failures_total"] += 1
+            self._failed_key = key
+            self._retry_at = time.time() + CONTEXT_CACHE_RETRY_SECONDS
+            return
+        old, self._entry = self._entry, _CacheEntry(key, cache.name, now + self.ttl)
+        context_cache_stats["creates_total"] += 1
+        logger.info(f"Created context cache {cache.name} for {model}")
+        if old is not None:
+            await self._delete(old.name)
+
+    async def _delete(self, name: str):
+        """Drop a superseded cache; it would expire on its own anyway."""
+        try:
+            await self._client().aio.caches.delete(name=name)
+        except Exception as e:
+            logger.warning(f"Could not delete context cache {name}: {type(e).__name__}: {e}")
+
+    async def apply(self, callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+        """
+        before_model_callback pointing a Gemini request at the cached prefix.
+
+        The cached instruction is the request's own, with the rendered
+        prompt swapped back for its template. Requests whose instruction
+        does not contain the rendered prompt, or that go to another
+        provider, are sent unchanged.
+        """
+        model = llm_request.model or ""
+        config = llm_request.config
+        if not CONTEXT_CACHE_ENABLED or not model.startswith("gemini") or config is None:
+            return None
+        state = callback_context.state
+        rendered = self.prompt.render(state)
+        if not isinstance(config.system_instruction, str) or rendered not in config.system_instruction:
+            context_cache_stats["requests_uncached_total"] += 1
+            return None
+        template = self.prompt.text()
+        # ADK adds the agent's name and description around the prompt; those are static too
+        static = config.system_instruction.replace(rendered, template)
+        tools = list(config.tools or [])
+        name = self._cache_name(self.cache_key(model, static, tools), model, static, tools)
+        if name is None:
+            context_cache_stats["requests_uncached_total"] += 1
+            return None
+
+        config.cached_content = name
+        config.system_instruction = None
+        config.tools = None
+        config.tool_config = None
+        details = [f"{placeholder}: {state[placeholder]}"
+                   for placeholder in dict.fromkeys(PLACEHOLDER.findall(template)) if placeholder in state]
+        if details:
+            llm_request.contents.insert(0, types.Content(
+                role="user",
+                parts=[types.Part(text="Session details:\n" + "\n".join(details))],
+            ))
+        context_cache_stats["requests_cached_total"] += 1
+        return None
+
+    def record_usage(self, callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+        """after_model_callback counting prompt tokens and the share served from the cache."""
+        usage = llm_response.usage_metadata
+        if llm_response.partial or usage is None:
+            return None
+        context_cache_stats["prompt_tokens_total"] += usage.prompt_token_count or 0
+        context_cache_stats["cached_tokens_total"] += usage.cached_content_token_count or 0
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache use and token figures for monitoring."""
+        entry = self._entry
+        prompt_tokens = context_cache_stats["prompt_tokens_total"]
+        return {
+            "enabled": CONTEXT_CACHE_ENABLED,
+            **context_cache_stats,
+            "cached_token_ratio": context_cache_stats["cached_tokens_total"] / prompt_tokens if prompt_tokens else 0.0,
+            "expires_in_seconds": max(entry.expires_at - time.time(), 0) if entry is not None else None,
+        }
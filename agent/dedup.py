@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Deliveries of the same message within this window are treated as retries
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+
+# Payload fields that may carry the WhatsApp message ID
+MESSAGE_ID_FIELDS = ("id", "messageId", "message_id")
+
+
+def idempotency_key(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Build the idempotency key of a webhook payload.
+
+    The message ID is used when the payload has one; otherwise the key is a
+    hash of sender, text and timestamp. Without either, a redelivery cannot
+    be told apart from the user sending the same text again, so there is no
+    key and the message is never deduplicated.
+
+    Args:
+        data (Dict[str, Any]): The webhook payload
+
+    Returns:
+        Optional[str]: The idempotency key, or None if the payload has
+            neither a message ID nor a timestamp
+    """
+    for field in MESSAGE_ID_FIELDS:
+        message_id = data.get(field)
+        if isinstance(message_id, dict):
+            message_id = message_id.get("_serialized") or message_id.get("id")
+        if message_id:
+            return f"id:{message_id}"
+    if data.get("timestamp") in (None, ""):
+        return None
+    fingerprint = json.dumps([data.get("from"), data.get("message"), data.get("timestamp")], default=str)
+    return "sha256:" + hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+class IdempotencyCache:
+    """
+    Bounded, time-windowed record of the webhook responses already given.
+
+    Entries expire after `window` seconds and the oldest keys are evicted
+    beyond `max_entries`, so memory stays flat however many messages arrive.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW_SECONDS, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._duplicates_total = 0
+        self._evictions_total = 0
+
+    def get(self, key: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        Return the response recorded for a key and count the duplicate.
+
+        Args:
+            key (str): The idempotency key
+
+        Returns:
+            Optional[Tuple[int, Dict[str, Any]]]: (status code, body), or None if
+            the key was not seen within the window
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, status_code, content = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._duplicates_total += 1
+        return status_code, content
+
+    def put(self, key: str, status_code: int, content: Dict[str, Any]):
+        """
+        Record the response given for a key.
+
+        Args:
+            key (str): The idempotency key
+            status_code (int): HTTP status returned
+            content (Dict[str, Any]): Response body returned
+        """
+        now = time.monotonic()
+        self._entries.pop(key, None)
+        self._entries[key] = (now + self.window, status_code, content)
+        # The window runs from the first delivery, so entries are in expiry order
+        while self._entries:
+            oldest_key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at >= now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_key]
+            if expires_at >= now:
+                self._evictions_total += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Duplicate counters for monitoring."""
+        return {
+            "entries": len(self._entries),
+            "duplicates_suppressed_total": self._duplicates_total,
+            "evictions_total": self._evictions_total,
+        }
@@ -0,0 +1,200 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
+import asyncio
+import logging
+import os
+import sys
+
+import httpx
+
+from ingest import chat_id_from_body
+from sharding import WEBHOOK_PROCESSES, process_for_chat
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+# Webhook process i listens on WORKER_BASE_PORT + i, on localhost only
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+# Seconds before a crashed webhook process is started again
+WORKER_RESTART_SECONDS = float(os.getenv("WORKER_RESTART_SECONDS", "2"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "30"))
+
+WEBHOOK_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "webhook_server.py")
+
+
+class WorkerPool:
+    """
+    Runs the webhook processes behind the dispatcher and restarts them if they exit.
+
+    Each process gets its index, its own port and its own job queue file;
+    sessions, scheduled tasks and the message index stay in the shared
+    SQLite files, which is safe because every chat has exactly one owner.
+    """
+
+    def __init__(self, processes: int = WEBHOOK_PROCESSES, base_port: int = WORKER_BASE_PORT,
+                 command: Optional[List[str]] = None):
+        self.processes = processes
+        self.base_port = base_port
+        self.command = command or [sys.executable, WEBHOOK_SERVER]
+        self.urls = [f"http://127.0.0.1:{base_port + i}" for i in range(processes)]
+        self._procs: List[Optional[asyncio.subprocess.Process]] = [None] * processes
+        self._watchers: List[asyncio.Task] = []
+        self._restarts = 0
+        self._stopping = False
+
+    def _env(self, index: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "WEBHOOK_PORT": str(self.base_port + index),
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PROCESSES": str(self.processes),
+            "WEBHOOK_PROCESS_INDEX": str(index),
+            "QUEUE_DB_PATH": os.path.join(DATA_DIR, f"queue-{index}.db"),
+        })
+        return env
+
+    def start(self):
+        """Start every webhook process and watch it."""
+        self._stopping = False
+        self._watchers = [asyncio.create_task(self._watch(i)) for i in range(self.processes)]
+
+    async def _watch(self, index: int):
+        """Run one webhook process, starting it again whenever it exits."""
+        while not self._stopping:
+            proc = await asyncio.create_subprocess_exec(
+                *self.command, env=self._env(index), cwd=os.path.dirname(WEBHOOK_SERVER))
+            self._procs[index] = proc
+            logger.info(f"Started webhook process {index} (pid {proc.pid}) on port {self.base_port + index}")
+            code = await proc.wait()
+            if self._stopping:
+                return
+            self._restarts += 1
+            logger.error(f"Webhook process {index} exited with code {code}; restarting in {WORKER_RESTART_SECONDS}s")
+            await asyncio.sleep(WORKER_RESTART_SECONDS)
+
+    async def stop(self):
+        """Ask every webhook process to shut down and wait for it."""
+        self._stopping = True
+        for proc in self._procs:
+            if proc is not None and proc.returncode is None:
+                proc.terminate()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        for proc in self._procs:
+            if proc is not None and proc.returncode is None:
+                await proc.wait()
+
+    def url_for(self, chat_id: Any) -> str:
+        """Base URL of the process that owns a chat."""
+        return self.urls[process_for_chat(chat_id, self.processes)]
+
+    def stats(self) -> Dict[str, Any]:
+        """Process IDs and restart count for monitoring."""
+        return {
+            "processes": self.processes,
+            "pids": [proc.pid if proc is not None else None for proc in self._procs],
+            "restarts_total": self._restarts,
+        }
+
+
+def create_app(pool: WorkerPool) -> FastAPI:
+    """
+    Build the dispatcher app in front of a worker pool.
+
+    Args:
+        pool (WorkerPool): The webhook processes to route to
+
+    Returns:
+        FastAPI: The dispatcher application
+    """
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        pool.start()
+        app.state.client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=100 * pool.processes, max_keepalive_connections=20 * pool.processes),
+        )
+        yield
+        await app.state.client.aclose()
+        await pool.stop()
+
+    app = FastAPI(title="WhatsApp Butler Dispatcher", lifespan=lifespan)
+    forwarded = [0] * pool.processes
+
+    async def get_json(url: str) -> Any:
+        try:
+            response = await app.state.client.get(url)
+            return response.json()
+        except Exception as e:
+            return {"status": "unreachable", "error": str(e)}
+
+    @app.post("/webhook")
+    async def webhook(request: Request):
+        """
+        Forward a webhook to the process that owns its chat, and relay its response
+        """
+        body = await request.body()
+        # Only the chat ID is needed, so the body is not decoded here; a bad payload goes to
+        # process 0, which reports it
+        chat_id = chat_id_from_body(body)
+        index = process_for_chat(chat_id, pool.processes)
+        forwarded[index] += 1
+        try:
+            response = await app.state.client.post(
+                f"{pool.urls[index]}/webhook", content=body, headers={"content-type": "application/json"})
+        except httpx.HTTPError as e:
+            logger.error(f"Webhook process {index} unreachable: {str(e)}")
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+                content={"status": "unavailable", "error": str(e)}
+            )
+        headers = {"Retry-After": response.headers["retry-after"]} if "retry-after" in response.headers else None
+        return Response(content=response.content, status_code=response.status_code,
+                        media_type="application/json", headers=headers)
+
+    @app.get("/health")
+    async def health_check():
+        """Health check endpoint"""
+        return {"status": "healthy"}
+
+    @app.get("/ready")
+    async def readiness_check():
+        """Ready once every webhook process is ready"""
+        results = await asyncio.gather(*(app.state.client.get(f"{url}/ready") for url in pool.urls),
+                                       return_exceptions=True)
+        ready = all(not isinstance(r, Exception) and r.status_code == 200 for r in results)
+        return JSONResponse(
+            status_code=200 if ready else 503,
+            content={"status": "ready" if ready else "starting",
+                     "processes": [getattr(r, "status_code", None) == 200 for r in results]}
+        )
+
+    @app.get("/stats")
+    async def stats():
+        """Dispatcher figures and the /stats of every webhook process"""
+        workers = await asyncio.gather(*(get_json(f"{url}/stats") for url in pool.urls))
+        return {
+            "dispatcher": {**pool.stats(), "forwarded_total": forwarded},
+            "workers": workers,
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.getenv("WEBHOOK_PORT", "8000"))
+    uvicorn.run(
+        create_app(WorkerPool()),
+        host="0.0.0.0",
+        port=port,
+        log_level="info"
+    )
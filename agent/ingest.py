@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+QUERY_PREFIX = os.getenv("QUERY_PREFIX", "/query ")
+# One in this many dropped (non-query) webhooks is logged at INFO; 0 disables it
+WEBHOOK_DROP_LOG_SAMPLE = int(os.getenv("WEBHOOK_DROP_LOG_SAMPLE", "100"))
+# Append every raw webhook body to this JSON lines file, for replay with bench/load_bench.py
+WEBHOOK_RECORD_PATH = os.getenv("WEBHOOK_RECORD_PATH", "")
+
+# The prefix as it can appear inside a JSON string ("/" may be escaped as "\/")
+_PREFIX_BYTES = tuple({
+    json.dumps(QUERY_PREFIX)[1:-1].encode(),
+    json.dumps(QUERY_PREFIX)[1:-1].replace("/", "\\/").encode(),
+})
+
+# The first "from" string in the body; webhook payloads are flat, so that is the sender's chat
+_FROM_FIELD = re.compile(rb'"from"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+_record_file = None
+
+ingest_stats = {
+    "received_total": 0,
+    "decoded_total": 0,
+    "dropped_total": 0,
+    "dropped_undecoded_total": 0,
+}
+
+
+def loads(body: bytes) -> Dict[str, Any]:
+    """
+    Decode a JSON request body, with orjson when it is installed.
+
+    Args:
+        body (bytes): The raw request body
+
+    Returns:
+        Dict[str, Any]: The decoded payload
+    """
+    ingest_stats["decoded_total"] += 1
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def might_be_query(body: bytes) -> bool:
+    """
+    Cheap pre-check on the raw body for the query prefix.
+
+    A False result is definitive: the payload cannot hold an agent query.
+    A True result still has to be confirmed on the decoded payload.
+
+    Args:
+        body (bytes): The raw request body
+
+    Returns:
+        bool: Whether the body contains the query prefix anywhere
+    """
+    return any(prefix in body for prefix in _PREFIX_BYTES)
+
+
+def chat_id_from_body(body: bytes) -> str:
+    """
+    Read the chat ID ("from") off the raw body without decoding the rest.
+
+    Args:
+        body (bytes): The raw request body
+
+    Returns:
+        str: The chat ID, or "" if there is none
+    """
+    match = _FROM_FIELD.search(body)
+    if match is None:
+        return ""
+    value = match.group(1)
+    if b"\\" not in value:
+        return value.decode("utf-8", "replace")
+    try:
+        return json.loads(b'"' + value + b'"')
+    except ValueError:
+        return ""
+
+
+def log_dropped(body: bytes, decoded: bool = True):
+    """
+    Count and log a webhook that is not an agent query.
+
+    Only one in WEBHOOK_DROP_LOG_SAMPLE is logged at INFO, and the message is
+    formatted by the logging module only if it is actually emitted.
+
+    Args:
+        body (bytes): The raw request body
+        decoded (bool): Whether the body had to be decoded before dropping it
+    """
+    ingest_stats["dropped_total"] += 1
+    if not decoded:
+        ingest_stats["dropped_undecoded_total"] += 1
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Dropped webhook: %s", body)
+    elif WEBHOOK_DROP_LOG_SAMPLE and (ingest_stats["dropped_total"] - 1) % WEBHOOK_DROP_LOG_SAMPLE == 0:
+        logger.info("Dropped %d non-query webhook(s) so far; latest is %d bytes",
+                    ingest_stats["dropped_total"], len(body))
+
+
+def record_body(body: bytes):
+    """
+    Append a raw webhook body, with its arrival time, to WEBHOOK_RECORD_PATH.
+
+    Args:
+        body (bytes): The raw request body
+    """
+    global _record_file
+    if _record_file is None:
+        _record_file = open(WEBHOOK_RECORD_PATH, "a", encoding="utf-8")
+    _record_file.write(json.dumps({"at": time.time(), "body": body.decode("utf-8", "replace")}) + "\n")
+    _record_file.flush()
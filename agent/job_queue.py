@@ -0,0 +1,312 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", os.path.join(DATA_DIR, "queue.db"))
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", "1000"))
+# Jobs that were already started this many times are dropped on recovery
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+# Maximum queue writes committed in one transaction
+QUEUE_WRITE_BATCH = int(os.getenv("QUEUE_WRITE_BATCH", "200"))
+
+# A queued write: statement, parameters, and the future waiting for its commit (None if nobody waits)
+QueuedWrite = Tuple[str, tuple, Optional[asyncio.Future]]
+
+
+class QueueFull(Exception):
+    """Raised when a job is offered to a queue that is already at capacity."""
+
+
+@dataclass
+class Job:
+    """A unit of work waiting in (or taken from) the job queue."""
+    id: int
+    payload: Dict[str, Any]
+    enqueued_at: float
+    attempts: int = 0
+
+
+class JobQueue:
+    """
+    Bounded FIFO queue of agent jobs backed by a SQLite file.
+
+    Every job is written to disk before it is handed to a worker, and only
+    deleted once the worker reports it as done, so jobs that were queued or
+    running when the process died are picked up again on the next start.
+
+    The database is only touched from a writer task that commits queued
+    statements in batches on a thread, so a slow disk never blocks the event
+    loop. `put` waits for its job's commit; updates and deletes are written
+    behind.
+    """
+
+    def __init__(self, path: str = QUEUE_DB_PATH, maxsize: int = QUEUE_MAXSIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self._conn: Optional[sqlite3.Connection] = None
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._writes: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        # Jobs accepted by `put` whose insert is not committed yet
+        self._putting = 0
+        self._completions: Dict[int, asyncio.Future] = {}
+        self._taken: Dict[int, Job] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._released_total = 0
+        self._enqueued_total = 0
+        self._completed_total = 0
+        self._failed_total = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    def open(self) -> int:
+        """
+        Open the database and reload jobs left over from a previous run.
+
+        Returns:
+            int: Number of jobs recovered from disk
+        """
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL,"
+            " enqueued_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        rows = self._conn.execute(
+            "SELECT id, payload, enqueued_at, attempts FROM jobs ORDER BY id"
+        ).fetchall()
+        recovered = 0
+        for job_id, payload, enqueued_at, attempts in rows:
+            if attempts >= QUEUE_MAX_ATTEMPTS:
+                logger.warning(f"Dropping job {job_id} after {attempts} attempt(s)")
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                continue
+            self._ready.put_nowait(Job(job_id, json.loads(payload), enqueued_at, attempts))
+            recovered += 1
+        if recovered:
+            logger.info(f"Recovered {recovered} pending job(s) from {self.path}")
+        return recovered
+
+    async def close(self):
+        """Write everything queued and close the database. Jobs not yet marked done stay on disk."""
+        if self._writes is not None:
+            await self._writes.join()
+        if self._writer is not None:
+            # Idle now, waiting for the next write
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        self._writes = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def depth(self) -> int:
+        """Number of jobs waiting or running."""
+        return self._ready.qsize() + self._in_flight + self._putting
+
+    def _write(self, sql: str, params: tuple, wait: bool = False) -> Optional[asyncio.Future]:
+        """
+        Queue a statement for the writer, starting it if needed.
+
+        Args:
+            sql (str): The statement
+            params (tuple): Its parameters
+            wait (bool): Whether the caller waits for the commit
+
+        Returns:
+            Optional[asyncio.Future]: With `wait`, a future resolving to the
+                statement's lastrowid once committed
+        """
+        if self._writes is None:
+            self._writes = asyncio.Queue()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_loop())
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._writes.put_nowait((sql, params, future))
+        return future
+
+    async def _write_loop(self):
+        """Commit queued writes in batches until cancelled."""
+        while True:
+            batch: List[QueuedWrite] = [await self._writes.get()]
+            while len(batch) < QUEUE_WRITE_BATCH and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            try:
+                row_ids = await asyncio.to_thread(self._apply_writes, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} job queue update(s): {str(e)}")
+                for _, _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, _, future), row_id in zip(batch, row_ids):
+                    if future is not None and not future.done():
+                        future.set_result(row_id)
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _apply_writes(self, batch: List[QueuedWrite]) -> List[int]:
+        """Apply a batch of queued writes in one transaction."""
+        with self._conn:
+            self._conn.execute("BEGIN")
+            return [self._conn.execute(sql, params).lastrowid for sql, params, _ in batch]
+
+    async def put(self, payload: Dict[str, Any]) -> int:
+        """
+        Persist a job and make it available to workers.
+
+        Args:
+            payload (Dict[str, Any]): JSON-serialisable job data
+
+        Returns:
+            int: The job ID
+
+        Raises:
+            QueueFull: If the queue already holds `maxsize` jobs
+        """
+        if self.depth() >= self.maxsize:
+            raise QueueFull(f"Job queue is full ({self.maxsize} jobs)")
+        now = time.time()
+        self._putting += 1
+        try:
+            job_id = await self._write(
+                "INSERT INTO jobs (payload, enqueued_at) VALUES (?, ?)",
+                (json.dumps(payload), now),
+                wait=True,
+            )
+        finally:
+            self._putting -= 1
+        job = Job(job_id, payload, now)
+        self._ready.put_nowait(job)
+        self._enqueued_total += 1
+        return job.id
+
+    async def wait(self, job_id: int) -> bool:
+        """
+        Wait until a job put in this process is marked done.
+
+        Args:
+            job_id (int): The ID returned by `put`
+
+        Returns:
+            bool: Whether the job failed
+        """
+        future = self._completions.get(job_id)
+        if future is None:
+            future = self._completions[job_id] = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._completions.pop(job_id, None)
+
+    async def get(self) -> Job:
+        """Wait for the next job and mark it as running."""
+        job = await self._ready.get()
+        self._in_flight += 1
+        self._taken[job.id] = job
+        self._idle.clear()
+        job.attempts += 1
+        self._write("UPDATE jobs SET attempts = ? WHERE id = ?", (job.attempts, job.id))
+        wait = time.time() - job.enqueued_at
+        self._wait_seconds_total += wait
+        self._wait_seconds_max = max(self._wait_seconds_max, wait)
+        return job
+
+    def done(self, job: Job, failed: bool = False):
+        """
+        Remove a finished job from the queue.
+
+        Args:
+            job (Job): The job returned by `get`
+            failed (bool): Whether the job ended with an error
+        """
+        self._write("DELETE FROM jobs WHERE id = ?", (job.id,))
+        self._finish(job)
+        if failed:
+            self._failed_total += 1
+        else:
+            self._completed_total += 1
+        future = self._completions.get(job.id)
+        if future is not None and not future.done():
+            future.set_result(failed)
+
+    def release(self, job: Job):
+        """
+        Put a job that was taken but not finished back on disk, to be run on
+        the next start as if it had never been started.
+
+        Args:
+            job (Job): The job returned by `get`
+        """
+        job.attempts -= 1
+        self._write("UPDATE jobs SET attempts = ? WHERE id = ?", (job.attempts, job.id))
+        self._released_total += 1
+        self._finish(job)
+
+    def release_all(self) -> int:
+        """
+        Release every job still taken, e.g. turns cut off by a shutdown.
+
+        Returns:
+            int: Number of jobs released
+        """
+        taken = list(self._taken.values())
+        for job in taken:
+            self.release(job)
+        return len(taken)
+
+    def _finish(self, job: Job):
+        self._taken.pop(job.id, None)
+        self._in_flight -= 1
+        if not self._in_flight:
+            self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """
+        Wait until no job is running.
+
+        Args:
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: Whether every taken job was done or released in time
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return not self._in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and wait-time figures for monitoring."""
+        taken = self._completed_total + self._failed_total + self._in_flight
+        return {
+            "depth": self.depth(),
+            "waiting": self._ready.qsize(),
+            "in_flight": self._in_flight,
+            "maxsize": self.maxsize,
+            "enqueued_total": self._enqueued_total,
+            "completed_total": self._completed_total,
+            "failed_total": self._failed_total,
+            "released_total": self._released_total,
+            "wait_seconds_avg": self._wait_seconds_total / taken if taken else 0.0,
+            "wait_seconds_max": self._wait_seconds_max,
+        }
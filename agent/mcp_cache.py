@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.base_toolset import BaseToolset
+from google.adk.tools.tool_context import ToolContext
+
+logger = logging.getLogger(__name__)
+
+MCP_CACHE_MAX_ENTRIES = int(os.getenv("MCP_CACHE_MAX_ENTRIES", "500"))
+MCP_CACHE_MAX_BYTES = int(os.getenv("MCP_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Default TTL in seconds for each read-only wweb-mcp tool. Tools not listed
+# here are never cached. Override with MCP_CACHE_TTLS="get_messages=60,get_chats=0".
+DEFAULT_TOOL_TTLS = {
+    "get_status": 30,
+    "search_contacts": 600,
+    "get_chats": 60,
+    "get_messages": 120,
+    "get_groups": 300,
+    "search_groups": 300,
+    "get_group_by_id": 300,
+    "get_group_messages": 120,
+}
+# Cached results of these tools change whenever any chat gets a message
+ANY_MESSAGE_TOOLS = {"get_chats"}
+# Tools that change WhatsApp state; they are never cached and invalidate what they touch
+WRITE_TOOLS = {"send_message", "send_group_message", "create_group", "add_participants_to_group"}
+# Listing tools made stale by group membership changes
+GROUP_LIST_TOOLS = {"get_groups", "search_groups", "get_group_by_id"}
+GROUP_WRITE_TOOLS = {"create_group", "add_participants_to_group"}
+# Argument names that carry a chat ID
+CHAT_ARGS = ("number", "groupId", "chatId")
+
+TOOL_NAME_PREFIX = "mcp_whatsapp_"
+
+CacheKey = Tuple[str, str]
+
+
+def parse_tool_ttls(spec: str) -> Dict[str, float]:
+    """
+    Parse a "tool=seconds,tool=seconds" override string.
+
+    Args:
+        spec (str): The override string
+
+    Returns:
+        Dict[str, float]: TTLs by tool name
+    """
+    ttls = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            ttls[name.strip()] = float(seconds)
+    return ttls
+
+
+TOOL_TTLS = {**DEFAULT_TOOL_TTLS, **parse_tool_ttls(os.getenv("MCP_CACHE_TTLS", ""))}
+
+
+def base_tool_name(name: str) -> str:
+    """Strip the client-side prefix some MCP setups add to wweb-mcp tool names."""
+    return name[len(TOOL_NAME_PREFIX):] if name.startswith(TOOL_NAME_PREFIX) else name
+
+
+def normalize_chat_id(chat_id: Any) -> str:
+    """
+    Reduce the different spellings of a chat ID to one form.
+
+    "5511999999999@c.us", "+55 11 99999-9999" and "5511999999999" all map to
+    the same key, as do "12036304@g.us" and "12036304".
+
+    Args:
+        chat_id (Any): A phone number, contact ID or group ID
+
+    Returns:
+        str: The normalized ID, or "" if there is none
+    """
+    if not chat_id:
+        return ""
+    text = str(chat_id).split("@", 1)[0]
+    if re.fullmatch(r"[\d\s()+-]+", text):
+        return re.sub(r"\D", "", text)
+    return text
+
+
+def _result_size(result: Any) -> int:
+    """Approximate memory held by a cached result."""
+    if hasattr(result, "model_dump_json"):
+        return len(result.model_dump_json())
+    return len(str(result))
+
+
+class ToolResultCache:
+    """
+    Bounded TTL + LRU cache of MCP tool results, invalidated per chat.
+
+    Entries are bounded by count and by approximate size; the least recently
+    used entries are evicted first. Each entry remembers which chats it
+    depends on so a new message in a chat drops only that chat's results.
+    """
+
+    def __init__(self, max_entries: int = MCP_CACHE_MAX_ENTRIES, max_bytes: int = MCP_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[float, int, Any, Set[str]]]" = OrderedDict()
+        self._by_chat: Dict[str, Set[CacheKey]] = {}
+        self._any_message: Set[CacheKey] = set()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(tool_name: str, args: Dict[str, Any]) -> CacheKey:
+        """Build the cache key for a tool call."""
+        return base_tool_name(tool_name), json.dumps(args or {}, sort_keys=True, default=str)
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        """Return a fresh cached result, or None."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return entry[2]
+
+    def put(self, key: CacheKey, result: Any, ttl: float, chat_ids: Set[str]):
+        """
+        Store a result and evict old entries beyond the bounds.
+
+        Args:
+            key (CacheKey): The cache key from `key`
+            result (Any): The tool result
+            ttl (float): Seconds the result stays fresh
+            chat_ids (Set[str]): Normalized chats the result depends on
+        """
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, size, result, chat_ids)
+        self._bytes += size
+        for chat_id in chat_ids:
+            self._by_chat.setdefault(chat_id, set()).add(key)
+        if key[0] in ANY_MESSAGE_TOOLS:
+            self._any_message.add(key)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: CacheKey):
+        """Drop an entry and its index references."""
+        _, size, _, chat_ids = self._entries.pop(key)
+        self._bytes -= size
+        for chat_id in chat_ids:
+            keys = self._by_chat.get(chat_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_chat[chat_id]
+        self._any_message.discard(key)
+
+    def invalidate_chat(self, chat_id: Any):
+        """
+        Drop cached results that a new message in this chat makes stale.
+
+        Args:
+            chat_id (Any): The chat that changed, in any spelling
+        """
+        keys = set(self._any_message)
+        normalized = normalize_chat_id(chat_id)
+        if normalized:
+            keys |= self._by_chat.get(normalized, set())
+        for key in keys:
+            if key in self._entries:
+                self._remove(key)
+                self._invalidations += 1
+
+    def invalidate_tools(self, tool_names: Set[str]):
+        """Drop every cached result of the given tools."""
+        for key in [key for key in self._entries if key[0] in tool_names]:
+            self._remove(key)
+            self._invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters for monitoring."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+        }
+
+
+tool_result_cache = ToolResultCache()
+
+
+class CachedMCPTool(BaseTool):
+    """Wraps an MCP tool, serving read-only calls from the tool result cache."""
+
+    def __init__(self, inner: BaseTool, cache: ToolResultCache):
+        super().__init__(name=inner.name, description=inner.description, is_long_running=inner.is_long_running)
+        self._inner = inner
+        self._cache = cache
+
+    def _get_declaration(self):
+        return self._inner._get_declaration()
+
+    async def run_async(self, *, args: Dict[str, Any], tool_context: ToolContext) -> Any:
+        name = base_tool_name(self.name)
+        chat_ids = {normalize_chat_id(args.get(arg)) for arg in CHAT_ARGS if args.get(arg)}
+        ttl = TOOL_TTLS.get(name, 0)
+
+        if ttl <= 0:
+            result = await self._inner.run_async(args=args, tool_context=tool_context)
+            if name in WRITE_TOOLS:
+                for chat_id in chat_ids or {""}:
+                    self._cache.invalidate_chat(chat_id)
+            if name in GROUP_WRITE_TOOLS:
+                self._cache.invalidate_tools(GROUP_LIST_TOOLS)
+            return result
+
+        key = self._cache.key(name, args)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        result = await self._inner.run_async(args=args, tool_context=tool_context)
+        if not getattr(result, "isError", False):
+            self._cache.put(key, result, ttl, chat_ids)
+        return result
+
+
+class CachingMCPToolset(BaseToolset):
+    """Toolset wrapper whose tools go through the shared tool result cache."""
+
+    def __init__(self, inner: BaseToolset, cache: ToolResultCache = tool_result_cache):
+        self._inner = inner
+        self._cache = cache
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> List[BaseTool]:
+        tools = await self._inner.get_tools(readonly_context)
+        return [CachedMCPTool(tool, self._cache) for tool in tools]
+
+    async def close(self) -> None:
+        await self._inner.close()
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.base_toolset import BaseToolset
+from google.adk.tools.tool_context import ToolContext
+import anyio
+import httpx
+from mcp.shared import exceptions as mcp_exceptions
+
+from mcp_cache import DEFAULT_TOOL_TTLS, base_tool_name
+
+logger = logging.getLogger(__name__)
+
+MCP_RECONNECT_INITIAL_SECONDS = float(os.getenv("MCP_RECONNECT_INITIAL_SECONDS", "1"))
+MCP_RECONNECT_MAX_SECONDS = float(os.getenv("MCP_RECONNECT_MAX_SECONDS", "60"))
+# How long an agent turn waits for the connection before running without WhatsApp tools
+MCP_READY_WAIT_SECONDS = float(os.getenv("MCP_READY_WAIT_SECONDS", "5"))
+
+# JSON-RPC errors mean the server answered; they do not call for a reconnect
+PROTOCOL_ERRORS = tuple(
+    getattr(mcp_exceptions, name) for name in ("McpError", "MCPError") if hasattr(mcp_exceptions, name)
+)
+# Errors raised before the request could reach the server: the session's streams were
+# already closed, or the connection could not be opened
+NOT_SENT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, httpx.ConnectError)
+# Read-only wweb-mcp tools, which are safe to run again whatever happened to the first call
+RETRY_SAFE_TOOLS = set(DEFAULT_TOOL_TTLS)
+
+
+class ResilientMCPTool(BaseTool):
+    """
+    Wraps an MCP tool; a call that fails on a dead connection is retried once after reconnecting.
+
+    Only read-only tools, and calls that failed before the request went
+    out, are retried: a write such as send_message that timed out may
+    already have been carried out, and running it again would repeat it.
+    """
+
+    def __init__(self, inner: BaseTool, manager: "ManagedMCPToolset", generation: int):
+        super().__init__(name=inner.name, description=inner.description, is_long_running=inner.is_long_running)
+        self._inner = inner
+        self._manager = manager
+        self._generation = generation
+        # MCPTool.run_async reopens a closed session from inside the calling
+        # task, which ties the new connection to the agent turn; call the
+        # undecorated method and let the manager reconnect instead
+        self._call = getattr(type(inner).run_async, "__wrapped__", None)
+
+    def _get_declaration(self):
+        return self._inner._get_declaration()
+
+    async def _run_inner(self, args: Dict[str, Any], tool_context: ToolContext) -> Any:
+        if self._call is not None:
+            return await self._call(self._inner, args=args, tool_context=tool_context)
+        return await self._inner.run_async(args=args, tool_context=tool_context)
+
+    async def run_async(self, *, args: Dict[str, Any], tool_context: ToolContext) -> Any:
+        try:
+            return await self._run_inner(args, tool_context)
+        except PROTOCOL_ERRORS:
+            raise
+        except Exception as e:
+            self._manager.mark_broken(e, self._generation)
+            if not self._may_retry(e):
+                raise
+            tool = await self._manager.fresh_tool(self.name)
+            if tool is None:
+                raise
+            return await tool._run_inner(args, tool_context)
+
+    def _may_retry(self, error: BaseException) -> bool:
+        """Whether running the call again cannot repeat a side effect."""
+        if base_tool_name(self.name) in RETRY_SAFE_TOOLS:
+            return True
+        # Connection errors arrive wrapped in anyio task group exception groups
+        while isinstance(error, BaseExceptionGroup) and error.exceptions:
+            error = error.exceptions[0]
+        return isinstance(error, NOT_SENT_ERRORS)
+
+
+class ManagedMCPToolset(BaseToolset):
+    """
+    Owns the connection to an MCP server and keeps it alive.
+
+    A background task connects, caches the tool list and then waits; if a
+    tool call finds the connection dead, the same task closes it and
+    reconnects with exponential backoff. Agent turns never negotiate with the
+    server themselves: they get the cached tools, wait briefly for a
+    connection that is still coming up, or run without the MCP tools.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], BaseToolset],
+        initial_backoff: float = MCP_RECONNECT_INITIAL_SECONDS,
+        max_backoff: float = MCP_RECONNECT_MAX_SECONDS,
+        ready_wait: float = MCP_READY_WAIT_SECONDS,
+    ):
+        self._factory = factory
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.ready_wait = ready_wait
+        self._tools: Optional[List[ResilientMCPTool]] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._broken: Optional[asyncio.Event] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._closing = False
+        self._started_at: Optional[float] = None
+        self._connects = 0
+        self._failures = 0
+        self._turns_without_tools = 0
+        self._last_error: Optional[str] = None
+        self._first_connect_seconds: Optional[float] = None
+        self._last_connect_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether the connection is up and the tool list is cached."""
+        return self._tools is not None
+
+    def start(self):
+        """Start connecting in the background; returns immediately."""
+        if self._supervisor is not None:
+            return
+        self._closing = False
+        self._ready = asyncio.Event()
+        self._broken = asyncio.Event()
+        self._started_at = time.perf_counter()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """
+        Wait for the connection to come up.
+
+        Args:
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: Whether the connection is ready
+        """
+        if self.ready:
+            return True
+        self.start()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready.wait()), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.ready
+
+    def mark_broken(self, error: Exception, generation: int):
+        """
+        Report a dead connection so the background task reconnects.
+
+        Args:
+            error (Exception): What the failed call raised
+            generation (int): The connection the failing tool came from;
+                reports about an already replaced connection are ignored
+        """
+        if self._tools is None or generation != self._connects:
+            return
+        self._last_error = f"{type(error).__name__}: {error}"
+        logger.warning(f"MCP connection lost: {self._last_error}")
+        self._tools = None
+        self._ready.clear()
+        self._broken.set()
+
+    async def fresh_tool(self, name: str) -> Optional[ResilientMCPTool]:
+        """Wait for the reconnect and return the tool with this name, if any."""
+        if not await self.wait_ready(self.ready_wait):
+            return None
+        return next((tool for tool in self._tools if tool.name == name), None)
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> List[BaseTool]:
+        if await self.wait_ready(self.ready_wait):
+            return list(self._tools)
+        self._turns_without_tools += 1
+        logger.warning("MCP server not ready; running this step without WhatsApp tools")
+        return []
+
+    async def _supervise(self):
+        """Connect, wait until the connection breaks, close it and reconnect, forever."""
+        backoff = self.initial_backoff
+        while not self._closing:
+            toolset = self._factory()
+            attempt_started = time.perf_counter()
+            try:
+                tools = await toolset.get_tools()
+            except asyncio.CancelledError:
+                await self._close_quietly(toolset)
+                raise
+            except Exception as e:
+                # Connection errors arrive wrapped in anyio task group exception groups
+                while isinstance(e, BaseExceptionGroup) and e.exceptions:
+                    e = e.exceptions[0]
+                self._failures += 1
+                self._last_error = f"{type(e).__name__}: {e}"
+                await self._close_quietly(toolset)
+                delay = backoff * random.uniform(0.5, 1.0)
+                logger.warning(f"Could not connect to MCP server ({self._last_error}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = self.initial_backoff
+            self._connects += 1
+            self._last_connect_seconds = time.perf_counter() - attempt_started
+            if self._first_connect_seconds is None:
+                self._first_connect_seconds = time.perf_counter() - self._started_at
+            self._tools = [ResilientMCPTool(tool, self, self._connects) for tool in tools]
+            self._ready.set()
+            logger.info(f"Connected to MCP server with {len(tools)} tool(s) in {self._last_connect_seconds:.2f}s")
+
+            # The connection is closed by the task that opened it
+            await self._broken.wait()
+            self._broken.clear()
+            await self._close_quietly(toolset)
+
+    @staticmethod
+    async def _close_quietly(toolset: BaseToolset):
+        try:
+            await toolset.close()
+        except Exception as e:
+            logger.warning(f"Error closing MCP connection: {str(e)}")
+
+    async def close(self) -> None:
+        """Close the connection and stop reconnecting."""
+        if self._supervisor is None:
+            return
+        self._closing = True
+        if self._tools is not None:
+            self._tools = None
+            self._broken.set()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+        else:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+        self._supervisor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection state and timings for monitoring."""
+        return {
+            "ready": self.ready,
+            "tools": len(self._tools) if self._tools is not None else 0,
+            "connects_total": self._connects,
+            "connect_failures_total": self._failures,
+            "turns_without_tools_total": self._turns_without_tools,
+            "first_connect_seconds": self._first_connect_seconds,
+            "last_connect_seconds": self._last_connect_seconds,
+            "last_error": self._last_error,
+        }
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+from dedup import DEDUP_MAX_ENTRIES, idempotency_key
+from ingest import loads
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+MESSAGE_INDEX_ENABLED = os.getenv("MESSAGE_INDEX_ENABLED", "true").lower() == "true"
+MESSAGE_INDEX_DB_PATH = os.getenv("MESSAGE_INDEX_DB_PATH", os.path.join(DATA_DIR, "messages.db"))
+MESSAGE_INDEX_BATCH_SIZE = int(os.getenv("MESSAGE_INDEX_BATCH_SIZE", "200"))
+MESSAGE_INDEX_FLUSH_SECONDS = float(os.getenv("MESSAGE_INDEX_FLUSH_SECONDS", "1.0"))
+# Messages buffered beyond this are dropped rather than slowing down the webhook
+MESSAGE_INDEX_MAX_PENDING = int(os.getenv("MESSAGE_INDEX_MAX_PENDING", "10000"))
+SNIPPET_TOKENS = 16
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    body,
+    sender,
+    chat_id UNINDEXED,
+    timestamp UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def to_match_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query matching all of its words.
+
+    Every word is quoted, so user input can never be parsed as FTS5 syntax;
+    the last word also matches as a prefix.
+
+    Args:
+        query (str): The free-text query
+
+    Returns:
+        str: The FTS5 MATCH expression, or "" if the query has no words
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _timestamp(value: Any) -> float:
+    """A webhook timestamp in seconds; the current time if it is missing or not a usable time."""
+    try:
+        timestamp = float(value)
+        # search() renders it, so it has to be a valid date too
+        datetime.fromtimestamp(timestamp)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return time.time()
+    return timestamp if timestamp > 0 else time.time()
+
+
+class MessageIndex:
+    """
+    Local SQLite FTS5 index of every message seen by the webhook.
+
+    `add` only appends to an in-memory buffer; a background task writes the
+    buffer in batches from a worker thread, so ingesting never waits on disk.
+    `add_raw` buffers an undecoded webhook body instead; it is decoded in
+    that thread, and redeliveries are skipped there.
+    """
+
+    def __init__(self, path: str = MESSAGE_INDEX_DB_PATH):
+        self.path = path
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+        self._pending: List[Union[tuple, bytes]] = []
+        # Idempotency keys of recently indexed raw bodies; only touched by the writer thread
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._indexed_total = 0
+        self._dropped_total = 0
+
+    def open(self):
+        """Open the index, creating it if needed."""
+        if self._write_conn is not None:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._write_conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+        self._write_conn.executescript(SCHEMA)
+        self._read_conn = sqlite3.connect(self.path, check_same_thread=False)
+
+    def start(self):
+        """Open the index and start the background flusher."""
+        self.open()
+        self._stopping = False
+        self._batch_ready = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Write whatever is buffered and stop the flusher.
+
+        The flusher is woken up rather than cancelled, so a batch it is
+        writing in its thread is finished before `close` runs.
+        """
+        if self._flusher is not None:
+            self._stopping = True
+            self._batch_ready.set()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+        self._batch_ready = None
+
+    def close(self):
+        """Close the database connections."""
+        for conn in (self._write_conn, self._read_conn):
+            if conn is not None:
+                conn.close()
+        self._write_conn = self._read_conn = None
+
+    def add(self, message: Dict[str, Any]):
+        """
+        Buffer an incoming webhook message for indexing.
+
+        Args:
+            message (Dict[str, Any]): The webhook payload
+        """
+        row = self._row(message)
+        if row is not None:
+            self._buffer(row)
+
+    def add_raw(self, body: bytes):
+        """
+        Buffer an undecoded webhook body for indexing.
+
+        Args:
+            body (bytes): The raw request body
+        """
+        self._buffer(body)
+
+    def _buffer(self, item: Union[tuple, bytes]):
+        if len(self._pending) >= MESSAGE_INDEX_MAX_PENDING:
+            self._dropped_total += 1
+            return
+        self._pending.append(item)
+        if len(self._pending) >= MESSAGE_INDEX_BATCH_SIZE and self._batch_ready is not None:
+            self._batch_ready.set()
+
+    @staticmethod
+    def _row(message: Dict[str, Any]) -> Optional[tuple]:
+        """The index row of a webhook payload; None if it has no text."""
+        body = message.get("message")
+        if not body:
+            return None
+        return (
+            body,
+            message.get("name", ""),
+            message.get("from", ""),
+            _timestamp(message.get("timestamp")),
+        )
+
+    def _decode(self, body: bytes) -> Optional[tuple]:
+        """The index row of a raw body; None if it is malformed, has no text or was already indexed."""
+        try:
+            message = loads(body)
+        except ValueError:
+            return None
+        if not isinstance(message, dict):
+            return None
+        key = idempotency_key(message)
+        if key is not None:
+            if key in self._seen:
+                return None
+            self._seen[key] = None
+            if len(self._seen) > DEDUP_MAX_ENTRIES:
+                self._seen.popitem(last=False)
+        return self._row(message)
+
+    async def _flush_loop(self):
+        """Flush the buffer every interval, or as soon as a full batch is waiting."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), MESSAGE_INDEX_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write the buffered messages in one transaction."""
+        if not self._pending or self._write_conn is None:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            self._indexed_total += await asyncio.to_thread(self._insert, batch)
+        except Exception as e:
+            self._dropped_total += len(batch)
+            logger.error(f"Failed to index {len(batch)} message(s): {str(e)}")
+
+    def _insert(self, batch: List[Union[tuple, bytes]]) -> int:
+        rows = [self._decode(item) if isinstance(item, bytes) else item for item in batch]
+        rows = [row for row in rows if row is not None]
+        with self._write_conn:
+            self._write_conn.execute("BEGIN")
+            self._write_conn.executemany(
+                "INSERT INTO messages (body, sender, chat_id, timestamp) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def search(self, query: str, chat_id: str = "", limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find the best-matching messages for a query.
+
+        Args:
+            query (str): Free-text query
+            chat_id (str): Only search this chat, if given
+            limit (int): Maximum number of results
+
+        Returns:
+            List[Dict[str, Any]]: Matches with chat_id, sender, time and a snippet
+        """
+        match = to_match_query(query)
+        if not match:
+            return []
+        self.open()
+        sql = (
+            "SELECT chat_id, sender, timestamp,"
+            f" snippet(messages, 0, '*', '*', '...', {SNIPPET_TOKENS})"
+            " FROM messages WHERE messages MATCH ?"
+        )
+        params: List[Any] = [match]
+        if chat_id:
+            sql += " AND chat_id = ?"
+            params.append(chat_id)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        return [
+            {
+                "chat_id": row_chat_id,
+                "sender": sender,
+                "time": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M"),
+                "snippet": snippet,
+            }
+            for row_chat_id, sender, timestamp, snippet in rows
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        """Ingestion counters for monitoring."""
+        return {
+            "enabled": MESSAGE_INDEX_ENABLED,
+            "pending": len(self._pending),
+            "indexed_total": self._indexed_total,
+            "dropped_total": self._dropped_total,
+        }
+
+
+message_index = MessageIndex()
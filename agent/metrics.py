@@ -0,0 +1,183 @@
+import contextlib
+import contextvars
+import functools
+import logging
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Seconds; fine at the low end for SQLite and cache hits, coarse at the top for model calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "butler_stage_seconds",
+    "Time spent in each stage of handling a message",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+MODEL_CALL_SECONDS = Histogram(
+    "butler_model_call_seconds",
+    "Time per model call (one agent step)",
+    buckets=LATENCY_BUCKETS,
+)
+TOOL_CALL_SECONDS = Histogram(
+    "butler_tool_call_seconds",
+    "Time per tool call",
+    ["tool"],
+    buckets=LATENCY_BUCKETS,
+)
+TASK_FIRE_SKEW_SECONDS = Histogram(
+    "butler_task_fire_skew_seconds",
+    "Delay between a scheduled task's due time and the moment it was queued",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300, 900, 3600),
+)
+MODEL_TOKENS = Counter(
+    "butler_model_tokens",
+    "Tokens reported by the model",
+    ["kind"],
+)
+ROUTED_QUERIES = Counter(
+    "butler_routed_queries",
+    "Queries by the command rule that answered them; `agent` when none did",
+    ["rule"],
+)
+ERRORS = Counter(
+    "butler_errors",
+    "Errors by stage",
+    ["stage"],
+)
+
+# Model call start times of the running agent turn, by invocation; steps of one invocation never overlap.
+# Scoped to the turn by `model_call_timing`, so a call that fails before its response is dropped with the turn
+_model_started: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("model_started", default=None)
+
+
+def timed(stage: str):
+    """
+    Decorator recording the duration of an async function under a stage label.
+
+    Args:
+        stage (str): Value of the `stage` label
+    """
+    histogram = STAGE_SECONDS.labels(stage)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def model_call_timing() -> Iterator[None]:
+    """Keep the model call start times of one agent turn for as long as the turn runs."""
+    token = _model_started.set({})
+    try:
+        yield
+    finally:
+        _model_started.reset(token)
+
+
+def record_model_start(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """before_model_callback that notes when a model call starts."""
+    started = _model_started.get()
+    if started is not None:
+        started[callback_context.invocation_id] = time.perf_counter()
+    return None
+
+
+def record_model_end(callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+    """
+    after_model_callback that records model time, tokens and errors.
+
+    In streaming mode this runs for every chunk; only the final, non-partial
+    response closes the measurement.
+    """
+    if llm_response.partial:
+        return None
+    started = (_model_started.get() or {}).pop(callback_context.invocation_id, None)
+    if started is not None:
+        MODEL_CALL_SECONDS.observe(time.perf_counter() - started)
+    usage = llm_response.usage_metadata
+    if usage is not None:
+        MODEL_TOKENS.labels("prompt").inc(usage.prompt_token_count or 0)
+        MODEL_TOKENS.labels("completion").inc(usage.candidates_token_count or 0)
+        MODEL_TOKENS.labels("cached").inc(usage.cached_content_token_count or 0)
+    if llm_response.error_code:
+        ERRORS.labels("model").inc()
+    return None
+
+
+def record_tool_start(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> None:
+    """before_tool_callback that notes when a tool call starts."""
+    tool_context.metrics_started = time.perf_counter()
+    return None
+
+
+def record_tool_end(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Any) -> None:
+    """after_tool_callback that records the tool call duration."""
+    started = getattr(tool_context, "metrics_started", None)
+    if started is not None:
+        TOOL_CALL_SECONDS.labels(tool.name).observe(time.perf_counter() - started)
+    return None
+
+
+class StatsCollector:
+    """
+    Exposes the numeric figures of the components' `stats()` dicts as gauges.
+
+    Each source is read at scrape time, so nothing is updated on the hot path;
+    `queue.depth` becomes `butler_queue_depth`, and so on.
+    """
+
+    def __init__(self, sources: Callable[[], Dict[str, Dict[str, Any]]]):
+        self._sources = sources
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        try:
+            sections = self._sources()
+        except Exception as e:
+            logger.error(f"Could not read stats for metrics: {str(e)}")
+            return
+        for section, figures in sections.items():
+            for key, value in figures.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f"butler_{section}_{key}", f"{section} {key.replace('_', ' ')}", value=value)
+
+
+_collector: Optional[StatsCollector] = None
+
+
+def register_stats(sources: Callable[[], Dict[str, Dict[str, Any]]]):
+    """
+    Publish component stats on /metrics; a later call replaces the sources.
+
+    Args:
+        sources (Callable[[], Dict[str, Dict[str, Any]]]): Returns stats dicts by section name
+    """
+    global _collector
+    if _collector is not None:
+        REGISTRY.unregister(_collector)
+    _collector = StatsCollector(sources)
+    REGISTRY.register(_collector)
+
+
+def render_metrics() -> tuple:
+    """The current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
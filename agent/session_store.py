@@ -0,0 +1,425 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.db"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "500"))
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+# Maximum number of queued writes committed in one transaction
+SESSION_WRITE_BATCH = int(os.getenv("SESSION_WRITE_BATCH", "200"))
+
+SessionKey = Tuple[str, str, str]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    last_update_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_session ON events (app_name, user_id, session_id, seq);
+CREATE TABLE IF NOT EXISTS hot_sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (app_name, user_id, id)
+);
+"""
+
+
+class SqliteSessionService(BaseSessionService):
+    """
+    ADK session service persisted to SQLite (WAL mode) with a hot in-memory LRU.
+
+    Sessions are loaded from disk on first access and kept in memory until
+    they fall out of the LRU or stay idle longer than the TTL. Appended events
+    are applied in memory immediately and written to disk by a background
+    task in batches, so `append_event` never waits on disk I/O. Nothing is
+    read at startup, so boot time does not depend on how many chats exist;
+    instead the keys of the hot sessions are saved on shutdown
+    (`snapshot_hot`) and reloaded in the background after a restart
+    (`restore_hot`). With several webhook processes sharing the database,
+    each one saves and restores only the sessions of the users it `owns`.
+
+    Unlike InMemorySessionService, `app:` and `user:` state keys are stored
+    with the session that set them rather than shared across sessions.
+    `get_session` returns the cached session object itself, not a copy.
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        cache_size: int = SESSION_CACHE_SIZE,
+        idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+        owns: Callable[[str], bool] = lambda user_id: True,
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        self.idle_ttl = idle_ttl
+        self.owns = owns
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._hot: "OrderedDict[SessionKey, Session]" = OrderedDict()
+        self._last_access: Dict[SessionKey, float] = {}
+        self._writes: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._restored = 0
+
+    def _db(self) -> sqlite3.Connection:
+        """Open the database on first use."""
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def _run_db(self, fn, *args):
+        """Run a blocking database function in a thread, one at a time."""
+        def call():
+            with self._db_lock:
+                return fn(self._db(), *args)
+        return await asyncio.to_thread(call)
+
+    # Write-behind
+
+    def _enqueue_write(self, op: tuple):
+        """Queue a write for the background writer, starting it if needed."""
+        if self._writes is None:
+            self._writes = asyncio.Queue()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_loop())
+        self._writes.put_nowait(op)
+
+    async def _write_loop(self):
+        """Commit queued writes in batches until cancelled."""
+        while True:
+            batch = [await self._writes.get()]
+            while len(batch) < SESSION_WRITE_BATCH and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            try:
+                await self._run_db(self._apply_writes, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} session update(s): {str(e)}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    @staticmethod
+    def _apply_writes(conn: sqlite3.Connection, batch: List[tuple]):
+        """Apply a batch of queued writes in one transaction."""
+        with conn:
+            conn.execute("BEGIN")
+            for op, key, *values in batch:
+                if op == "create":
+                    state, last_update_time = values
+                    conn.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO sessions (app_name, user_id, id, state, last_update_time)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (*key, state, last_update_time),
+                    )
+                elif op == "event":
+                    data, state, last_update_time = values
+                    conn.execute(
+                        "INSERT INTO events (app_name, user_id, session_id, data) VALUES (?, ?, ?, ?)",
+                        (*key, data),
+                    )
+                    conn.execute(
+                        "UPDATE sessions SET state = ?, last_update_time = ?"
+                        " WHERE app_name = ? AND user_id = ? AND id = ?",
+                        (state, last_update_time, *key),
+                    )
+                elif op == "rewrite":
+                    events, state, last_update_time = values
+                    conn.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+                    conn.executemany(
+                        "INSERT INTO events (app_name, user_id, session_id, data) VALUES (?, ?, ?, ?)",
+                        [(*key, data) for data in events],
+                    )
+                    conn.execute(
+                        "UPDATE sessions SET state = ?, last_update_time = ?"
+                        " WHERE app_name = ? AND user_id = ? AND id = ?",
+                        (state, last_update_time, *key),
+                    )
+                elif op == "delete":
+                    conn.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", key)
+                    conn.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", key)
+
+    async def flush(self):
+        """Wait until every queued write has been committed."""
+        if self._writes is not None and self._writer is not None and not self._writer.done():
+            await self._writes.join()
+
+    async def close(self):
+        """Flush pending writes, stop the writer and close the database."""
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        self._writes = None
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.close()
+                self._conn = None
+
+    # Hot cache
+
+    def _touch(self, key: SessionKey, session: Session):
+        """Mark a session as most recently used and evict idle or excess sessions."""
+        now = time.monotonic()
+        self._hot[key] = session
+        self._hot.move_to_end(key)
+        self._last_access[key] = now
+        while self._hot:
+            oldest = next(iter(self._hot))
+            idle = now - self._last_access[oldest] > self.idle_ttl
+            if not idle and len(self._hot) <= self.cache_size:
+                break
+            self._hot.popitem(last=False)
+            del self._last_access[oldest]
+            self._evictions += 1
+
+    def _drop(self, key: SessionKey):
+        """Remove a session from the hot cache."""
+        self._hot.pop(key, None)
+        self._last_access.pop(key, None)
+
+    @staticmethod
+    def _load_session(conn: sqlite3.Connection, key: SessionKey) -> Optional[Session]:
+        """Read a session and its events from disk."""
+        row = conn.execute(
+            "SELECT state, last_update_time FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            "SELECT data FROM events WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq",
+            key,
+        ).fetchall()
+        return Session(
+            app_name=key[0],
+            user_id=key[1],
+            id=key[2],
+            state=json.loads(row[0]),
+            events=[Event.model_validate_json(data) for (data,) in rows],
+            last_update_time=row[1],
+        )
+
+    # Warm restart
+
+    async def snapshot_hot(self) -> int:
+        """
+        Save the keys of the hot sessions, most recently used first, for `restore_hot`.
+
+        The sessions themselves are already on disk once pending writes are flushed.
+
+        Returns:
+            int: Number of sessions saved
+        """
+        now = time.monotonic()
+        keys = [key for key in reversed(self._hot) if now - self._last_access[key] <= self.idle_ttl]
+
+        def save(conn: sqlite3.Connection):
+            with conn:
+                conn.execute("BEGIN")
+                stale = [key for key in conn.execute("SELECT app_name, user_id, id FROM hot_sessions") if self.owns(key[1])]
+                conn.executemany("DELETE FROM hot_sessions WHERE app_name = ? AND user_id = ? AND id = ?", stale)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO hot_sessions (app_name, user_id, id, position) VALUES (?, ?, ?, ?)",
+                    [(*key, position) for position, key in enumerate(keys)],
+                )
+
+        await self._run_db(save)
+        return len(keys)
+
+    async def restore_hot(self) -> int:
+        """
+        Reload the sessions saved by `snapshot_hot` into the hot cache.
+
+        Returns:
+            int: Number of sessions restored
+        """
+        def load(conn: sqlite3.Connection) -> List[Session]:
+            keys = [key for key in conn.execute("SELECT app_name, user_id, id FROM hot_sessions ORDER BY position")
+                    if self.owns(key[1])]
+            sessions = (self._load_session(conn, key) for key in keys[:self.cache_size])
+            return [session for session in sessions if session is not None]
+
+        sessions = await self._run_db(load)
+        restored = 0
+        # Least recently used first, so the LRU order matches the one saved
+        for session in reversed(sessions):
+            key = (session.app_name, session.user_id, session.id)
+            if key not in self._hot:
+                self._touch(key, session)
+                restored += 1
+        self._restored += restored
+        return restored
+
+    # BaseSessionService
+
+    @timed("session_create")
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=state or {},
+            last_update_time=time.time(),
+        )
+        key = (app_name, user_id, session_id)
+        self._touch(key, session)
+        self._enqueue_write(("create", key, json.dumps(session.state), session.last_update_time))
+        return session
+
+    @timed("session_get")
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        session = self._hot.get(key)
+        if session is not None:
+            self._hits += 1
+        else:
+            self._misses += 1
+            # Evicted sessions may still have queued writes
+            await self.flush()
+            session = await self._run_db(self._load_session, key)
+            if session is None:
+                return None
+        self._touch(key, session)
+
+        if config and (config.num_recent_events or config.after_timestamp):
+            events = session.events
+            if config.num_recent_events:
+                events = events[-config.num_recent_events:]
+            if config.after_timestamp:
+                events = [e for e in events if e.timestamp >= config.after_timestamp]
+            return session.model_copy(update={"events": events})
+        return session
+
+    async def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        await self.flush()
+
+        def query(conn: sqlite3.Connection):
+            return conn.execute(
+                "SELECT id, last_update_time FROM sessions WHERE app_name = ? AND user_id = ?",
+                (app_name, user_id),
+            ).fetchall()
+
+        rows = await self._run_db(query)
+        return ListSessionsResponse(sessions=[
+            Session(app_name=app_name, user_id=user_id, id=session_id, last_update_time=last_update_time)
+            for session_id, last_update_time in rows
+        ])
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        self._drop(key)
+        self._enqueue_write(("delete", key))
+
+    @timed("session_append")
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+
+        key = (session.app_name, session.user_id, session.id)
+        stored = self._hot.get(key)
+        if stored is not None and stored is not session:
+            # The caller holds a copy (e.g. from a filtered get_session)
+            await super().append_event(session=stored, event=event)
+            stored.last_update_time = event.timestamp
+        self._enqueue_write((
+            "event",
+            key,
+            event.model_dump_json(exclude_none=True),
+            json.dumps(session.state),
+            session.last_update_time,
+        ))
+        return event
+
+    async def rewrite_events(self, session: Session, events: List[Event], state_delta: Optional[Dict[str, Any]] = None):
+        """
+        Replace a session's stored events, e.g. after compacting its history.
+
+        Args:
+            session (Session): The session to rewrite
+            events (List[Event]): The new event list
+            state_delta (Optional[Dict[str, Any]]): State keys to update alongside
+        """
+        session.events = list(events)
+        if state_delta:
+            session.state.update(state_delta)
+        key = (session.app_name, session.user_id, session.id)
+        stored = self._hot.get(key)
+        if stored is not None and stored is not session:
+            stored.events = list(events)
+            stored.state.update(state_delta or {})
+        self._enqueue_write((
+            "rewrite",
+            key,
+            [event.model_dump_json(exclude_none=True) for event in events],
+            json.dumps(session.state),
+            session.last_update_time,
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hot cache and write-queue figures for monitoring."""
+        return {
+            "hot_sessions": len(self._hot),
+            "cache_size": self.cache_size,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "restored": self._restored,
+            "pending_writes": self._writes.qsize() if self._writes is not None else 0,
+        }
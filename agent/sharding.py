@@ -0,0 +1,33 @@
+import os
+import zlib
+from typing import Any
+
+from mcp_cache import normalize_chat_id
+
+# Number of webhook processes behind the dispatcher, and this process's index among them
+WEBHOOK_PROCESSES = int(os.getenv("WEBHOOK_PROCESSES", "1"))
+WEBHOOK_PROCESS_INDEX = int(os.getenv("WEBHOOK_PROCESS_INDEX", "0"))
+
+
+def process_for_chat(chat_id: Any, processes: int = WEBHOOK_PROCESSES) -> int:
+    """
+    Pick the webhook process that owns a chat.
+
+    Every message, agent turn and scheduled task of a chat is handled by the
+    same process, so its session, lane and tasks live in one place.
+
+    Args:
+        chat_id (Any): The chat ID, in any spelling
+        processes (int): Number of webhook processes
+
+    Returns:
+        int: Index of the owning process
+    """
+    if processes <= 1:
+        return 0
+    return zlib.crc32(normalize_chat_id(chat_id).encode()) % processes
+
+
+def owns_chat(chat_id: Any) -> bool:
+    """Whether this process owns the chat."""
+    return process_for_chat(chat_id) == WEBHOOK_PROCESS_INDEX
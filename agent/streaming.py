@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() == "true"
+# Sent as soon as a streamed query is picked up; empty disables it
+STREAM_ACK_TEXT = os.getenv("STREAM_ACK_TEXT", "On it, working on your request...")
+# Minimum gap between two messages of one reply, to stay within WhatsApp send limits
+STREAM_MIN_INTERVAL_SECONDS = float(os.getenv("STREAM_MIN_INTERVAL_SECONDS", "2.0"))
+# Maximum messages per reply (acknowledgement included); the rest is sent together at the end
+STREAM_MAX_MESSAGES = int(os.getenv("STREAM_MAX_MESSAGES", "8"))
+# Partial text is only flushed once at least this much complete text is buffered
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "160"))
+
+SENTENCE_END = re.compile(r"[.!?:;](\s+)|\n")
+
+first_message_stats = {
+    "streamed_replies_total": 0,
+    "buffered_replies_total": 0,
+    "ack_seconds_total": 0.0,
+    "streamed_first_chunk_seconds_total": 0.0,
+    "streamed_first_chunk_seconds_max": 0.0,
+    "buffered_first_message_seconds_total": 0.0,
+    "buffered_first_message_seconds_max": 0.0,
+}
+
+
+def record_buffered_reply(seconds: float):
+    """
+    Record time to first message for a reply sent in one go.
+
+    Args:
+        seconds (float): Seconds from picking up the query to sending the reply
+    """
+    first_message_stats["buffered_replies_total"] += 1
+    first_message_stats["buffered_first_message_seconds_total"] += seconds
+    first_message_stats["buffered_first_message_seconds_max"] = max(
+        first_message_stats["buffered_first_message_seconds_max"], seconds)
+
+
+def streaming_stats() -> Dict[str, Any]:
+    """Average and maximum time to first message, streamed vs. buffered."""
+    streamed = first_message_stats["streamed_replies_total"]
+    buffered = first_message_stats["buffered_replies_total"]
+    return {
+        "streamed_replies_total": streamed,
+        "buffered_replies_total": buffered,
+        "ack_seconds_avg": first_message_stats["ack_seconds_total"] / streamed if streamed else 0.0,
+        "streamed_first_chunk_seconds_avg": (
+            first_message_stats["streamed_first_chunk_seconds_total"] / streamed if streamed else 0.0),
+        "streamed_first_chunk_seconds_max": first_message_stats["streamed_first_chunk_seconds_max"],
+        "buffered_first_message_seconds_avg": (
+            first_message_stats["buffered_first_message_seconds_total"] / buffered if buffered else 0.0),
+        "buffered_first_message_seconds_max": first_message_stats["buffered_first_message_seconds_max"],
+    }
+
+
+def last_boundary(text: str) -> int:
+    """Index just past the last paragraph break, or failing that the last sentence end."""
+    paragraph = text.rfind("\n\n")
+    if paragraph >= 0:
+        return paragraph + 2
+    end = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+    return end
+
+
+class StreamingReply:
+    """
+    Delivers an agent reply progressively as partial model output arrives.
+
+    Partial text is buffered and flushed at paragraph or sentence boundaries,
+    with at least `min_interval` seconds between messages and at most
+    `max_messages` messages per reply; whatever is held back is sent by
+    `finish`.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        ack_text: str = STREAM_ACK_TEXT,
+        min_interval: float = STREAM_MIN_INTERVAL_SECONDS,
+        max_messages: int = STREAM_MAX_MESSAGES,
+        min_chars: int = STREAM_MIN_CHARS,
+    ):
+        self._send = send
+        self.ack_text = ack_text
+        self.min_interval = min_interval
+        self.max_messages = max_messages
+        self.min_chars = min_chars
+        self._started = time.perf_counter()
+        self._buffer = ""
+        self._step_chars = 0
+        self._last_send = 0.0
+        self._messages = 0
+        self._first_chunk_seconds: Optional[float] = None
+
+    async def _deliver(self, text: str):
+        """Send one message and update the rate-limit bookkeeping."""
+        await self._send(text)
+        self._last_send = time.perf_counter()
+        self._messages += 1
+
+    async def ack(self):
+        """Send the "working on it" acknowledgement."""
+        if not self.ack_text:
+            return
+        await self._deliver(self.ack_text)
+        first_message_stats["ack_seconds_total"] += self._last_send - self._started
+
+    async def on_partial(self, text: str):
+        """
+        Buffer a chunk of partial model text and flush finished sentences.
+
+        Args:
+            text (str): The new chunk
+        """
+        self._buffer += text
+        self._step_chars += len(text)
+        await self._flush(force=False)
+
+    async def on_step_text(self, text: str):
+        """
+        Handle the complete text of one model step.
+
+        Streaming models send the step's text again, aggregated, after its
+        partial chunks; only the part not already seen is buffered. Called
+        for every non-partial event, including steps that end in a tool call,
+        so the next step's text is counted from its own start.
+
+        Args:
+            text (str): The step's full text; empty for an event without text
+        """
+        if len(text) > self._step_chars:
+            self._buffer += text[self._step_chars:]
+        self._step_chars = 0
+        await self._flush(force=True)
+
+    async def _flush(self, force: bool):
+        """Send buffered text if the rate limit allows; `force` sends incomplete sentences too."""
+        if not self._buffer.strip() or self._messages >= self.max_messages - 1:
+            return
+        if time.perf_counter() - self._last_send < self.min_interval:
+            return
+        cut = len(self._buffer) if force else last_boundary(self._buffer)
+        if cut < self.min_chars and not force:
+            return
+        chunk, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:]
+        if not chunk:
+            return
+        if self._first_chunk_seconds is None:
+            self._first_chunk_seconds = time.perf_counter() - self._started
+        await self._deliver(chunk)
+
+    async def finish(self):
+        """Send everything still buffered, waiting out the rate limit if needed."""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        if rest:
+            wait = self.min_interval - (time.perf_counter() - self._last_send)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if self._first_chunk_seconds is None:
+                self._first_chunk_seconds = time.perf_counter() - self._started
+            await self._deliver(rest)
+
+        seconds = self._first_chunk_seconds or 0.0
+        first_message_stats["streamed_replies_total"] += 1
+        first_message_stats["streamed_first_chunk_seconds_total"] += seconds
+        first_message_stats["streamed_first_chunk_seconds_max"] = max(
+            first_message_stats["streamed_first_chunk_seconds_max"], seconds)
+        logger.info(f"Streamed reply in {self._messages} message(s), first chunk after {seconds:.2f}s")
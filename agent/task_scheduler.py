@@ -0,0 +1,475 @@
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cached_property
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Set, Tuple
+
+from croniter import croniter
+
+from metrics import TASK_FIRE_SKEW_SECONDS
+from sharding import owns_chat
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+TASK_DB_PATH = os.getenv("TASK_DB_PATH", os.path.join(DATA_DIR, "tasks.db"))
+# Runs missed while the process was down are fired once on start if they are
+# at most this old, and skipped otherwise
+TASK_CATCHUP_SECONDS = float(os.getenv("TASK_CATCHUP_SECONDS", "3600"))
+# Tasks due at the same time are spread evenly over this many seconds instead of all firing at once
+TASK_JITTER_SECONDS = float(os.getenv("TASK_JITTER_SECONDS", "30"))
+# Maximum number of scheduled tasks whose agent turns run at the same time
+TASK_FIRE_CONCURRENCY = int(os.getenv("TASK_FIRE_CONCURRENCY", "4"))
+# Minutes with at least TASK_PREWARM_MIN_TASKS due tasks are warmed up this many seconds ahead; 0 disables it
+TASK_PREWARM_SECONDS = float(os.getenv("TASK_PREWARM_SECONDS", "20"))
+TASK_PREWARM_MIN_TASKS = int(os.getenv("TASK_PREWARM_MIN_TASKS", "3"))
+
+
+def describe_schedule(cron_expression: str) -> str:
+    """
+    Render a cron expression as human-readable text.
+
+    Args:
+        cron_expression (str): The cron expression to describe
+
+    Returns:
+        str: The description, or "N/A" if it cannot be generated
+    """
+    try:
+        from cron_descriptor import Options, get_description
+    except ImportError:
+        return "N/A (could not generate description)"
+    try:
+        options = Options()
+        options.use_24hour_time_format = True
+        options.verbose = True
+        return get_description(cron_expression, options)
+    except Exception as e:
+        return f"N/A (error: {str(e)})"
+
+
+@dataclass(eq=False)
+class ScheduledTask:
+    """A recurring message scheduled by a user. `id` is stable across restarts."""
+    id: int
+    user_id: str
+    message: str
+    cron_expression: str
+    next_fire_at: float
+
+    @cached_property
+    def description(self) -> str:
+        """Human-readable schedule, rendered on first use."""
+        return describe_schedule(self.cron_expression)
+
+    def render(self) -> str:
+        """One-line summary used in task listings."""
+        return f"{self.id}. Message: '{self.message}', Schedule: '{self.cron_expression}', When: '{self.description}'"
+
+
+def next_fire_time(cron_expression: str, after: Optional[float] = None) -> float:
+    """
+    Compute the next time a cron expression fires, in local time.
+
+    Args:
+        cron_expression (str): A cron expression such as "0 8 * * *"
+        after (Optional[float]): Timestamp to start from; defaults to now
+
+    Returns:
+        float: The next fire time as a Unix timestamp
+    """
+    start = datetime.fromtimestamp(after if after is not None else time.time()).astimezone()
+    return croniter(cron_expression, start).get_next(float)
+
+
+class TaskScheduler:
+    """
+    In-process scheduler for recurring user tasks.
+
+    Tasks are stored in SQLite and kept in memory, indexed by ID, by user and
+    by (user, message), with a heap ordered by next fire time. Each user's
+    rendered listing is cached until one of their tasks changes, so listing
+    and removal only touch that user's tasks. A single background loop
+    sleeps until the earliest task is due and hands it to the `fire`
+    callback, so no cron daemon, shell or HTTP loopback is involved.
+
+    Tasks due together (popular times such as "0 8 * * *") are spread over
+    `jitter_seconds`, at most `concurrency` of them run at once, and busy
+    minutes are handed to the `prewarm` callback shortly before they come up.
+
+    With several webhook processes sharing the database, each one loads and
+    fires only the tasks of the users it `owns`.
+
+    The scheduling tools call it from worker threads, so the indexes and the
+    database connection are guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        path: str = TASK_DB_PATH,
+        catchup_seconds: float = TASK_CATCHUP_SECONDS,
+        owns: Callable[[str], bool] = lambda user_id: True,
+        jitter_seconds: float = TASK_JITTER_SECONDS,
+        concurrency: int = TASK_FIRE_CONCURRENCY,
+        prewarm_seconds: float = TASK_PREWARM_SECONDS,
+    ):
+        self.path = path
+        self.catchup_seconds = catchup_seconds
+        self.owns = owns
+        self.jitter_seconds = jitter_seconds
+        self.concurrency = concurrency
+        self.prewarm_seconds = prewarm_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tasks: Dict[int, ScheduledTask] = {}
+        self._by_user: Dict[str, Dict[int, ScheduledTask]] = {}
+        self._by_message: Dict[Tuple[str, str], Set[int]] = {}
+        self._listings: Dict[str, List[str]] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._lock = threading.RLock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._firing: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._warmed_at: Optional[float] = None
+        self._fired_total = 0
+        self._skipped_total = 0
+        self._prewarms_total = 0
+        self._skew_samples = 0
+        self._skew_seconds_total = 0.0
+        self._skew_seconds_max = 0.0
+
+    def open(self):
+        """Open the task database and load every task into memory."""
+        with self._lock:
+            if self._conn is None:
+                self._open()
+
+    def _open(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " cron_expression TEXT NOT NULL,"
+            " next_fire_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_by_user ON tasks (user_id)")
+        for row in self._conn.execute("SELECT id, user_id, message, cron_expression, next_fire_at FROM tasks"):
+            task = ScheduledTask(*row)
+            if not self.owns(task.user_id):
+                continue
+            self._index(task)
+            self._heap.append((task.next_fire_at, task.id))
+        heapq.heapify(self._heap)
+        logger.info(f"Loaded {len(self._tasks)} scheduled task(s) from {self.path}")
+
+    def close(self):
+        """Close the task database."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _index(self, task: ScheduledTask):
+        """Add a task to the in-memory indexes."""
+        self._tasks[task.id] = task
+        self._by_user.setdefault(task.user_id, {})[task.id] = task
+        self._by_message.setdefault((task.user_id, task.message), set()).add(task.id)
+        self._listings.pop(task.user_id, None)
+
+    def _unindex(self, task: ScheduledTask):
+        """Remove a task from the in-memory indexes."""
+        del self._tasks[task.id]
+        user_tasks = self._by_user[task.user_id]
+        del user_tasks[task.id]
+        if not user_tasks:
+            del self._by_user[task.user_id]
+        same_message = self._by_message[(task.user_id, task.message)]
+        same_message.discard(task.id)
+        if not same_message:
+            del self._by_message[(task.user_id, task.message)]
+        self._listings.pop(task.user_id, None)
+
+    def add(self, user_id: str, cron_expression: str, message: str) -> ScheduledTask:
+        """
+        Store a new task and schedule its first run.
+
+        Args:
+            user_id (str): The user the task belongs to
+            cron_expression (str): When the task fires
+            message (str): The message sent to the agent when it fires
+
+        Returns:
+            ScheduledTask: The stored task
+
+        Raises:
+            ValueError: If the cron expression is invalid
+        """
+        if not croniter.is_valid(cron_expression):
+            raise ValueError(f"Invalid cron expression: {cron_expression}")
+        self.open()
+        next_fire_at = next_fire_time(cron_expression)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO tasks (user_id, message, cron_expression, next_fire_at) VALUES (?, ?, ?, ?)",
+                (user_id, message, cron_expression, next_fire_at),
+            )
+            task = ScheduledTask(cursor.lastrowid, user_id, message, cron_expression, next_fire_at)
+            self._index(task)
+            heapq.heappush(self._heap, (next_fire_at, task.id))
+        if self._wakeup is not None:
+            self._event_loop.call_soon_threadsafe(self._wakeup.set)
+        return task
+
+    def find(self, user_id: str, identifier: str) -> List[ScheduledTask]:
+        """
+        Look up a user's tasks by task ID or by message.
+
+        Args:
+            user_id (str): The user whose tasks are searched
+            identifier (str): A task ID (optionally prefixed with "#") or the message text
+
+        Returns:
+            List[ScheduledTask]: The matching tasks
+        """
+        self.open()
+        task_id = identifier.strip().lstrip("#")
+        with self._lock:
+            if task_id.isdigit():
+                task = self._by_user.get(user_id, {}).get(int(task_id))
+                if task is not None:
+                    return [task]
+            return [self._tasks[i] for i in sorted(self._by_message.get((user_id, identifier), ()))]
+
+    def remove(self, user_id: str, identifier: str) -> int:
+        """
+        Remove a user's tasks matching a task ID or message.
+
+        Args:
+            user_id (str): The user whose tasks are removed
+            identifier (str): A task ID (optionally prefixed with "#") or the message text
+
+        Returns:
+            int: Number of tasks removed
+        """
+        with self._lock:
+            matches = self.find(user_id, identifier)
+            for task in matches:
+                self._unindex(task)
+            if matches:
+                self._conn.executemany("DELETE FROM tasks WHERE id = ?", [(task.id,) for task in matches])
+        # Stale heap entries are skipped when they come up
+        return len(matches)
+
+    def tasks(self, user_id: str) -> List[ScheduledTask]:
+        """A user's scheduled tasks, in creation order."""
+        self.open()
+        with self._lock:
+            return sorted(self._by_user.get(user_id, {}).values(), key=lambda task: task.id)
+
+    def listing(self, user_id: str) -> List[str]:
+        """
+        A user's rendered task listing, cached until their tasks change.
+
+        Args:
+            user_id (str): The user whose tasks are listed
+
+        Returns:
+            List[str]: One line per task
+        """
+        with self._lock:
+            listing = self._listings.get(user_id)
+            if listing is None:
+                listing = self._listings[user_id] = [task.render() for task in self.tasks(user_id)]
+            return listing
+
+    def start(
+        self,
+        fire: Callable[[ScheduledTask], Awaitable[None]],
+        prewarm: Optional[Callable[[List[ScheduledTask]], Awaitable[None]]] = None,
+    ):
+        """
+        Start the firing loop.
+
+        Args:
+            fire (Callable[[ScheduledTask], Awaitable[None]]): Called with each due
+                task; it should return once the task's turn is over, so that
+                `concurrency` bounds the turns in flight
+            prewarm (Optional[Callable[[List[ScheduledTask]], Awaitable[None]]]):
+                Called with the tasks of a busy minute `prewarm_seconds` before it
+        """
+        self.open()
+        self._event_loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(max(self.concurrency, 1))
+        self._loop_task = asyncio.create_task(self._run(fire, prewarm))
+
+    async def stop(self):
+        """Stop the firing loop; tasks still waiting to fire are caught up on the next start."""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        for firing in list(self._firing):
+            firing.cancel()
+        await asyncio.gather(*self._firing, return_exceptions=True)
+        self._wakeup = None
+
+    async def _run(
+        self,
+        fire: Callable[[ScheduledTask], Awaitable[None]],
+        prewarm: Optional[Callable[[List[ScheduledTask]], Awaitable[None]]],
+    ):
+        """Sleep until the next task is due, fire it and reschedule it, forever."""
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            warm_first = False
+            if self._heap:
+                next_at = self._heap[0][0]
+                timeout = max(next_at - time.time(), 0)
+                if prewarm is not None and self.prewarm_seconds > 0 and self._warmed_at != next_at:
+                    warm_first = True
+                    timeout = max(timeout - self.prewarm_seconds, 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue  # A task was added; recompute the earliest deadline
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.time()
+            if warm_first:
+                self._warmed_at = next_at
+                self._start_prewarm(prewarm, next_at)
+                if next_at > now:
+                    continue
+
+            due = []
+            with self._lock:
+                while True:
+                    task, fire_at = self._pop_due(now)
+                    if task is None:
+                        break
+                    if now - fire_at > self.catchup_seconds:
+                        logger.warning(f"Skipping task {task.id} missed at {datetime.fromtimestamp(fire_at)}")
+                        self._skipped_total += 1
+                    else:
+                        due.append((task, fire_at))
+                    # Several missed runs collapse into the single one fired here
+                    task.next_fire_at = next_fire_time(task.cron_expression, max(now, fire_at))
+                    self._conn.execute("UPDATE tasks SET next_fire_at = ? WHERE id = ?", (task.next_fire_at, task.id))
+                    heapq.heappush(self._heap, (task.next_fire_at, task.id))
+
+            spacing = self.jitter_seconds / len(due) if len(due) > 1 else 0.0
+            if spacing:
+                logger.info(f"Spreading {len(due)} due task(s) over {self.jitter_seconds:.0f}s")
+            for i, (task, fire_at) in enumerate(due):
+                firing = asyncio.create_task(self._fire(fire, task, fire_at, i * spacing))
+                self._firing.add(firing)
+                firing.add_done_callback(self._firing.discard)
+
+    async def _fire(self, fire: Callable[[ScheduledTask], Awaitable[None]], task: ScheduledTask, fire_at: float, delay: float):
+        """Fire one task after `delay` seconds, once a concurrency slot is free."""
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            self._rewind(task, fire_at)
+            raise
+        try:
+            if task.id not in self._tasks:
+                return  # Removed while it was waiting
+            skew = max(time.time() - fire_at, 0)
+            TASK_FIRE_SKEW_SECONDS.observe(skew)
+            self._skew_samples += 1
+            self._skew_seconds_total += skew
+            self._skew_seconds_max = max(self._skew_seconds_max, skew)
+            try:
+                await fire(task)
+                self._fired_total += 1
+            except Exception as e:
+                logger.error(f"Failed to fire task {task.id}: {str(e)}")
+        finally:
+            self._slots.release()
+
+    def _rewind(self, task: ScheduledTask, fire_at: float):
+        """Set a task that was stopped before firing back to the run it missed, so the next start catches it up."""
+        with self._lock:
+            if task.id not in self._tasks or self._conn is None:
+                return
+            task.next_fire_at = fire_at
+            self._conn.execute("UPDATE tasks SET next_fire_at = ? WHERE id = ?", (fire_at, task.id))
+            heapq.heappush(self._heap, (fire_at, task.id))
+        logger.info(f"Task {task.id} was stopped before firing; it will be caught up on the next start")
+
+    def _start_prewarm(self, prewarm: Callable[[List[ScheduledTask]], Awaitable[None]], fire_at: float):
+        """Hand the tasks due in the minute starting at `fire_at` to `prewarm`, if there are enough of them."""
+        with self._lock:
+            tasks = self._due_before(fire_at + 60)
+        if len(tasks) < TASK_PREWARM_MIN_TASKS:
+            return
+        logger.info(f"Warming up for {len(tasks)} task(s) due at {datetime.fromtimestamp(fire_at)}")
+        self._prewarms_total += 1
+
+        async def run():
+            try:
+                await prewarm(tasks)
+            except Exception as e:
+                logger.warning(f"Warm-up for tasks due at {datetime.fromtimestamp(fire_at)} failed: {str(e)}")
+
+        warming = asyncio.create_task(run())
+        self._firing.add(warming)
+        warming.add_done_callback(self._firing.discard)
+
+    def _due_before(self, deadline: float) -> List[ScheduledTask]:
+        """Live tasks due before `deadline`, walking only the part of the heap that is."""
+        tasks = []
+        pending = [0] if self._heap else []
+        while pending:
+            i = pending.pop()
+            fire_at, task_id = self._heap[i]
+            if fire_at >= deadline:
+                continue  # Children of a heap entry are never due earlier
+            task = self._tasks.get(task_id)
+            if task is not None and task.next_fire_at == fire_at:
+                tasks.append(task)
+            pending.extend(child for child in (2 * i + 1, 2 * i + 2) if child < len(self._heap))
+        return tasks
+
+    def _pop_due(self, now: float) -> Tuple[Optional[ScheduledTask], Optional[float]]:
+        """Take the next due task off the heap, with the time it was due; (None, None) if none is."""
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, task_id = heapq.heappop(self._heap)
+            task = self._tasks.get(task_id)
+            if task is not None and task.next_fire_at == fire_at:
+                return task, fire_at
+            # Otherwise removed or rescheduled since this entry was pushed
+        return None, None
+
+    def stats(self) -> Dict[str, Any]:
+        """Task counts and fire-time skew for monitoring."""
+        return {
+            "tasks": len(self._tasks),
+            "users": len(self._by_user),
+            "next_fire_in_seconds": max(self._heap[0][0] - time.time(), 0) if self._heap else None,
+            "firing": len(self._firing),
+            "fired_total": self._fired_total,
+            "skipped_total": self._skipped_total,
+            "prewarms_total": self._prewarms_total,
+            "fire_skew_seconds_avg": self._skew_seconds_total / self._skew_samples if self._skew_samples else 0.0,
+            "fire_skew_seconds_max": self._skew_seconds_max,
+        }
+
+
+task_scheduler = TaskScheduler(owns=owns_chat)
@@ -0,0 +1,22 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The service modules read their database paths on import, so point them at a scratch
+# directory before any test imports one; agent/data is the live data when run in Docker
+DATA_DIR = tempfile.mkdtemp(prefix="butler-tests-")
+os.environ["DATA_DIR"] = DATA_DIR
+for name in ("SESSION_DB_PATH", "QUEUE_DB_PATH", "TASK_DB_PATH", "MESSAGE_INDEX_DB_PATH"):
+    os.environ.pop(name, None)
+
+# The service modules are imported flat, as they are when run from agent/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def scratch_data_dir():
+    yield DATA_DIR
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from google.adk.models import LlmRequest
+from google.genai import types
+
+import context_cache
+from context_cache import ContextCache, PromptFile
+
+PROMPT = "You are the butler of {user_id}."
+
+
+class SlowCaches:
+    """Stand-in for `client.aio.caches` whose calls take `seconds` and can fail."""
+
+    def __init__(self, seconds: float, fail: bool = False):
+        self.seconds = seconds
+        self.fail = fail
+        self.creates = 0
+
+    async def create(self, *, model, config):
+        self.creates += 1
+        await asyncio.sleep(self.seconds)
+        if self.fail:
+            raise RuntimeError("prompt below the minimum cache size")
+        return SimpleNamespace(name=f"cachedContents/{self.creates}")
+
+    async def update(self, *, name, config):
+        await asyncio.sleep(self.seconds)
+
+    async def delete(self, *, name):
+        pass
+
+
+def make_cache(tmp_path, caches: SlowCaches) -> ContextCache:
+    path = tmp_path / "prompt.md"
+    path.write_text(PROMPT)
+    return ContextCache(PromptFile(str(path)), client=SimpleNamespace(aio=SimpleNamespace(caches=caches)))
+
+
+def request() -> LlmRequest:
+    instruction = PROMPT.replace("{user_id}", "1@c.us")
+    return LlmRequest(model="gemini-2.0-flash", config=types.GenerateContentConfig(system_instruction=instruction))
+
+
+def test_model_calls_do_not_wait_for_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(context_cache, "CONTEXT_CACHE_ENABLED", True)
+    caches = SlowCaches(seconds=0.5)
+    cache = make_cache(tmp_path, caches)
+    callback_context = SimpleNamespace(state={"user_id": "1@c.us"})
+
+    async def run():
+        requests = [request() for _ in range(5)]
+        started = time.perf_counter()
+        await asyncio.gather(*(cache.apply(callback_context, llm_request) for llm_request in requests))
+        elapsed = time.perf_counter() - started
+        # Created once, in the background; these requests went out uncached
+        assert all(llm_request.config.cached_content is None for llm_request in requests)
+        await cache._maintenance
+        later = request()
+        await cache.apply(callback_context, later)
+        return elapsed, later.config.cached_content
+
+    elapsed, cached_content = asyncio.run(run())
+    assert elapsed < 0.1
+    assert caches.creates == 1
+    assert cached_content == "cachedContents/1"
+
+
+def test_failed_creation_is_not_retried_on_every_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(context_cache, "CONTEXT_CACHE_ENABLED", True)
+    caches = SlowCaches(seconds=0, fail=True)
+    cache = make_cache(tmp_path, caches)
+    callback_context = SimpleNamespace(state={"user_id": "1@c.us"})
+
+    async def run():
+        for _ in range(3):
+            await cache.apply(callback_context, request())
+            await cache._maintenance
+
+    asyncio.run(run())
+    assert caches.creates == 1
@@ -0,0 +1,18 @@
+from fastapi.testclient import TestClient
+
+import webhook_server
+
+
+def test_traces_are_off_without_a_token(monkeypatch):
+    monkeypatch.setattr(webhook_server, "DEBUG_TOKEN", "")
+    client = TestClient(webhook_server.app)
+    assert client.get("/debug/traces").status_code == 404
+
+
+def test_traces_need_the_token(monkeypatch):
+    monkeypatch.setattr(webhook_server, "DEBUG_TOKEN", "s3cret")
+    client = TestClient(webhook_server.app)
+    assert client.get("/debug/traces").status_code == 401
+    assert client.get("/debug/traces", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/debug/traces", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
@@ -0,0 +1,28 @@
+import asyncio
+
+from dedup import idempotency_key
+from message_index import MessageIndex
+
+
+def test_key_needs_a_message_id_or_timestamp():
+    assert idempotency_key({"id": "ABC", "from": "1@c.us", "message": "hi"}) == "id:ABC"
+    assert idempotency_key({"from": "1@c.us", "message": "hi", "timestamp": 1700000000}).startswith("sha256:")
+    # Sending the same text twice is not a redelivery
+    assert idempotency_key({"from": "1@c.us", "message": "/query list my reminders"}) is None
+
+
+def test_repeated_message_without_id_is_indexed_each_time(tmp_path):
+    index = MessageIndex(str(tmp_path / "index.db"))
+    body = b'{"from": "1@c.us", "name": "Ana", "message": "bring the charger"}'
+
+    async def run():
+        index.start()
+        index.add_raw(body)
+        index.add_raw(body)
+        index.add_raw(b'{"id": "A1", "from": "1@c.us", "message": "photos from the party"}')
+        index.add_raw(b'{"id": "A1", "from": "1@c.us", "message": "photos from the party"}')
+        await index.stop()
+
+    asyncio.run(run())
+    assert index.stats()["indexed_total"] == 3
+    index.close()
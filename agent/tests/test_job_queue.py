@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from job_queue import JobQueue
+
+
+def test_unfinished_jobs_survive_a_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+
+    async def first_run():
+        queue = JobQueue(path)
+        queue.open()
+        finished = await queue.put({"message": "one"})
+        await queue.put({"message": "two"})
+        queue.done(await queue.get())
+        await queue.close()
+        return finished
+
+    async def second_run():
+        queue = JobQueue(path)
+        recovered = queue.open()
+        job = await queue.get()
+        await queue.close()
+        return recovered, job
+
+    asyncio.run(first_run())
+    recovered, job = asyncio.run(second_run())
+    assert recovered == 1
+    assert job.payload == {"message": "two"}
+    assert job.attempts == 1
+
+
+def test_slow_disk_does_not_block_the_loop(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.db"))
+    apply_writes = queue._apply_writes
+
+    def slow_apply_writes(batch):
+        time.sleep(0.3)
+        return apply_writes(batch)
+
+    queue._apply_writes = slow_apply_writes
+
+    async def run():
+        queue.open()
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        job_ids = await asyncio.gather(*(queue.put({"message": str(i)}) for i in range(5)))
+        ticker.cancel()
+        await queue.close()
+        return job_ids, ticks
+
+    job_ids, ticks = asyncio.run(run())
+    # The five inserts went out in one commit, while the loop kept running
+    assert job_ids == [1, 2, 3, 4, 5]
+    assert ticks >= 10
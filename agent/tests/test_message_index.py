@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from message_index import MessageIndex
+
+
+def test_bad_timestamp_falls_back_to_now(tmp_path):
+    index = MessageIndex(str(tmp_path / "index.db"))
+
+    async def run():
+        index.start()
+        index.add({"from": "1@c.us", "name": "Ana", "message": "see you tomorrow", "timestamp": "yesterday"})
+        index.add_raw(b'{"id": "2", "from": "1@c.us", "message": "bring the charger", "timestamp": 1e300}')
+        await index.stop()
+
+    asyncio.run(run())
+    assert index.stats()["indexed_total"] == 2
+    assert len(index.search("charger")) == 1
+    index.close()
+
+
+def test_stop_waits_for_the_batch_being_written(tmp_path):
+    index = MessageIndex(str(tmp_path / "index.db"))
+    insert = index._insert
+
+    def slow_insert(batch):
+        time.sleep(0.2)
+        return insert(batch)
+
+    index._insert = slow_insert
+
+    async def run():
+        index.start()
+        index.add({"from": "1@c.us", "name": "Ana", "message": "photos from the party", "timestamp": 1700000000})
+        index._batch_ready.set()
+        await asyncio.sleep(0.05)
+        # The flusher is now inside slow_insert on its thread
+        await index.stop()
+        index.close()
+
+    asyncio.run(run())
+    assert index.stats()["indexed_total"] == 1
@@ -0,0 +1,43 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+from metrics import model_call_timing, record_model_end, record_model_start
+
+
+def model_calls_observed() -> float:
+    return metrics.REGISTRY.get_sample_value("butler_model_call_seconds_count") or 0.0
+
+
+def test_model_call_is_timed_within_a_turn():
+    context = SimpleNamespace(invocation_id="invocation-1")
+    before = model_calls_observed()
+    with model_call_timing():
+        record_model_start(context, None)
+        record_model_end(context, SimpleNamespace(partial=False, usage_metadata=None, error_code=None))
+    assert model_calls_observed() == before + 1
+
+
+def test_failed_model_call_is_dropped_with_its_turn(scratch_data_dir):
+    import agent
+
+    # The turn creates its session in the scratch database from conftest, not in agent/data
+    assert os.path.dirname(agent.session_service.path) == scratch_data_dir
+
+    class FailingRunner:
+        async def run_async(self, **kwargs):
+            # The model call starts, then fails before any response
+            record_model_start(SimpleNamespace(invocation_id="invocation-2"), None)
+            assert "invocation-2" in metrics._model_started.get()
+            raise RuntimeError("model unavailable")
+            yield
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await agent.call_agent_async("/query hi", FailingRunner(), "5511999999999@c.us", "session-metrics-test")
+        return metrics._model_started.get()
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,49 @@
+import asyncio
+
+from google.adk.events import Event
+from google.genai import types
+
+from streaming import StreamingReply
+
+
+class ScriptedRunner:
+    """Yields a fixed list of events in place of an ADK runner."""
+
+    def __init__(self, events):
+        self.events = events
+
+    async def run_async(self, **kwargs):
+        for event in self.events:
+            yield event
+
+
+def model_event(*parts, partial=False):
+    return Event(author="butler", partial=partial, content=types.Content(role="model", parts=list(parts)))
+
+
+def test_text_then_tool_then_text_turn_keeps_the_whole_answer():
+    import agent
+
+    events = [
+        # Step 1 streams some text, then ends in a tool call
+        model_event(types.Part(text="Let me check your reminders."), partial=True),
+        model_event(types.Part(text="Let me check your reminders."),
+                    types.Part(function_call=types.FunctionCall(name="list_tasks", args={}))),
+        Event(author="butler", content=types.Content(role="user", parts=[
+            types.Part(function_response=types.FunctionResponse(name="list_tasks", response={"result": []}))])),
+        # Step 2 arrives in one piece
+        model_event(types.Part(text="You have no reminders.")),
+    ]
+    sent = []
+
+    async def send(text):
+        sent.append(text)
+
+    async def run():
+        stream = StreamingReply(send, ack_text="", min_interval=0, min_chars=0)
+        await agent._run_agent_turn("/query list my reminders", ScriptedRunner(events),
+                                    "5511999999999@c.us", "session-stream-test", stream, None)
+        await stream.finish()
+
+    asyncio.run(run())
+    assert sent == ["Let me check your reminders.", "You have no reminders."]
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import tool_executor
+from tool_executor import _call_key, _Invocation, off_loop, tool_stats, use_prefetched_call
+
+
+def test_prefetched_falsy_result_is_not_run_again():
+    async def run():
+        async def no_tasks():
+            return []
+
+        invocation = _Invocation({})
+        invocation.calls[_call_key("list_tasks", {})] = deque([asyncio.create_task(no_tasks())])
+        tool_executor._invocations["invocation-1"] = invocation
+        try:
+            return await use_prefetched_call(SimpleNamespace(name="list_tasks"), {},
+                                             SimpleNamespace(invocation_id="invocation-1"))
+        finally:
+            tool_executor._invocations.pop("invocation-1", None)
+
+    # ADK only skips the tool when the callback returns something truthy
+    assert asyncio.run(run()) == {"result": []}
+
+
+def test_routed_command_runs_on_tool_threads():
+    from command_router import route_command
+
+    assert tool_executor.tool_executor is not None
+    before = tool_stats["threaded_calls_total"]
+    reply = asyncio.run(route_command("/query what time is it", "5511999999999@c.us"))
+    assert reply.startswith("It's ")
+    assert tool_stats["threaded_calls_total"] == before + 1
+
+
+def test_webhook_stays_fast_while_a_tool_is_slow():
+    import httpx
+    import webhook_server
+
+    assert tool_executor.tool_executor is not None
+
+    def slow_tool() -> dict:
+        time.sleep(0.5)
+        return {"status": "success"}
+
+    async def run():
+        tool = asyncio.create_task(off_loop(slow_tool)())
+        await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=webhook_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://butler") as client:
+            started = time.perf_counter()
+            response = await client.post("/webhook", content=b'{"id": "slow-tool-1", "from": "1@c.us", "message": "ok lol"}',
+                                         headers={"content-type": "application/json"})
+            elapsed = time.perf_counter() - started
+        # The webhook was answered while the tool was still blocking its thread
+        assert not tool.done()
+        await tool
+        return response.status_code, elapsed
+
+    status_code, elapsed = asyncio.run(run())
+    assert status_code == 200
+    assert elapsed < 0.2
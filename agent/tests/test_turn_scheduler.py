@@ -0,0 +1,62 @@
+import asyncio
+
+from budgets import UserBudgets
+from turn_scheduler import TurnScheduler
+
+
+def test_light_user_gets_ahead_of_heavy_backlog():
+    budgets = UserBudgets(window=3600, soft_tokens=1000, hard_tokens=10000, soft_tool_calls=0, hard_tool_calls=0, weights={})
+    heavy = [f"heavy{i}@c.us" for i in range(4)]
+    light = [f"light{i}@c.us" for i in range(8)]
+    for chat_id in heavy:
+        budgets.charge(chat_id, tokens=5000)
+
+    async def run():
+        scheduler = TurnScheduler(max_concurrent=4, priority=budgets.priority)
+        order = []
+
+        def turn(chat_id):
+            async def run_turn():
+                order.append(chat_id)
+                await asyncio.sleep(0.01)
+            return run_turn
+
+        # The heavy chats' backlog is queued first, as a worker would hand it over
+        for chat_id in heavy:
+            for _ in range(5):
+                scheduler.submit(chat_id, turn(chat_id))
+        for chat_id in light:
+            scheduler.submit(chat_id, turn(chat_id))
+        await asyncio.sleep(0)
+        waiting = scheduler.stats()["waiting_for_slot"]
+        while scheduler.stats()["pending"]:
+            await asyncio.sleep(0.01)
+        return order, waiting
+
+    order, waiting = asyncio.run(run())
+    assert waiting == len(heavy) + len(light) - 4
+    # The first four heavy turns already hold the slots; every light turn comes next
+    assert set(order[:4]) == set(heavy)
+    assert order[4:12] == light
+    assert len(order) == 28
+
+
+def test_submit_does_not_wait_for_the_turn():
+    async def run():
+        scheduler = TurnScheduler(max_concurrent=1)
+        finished = asyncio.Event()
+
+        async def slow_turn():
+            await finished.wait()
+
+        scheduler.submit("a@c.us", slow_turn)
+        scheduler.submit("a@c.us", slow_turn)
+        await asyncio.sleep(0)
+        stats = scheduler.stats()
+        finished.set()
+        await scheduler.close()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["pending"] == 2
+    assert stats["running"] == 1
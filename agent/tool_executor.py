@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+from mcp_cache import DEFAULT_TOOL_TTLS, base_tool_name
+
+logger = logging.getLogger(__name__)
+
+# Threads running synchronous tools, so they never block the event loop; 0 runs them on the loop
+TOOL_THREADS = int(os.getenv("TOOL_THREADS", "4"))
+# Run the read-only calls of a model response with several function calls concurrently
+PARALLEL_TOOL_CALLS = os.getenv("PARALLEL_TOOL_CALLS", "true").lower() == "true"
+# Prefetched results nobody picked up (e.g. the turn failed) are dropped after this long
+PREFETCH_MAX_AGE_SECONDS = 300
+
+# Tools that only read, so running them early and side by side is safe:
+# the local read-only tools and the read-only wweb-mcp tools
+PARALLEL_SAFE_TOOLS = {"get_current_time", "list_tasks", "search_messages", *DEFAULT_TOOL_TTLS}
+
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_THREADS, thread_name_prefix="tool") if TOOL_THREADS > 0 else None
+
+tool_stats = {
+    "threaded_calls_total": 0,
+    "threaded_in_flight": 0,
+    "queue_wait_seconds_max": 0.0,
+    "parallel_batches_total": 0,
+    "parallel_calls_total": 0,
+}
+
+CallKey = Tuple[str, str]
+
+
+def off_loop(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Make a synchronous tool function async by running it on `tool_executor`.
+
+    The wrapper keeps the function's name, docstring and signature, so ADK
+    builds the same declaration for it.
+
+    Args:
+        func (Callable[..., Any]): The tool function
+
+    Returns:
+        Callable[..., Any]: An async function with the same signature, or
+            `func` itself if TOOL_THREADS is 0
+    """
+    if tool_executor is None:
+        return func
+
+    def run(queued: float, *args, **kwargs):
+        wait = time.perf_counter() - queued
+        if wait > tool_stats["queue_wait_seconds_max"]:
+            tool_stats["queue_wait_seconds_max"] = wait
+        return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        tool_stats["threaded_calls_total"] += 1
+        tool_stats["threaded_in_flight"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                tool_executor, functools.partial(run, time.perf_counter(), *args, **kwargs))
+        finally:
+            tool_stats["threaded_in_flight"] -= 1
+    return wrapper
+
+
+def is_parallel_safe(tool_name: str) -> bool:
+    """Whether a tool only reads, so it may run before its turn and next to other calls."""
+    return base_tool_name(tool_name) in PARALLEL_SAFE_TOOLS
+
+
+def _call_key(name: str, args: Optional[Dict[str, Any]]) -> CallKey:
+    return name, json.dumps(args or {}, sort_keys=True, default=str)
+
+
+class _Invocation:
+    """Tools and prefetched calls of one agent invocation."""
+
+    def __init__(self, tools: Dict[str, BaseTool]):
+        self.tools = tools
+        self.started = time.monotonic()
+        self.calls: Dict[CallKey, Deque[asyncio.Task]] = {}
+
+
+_invocations: Dict[str, _Invocation] = {}
+
+
+def _discard(invocation: _Invocation):
+    for tasks in invocation.calls.values():
+        for task in tasks:
+            task.cancel()
+
+
+def remember_tools(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """before_model_callback keeping the invocation's tools for `prefetch_parallel_calls`."""
+    if not PARALLEL_TOOL_CALLS:
+        return None
+    invocation = _invocations.get(callback_context.invocation_id)
+    if invocation is not None:
+        invocation.tools = llm_request.tools_dict
+        return None
+    now = time.monotonic()
+    for invocation_id, stale in list(_invocations.items()):
+        if now - stale.started > PREFETCH_MAX_AGE_SECONDS:
+            _discard(_invocations.pop(invocation_id))
+    _invocations[callback_context.invocation_id] = _Invocation(llm_request.tools_dict)
+    return None
+
+
+async def prefetch_parallel_calls(callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+    """
+    after_model_callback starting every read-only call of a multi-call response at once.
+
+    ADK runs the function calls of one response one after the other; the
+    calls started here are picked up by `use_prefetched_call` when their
+    turn comes, so the turn waits for the slowest call instead of the sum.
+    """
+    if not PARALLEL_TOOL_CALLS or llm_response.partial:
+        return None
+    parts = llm_response.content.parts if llm_response.content and llm_response.content.parts else []
+    calls = [part.function_call for part in parts if part.function_call]
+    if not calls:
+        # The final answer; nothing else will be prefetched for this invocation
+        invocation = _invocations.pop(callback_context.invocation_id, None)
+        if invocation is not None:
+            _discard(invocation)
+        return None
+    invocation = _invocations.get(callback_context.invocation_id)
+    safe = [call for call in calls if is_parallel_safe(call.name)]
+    if invocation is None or len(calls) < 2 or len(safe) < 2:
+        return None
+    for call in safe:
+        tool = invocation.tools.get(call.name)
+        if tool is None:
+            continue
+        tool_context = ToolContext(callback_context._invocation_context)
+        task = asyncio.create_task(tool.run_async(args=call.args or {}, tool_context=tool_context))
+        invocation.calls.setdefault(_call_key(call.name, call.args), deque()).append(task)
+        tool_stats["parallel_calls_total"] += 1
+    tool_stats["parallel_batches_total"] += 1
+    logger.info(f"Running {len(safe)} of {len(calls)} tool calls concurrently")
+    return None
+
+
+async def use_prefetched_call(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Any]:
+    """
+    before_tool_callback returning the result of a call started by `prefetch_parallel_calls`.
+
+    Returns:
+        Optional[Any]: The call's result, never falsy so ADK does not run the
+            tool again; None if the call was not prefetched
+    """
+    invocation = _invocations.get(tool_context.invocation_id)
+    if invocation is None:
+        return None
+    tasks = invocation.calls.get(_call_key(tool.name, args))
+    if not tasks:
+        return None
+    result = await tasks.popleft()
+    # ADK calls the tool anyway when this returns something falsy (None, 0, "", [], {}), so the
+    # result is wrapped the way ADK wraps non-dict tool results
+    if not isinstance(result, dict) or not result:
+        result = {"result": result}
+    return result
@@ -0,0 +1,43 @@
+from typing import Dict, Any
+from message_index import message_index, MESSAGE_INDEX_ENABLED
+
+MAX_RESULTS = 20
+
+def search_messages(query: str, chat_id: str = "", limit: int = 5) -> Dict[str, Any]:
+    """
+    Full-text search over the messages the butler has received, returning only the best snippets.
+    Prefer this over paging chat history when looking for a message about a topic.
+    
+    Args:
+        query (str): Words to search for (all must appear; the last one also matches as a prefix)
+        chat_id (str): Optional chat ID (e.g. "5511999999999@c.us") to restrict the search to one chat
+        limit (int): Maximum number of results, up to 20
+    
+    Returns:
+        Dict[str, Any]: A dictionary containing:
+            - status: "success" or "error"
+            - error_message: Description of the error if status is "error"
+            - result: List of matches, best first, each with:
+                - chat_id: Chat the message was sent in
+                - sender: Name of the sender
+                - time: When the message was received (YYYY-MM-DD HH:MM)
+                - snippet: The matching part of the message, with matched words between asterisks
+    """
+    if not MESSAGE_INDEX_ENABLED:
+        return {
+            "status": "error",
+            "error_message": "The local message index is disabled",
+            "result": []
+        }
+    try:
+        return {
+            "status": "success",
+            "error_message": None,
+            "result": message_index.search(query, chat_id, max(1, min(limit, MAX_RESULTS)))
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "error_message": f"Error searching messages: {str(e)}",
+            "result": []
+        }
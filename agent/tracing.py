@@ -0,0 +1,344 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.events import Event
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+logger = logging.getLogger(__name__)
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+# Number of slowest and of most recent traces kept
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "20"))
+# Events recorded per trace; later ones are only counted
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "500"))
+# Start sampling the event loop's stack once an invocation runs this long; 0 disables it
+TRACE_PROFILE_THRESHOLD_SECONDS = float(os.getenv("TRACE_PROFILE_THRESHOLD_SECONDS", "0"))
+TRACE_PROFILE_INTERVAL_MS = float(os.getenv("TRACE_PROFILE_INTERVAL_MS", "10"))
+# Characters of tool arguments and event text kept in a trace
+TRACE_PREVIEW_CHARS = 200
+PROFILE_MAX_DEPTH = 64
+PROFILE_TOP_STACKS = 50
+
+current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+
+_trace_ids = itertools.count(1)
+
+
+def _preview(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return text if len(text) <= TRACE_PREVIEW_CHARS else text[:TRACE_PREVIEW_CHARS] + "..."
+
+
+def _size(value: Any) -> int:
+    if hasattr(value, "model_dump_json"):
+        return len(value.model_dump_json())
+    return len(json.dumps(value, default=str))
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack at a fixed interval from a helper thread.
+
+    Only code that is running shows up; time the event loop spends waiting
+    appears as the selector call. Other turns running concurrently on the
+    same loop are sampled too.
+    """
+
+    _active = threading.Lock()
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """Start sampling unless another sampler is already running."""
+        if not StackSampler._active.acquire(blocking=False):
+            return False
+        self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(stack))] += 1
+                self.samples += 1
+        finally:
+            StackSampler._active.release()
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop sampling and return the most frequent stacks, in collapsed (flame graph) format."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "stacks": [{"stack": stack, "count": count} for stack, count in self.counts.most_common(PROFILE_TOP_STACKS)],
+        }
+
+
+class Trace:
+    """Timeline of one agent invocation: every runner event, model call and tool call."""
+
+    def __init__(self, user_id: str, query: str):
+        self.id = next(_trace_ids)
+        self.user_id = user_id
+        self.query = _preview(query)
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.events: List[Dict[str, Any]] = []
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped_events = 0
+        self.error: Optional[str] = None
+        self.profile: Optional[Dict[str, Any]] = None
+        self._open: Dict[Any, Dict[str, Any]] = {}
+        self._sampler: Optional[StackSampler] = None
+        self._profile_timer: Optional[asyncio.TimerHandle] = None
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._started
+
+    def add_event(self, event: Event):
+        """Record a runner event: who sent it, what it holds and when."""
+        if len(self.events) >= TRACE_MAX_EVENTS:
+            self.dropped_events += 1
+            return
+        record: Dict[str, Any] = {"at": self._now(), "author": event.author}
+        if event.partial:
+            record["partial"] = True
+        if event.is_final_response():
+            record["final"] = True
+        parts = event.content.parts if event.content and event.content.parts else []
+        text = "".join(part.text for part in parts if part.text)
+        if text:
+            record["text_chars"] = len(text)
+            if not event.partial:
+                record["text"] = _preview(text)
+        calls = [part.function_call.name for part in parts if part.function_call]
+        if calls:
+            record["function_calls"] = calls
+        responses = [part.function_response.name for part in parts if part.function_response]
+        if responses:
+            record["function_responses"] = responses
+        if event.error_code:
+            record["error"] = f"{event.error_code}: {event.error_message}"
+        self.events.append(record)
+
+    def open_span(self, key: Any, name: str, category: str, args: Optional[Dict[str, Any]] = None):
+        """Start a timed span, closed later by `close_span` with the same key."""
+        self._open[key] = {"name": name, "cat": category, "start": self._now(), "args": args or {}}
+
+    def close_span(self, key: Any, **args):
+        """Finish a span opened with `open_span`, adding `args` to it."""
+        span = self._open.pop(key, None)
+        if span is None:
+            return
+        span["duration"] = self._now() - span["start"]
+        span["args"].update(args)
+        self.spans.append(span)
+
+    def arm_profiler(self, threshold: float, interval: float):
+        """Start the stack sampler if the invocation is still running after `threshold` seconds."""
+        thread_id = threading.get_ident()
+
+        def start():
+            sampler = StackSampler(thread_id, interval)
+            if sampler.start():
+                self._sampler = sampler
+                logger.info(f"Trace {self.id} passed {threshold}s; sampling stacks")
+
+        self._profile_timer = asyncio.get_running_loop().call_later(threshold, start)
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Close the trace and collect the profile, if one was taken."""
+        self.duration = self._now()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self._profile_timer is not None:
+            self._profile_timer.cancel()
+        if self._sampler is not None:
+            self.profile = self._sampler.stop()
+            self._sampler = None
+        # Spans left open were cut short by an error
+        for key in list(self._open):
+            self.close_span(key, unfinished=True)
+
+    def summary(self) -> Dict[str, Any]:
+        """One-line overview used in trace listings."""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "query": self.query,
+            "started_at": self.started_at,
+            "duration_seconds": self.duration,
+            "events": len(self.events) + self.dropped_events,
+            "error": self.error,
+            "profiled": self.profile is not None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The full trace, with the gap before each event."""
+        events = []
+        previous = 0.0
+        for record in self.events:
+            events.append({**record, "gap_ms": round((record["at"] - previous) * 1000, 3)})
+            previous = record["at"]
+        return {
+            **self.summary(),
+            "dropped_events": self.dropped_events,
+            "timeline": events,
+            "spans": self.spans,
+            "profile": self.profile,
+        }
+
+    def to_chrome(self) -> List[Dict[str, Any]]:
+        """The trace as Chrome trace events (chrome://tracing, Perfetto)."""
+        tid = self.id
+        base = self.started_at * 1e6
+        events = [
+            {"name": "invocation", "cat": "agent", "ph": "X", "ts": base, "dur": (self.duration or 0) * 1e6,
+             "pid": 1, "tid": tid, "args": {"user_id": self.user_id, "query": self.query, "error": self.error}},
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": f"trace {self.id} {self.user_id}"}},
+        ]
+        for span in self.spans:
+            events.append({"name": span["name"], "cat": span["cat"], "ph": "X", "ts": base + span["start"] * 1e6,
+                           "dur": span["duration"] * 1e6, "pid": 1, "tid": tid, "args": span["args"]})
+        for record in self.events:
+            args = {key: value for key, value in record.items() if key != "at"}
+            events.append({"name": f"event:{record['author']}", "cat": "event", "ph": "i", "s": "t",
+                           "ts": base + record["at"] * 1e6, "pid": 1, "tid": tid, "args": args})
+        return events
+
+
+class TraceBuffer:
+    """Keeps the N slowest and the N most recent finished traces."""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.size = size
+        self.recent: Deque[Trace] = deque(maxlen=size)
+        self._slowest: List[tuple] = []  # min-heap of (duration, id, trace)
+        self._recorded = 0
+
+    def add(self, trace: Trace):
+        """Store a finished trace, displacing the oldest recent and the fastest slow one."""
+        self._recorded += 1
+        self.recent.append(trace)
+        entry = (trace.duration, trace.id, trace)
+        if len(self._slowest) < self.size:
+            heapq.heappush(self._slowest, entry)
+        elif trace.duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self) -> List[Trace]:
+        """The slowest traces, slowest first."""
+        return [trace for _, _, trace in sorted(self._slowest, reverse=True)]
+
+    def get(self, trace_id: int) -> Optional[Trace]:
+        """A kept trace by ID, or None."""
+        for trace in itertools.chain(self.recent, (entry[2] for entry in self._slowest)):
+            if trace.id == trace_id:
+                return trace
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Trace counts for monitoring."""
+        return {
+            "enabled": TRACE_ENABLED,
+            "recorded_total": self._recorded,
+            "slowest_seconds": max((entry[0] for entry in self._slowest), default=0.0),
+        }
+
+
+trace_buffer = TraceBuffer()
+
+
+def start_trace(user_id: str, query: str) -> Optional[Trace]:
+    """
+    Start tracing an invocation in the current context.
+
+    Args:
+        user_id (str): The user the invocation is for
+        query (str): The query text
+
+    Returns:
+        Optional[Trace]: The trace, or None if tracing is disabled
+    """
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(user_id, query)
+    current_trace.set(trace)
+    if TRACE_PROFILE_THRESHOLD_SECONDS > 0:
+        trace.arm_profiler(TRACE_PROFILE_THRESHOLD_SECONDS, TRACE_PROFILE_INTERVAL_MS / 1000)
+    return trace
+
+
+def finish_trace(trace: Optional[Trace], error: Optional[BaseException] = None):
+    """Finish a trace started with `start_trace` and store it."""
+    if trace is None:
+        return
+    trace.finish(error)
+    current_trace.set(None)
+    trace_buffer.add(trace)
+
+
+def trace_model_start(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """before_model_callback opening a model span on the current trace."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.open_span("model", "model", "model", {"contents": len(llm_request.contents)})
+    return None
+
+
+def trace_model_end(callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+    """after_model_callback closing the model span once the response is complete."""
+    trace = current_trace.get()
+    if trace is not None and not llm_response.partial:
+        usage = llm_response.usage_metadata
+        trace.close_span(
+            "model",
+            prompt_tokens=usage.prompt_token_count if usage else None,
+            completion_tokens=usage.candidates_token_count if usage else None,
+            cached_tokens=usage.cached_content_token_count if usage else None,
+        )
+    return None
+
+
+def trace_tool_start(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> None:
+    """before_tool_callback opening a span with the tool's arguments."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.open_span(("tool", tool_context.function_call_id), tool.name, "tool", {"args": _preview(args)})
+    return None
+
+
+def trace_tool_end(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Any) -> None:
+    """after_tool_callback closing the tool span with the size of its result."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.close_span(("tool", tool_context.function_call_id), result_chars=_size(tool_response))
+    return None
@@ -0,0 +1,166 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Any, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_TURNS = int(os.getenv("MAX_CONCURRENT_TURNS", "4"))
+MAX_PENDING_TURNS = int(os.getenv("MAX_PENDING_TURNS", "100"))
+
+Turn = Callable[[], Awaitable[Any]]
+
+
+class SchedulerBusy(Exception):
+    """Raised when a turn is submitted while too many turns are already pending."""
+
+
+class TurnScheduler:
+    """
+    Orders agent turns per chat and caps how many run at once.
+
+    Every chat gets a FIFO lane, drained by a background task that is
+    started when a turn is submitted to an idle lane; submitting never
+    waits, so callers go straight back to taking work and the scheduler
+    sees every chat that has turns waiting. At most `max_concurrent` turns
+    run across all lanes, and once `max_pending` turns are parked or
+    running new submissions are refused.
+
+    When every slot is taken, a freed slot goes to the waiting lane with the
+    lowest `priority(chat_id)`, ties in arrival order; the default priority
+    is the same for every chat, which makes it first come, first served.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_TURNS,
+        max_pending: int = MAX_PENDING_TURNS,
+        priority: Callable[[str], float] = lambda chat_id: 0.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.priority = priority
+        self._free_slots = max_concurrent
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self._lanes: Dict[str, Deque[Turn]] = {}
+        self._pending = 0
+        self._running = 0
+        self._shed_total = 0
+        self._unslotted_total = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    def is_saturated(self) -> bool:
+        """Whether new turns would currently be refused."""
+        return self._pending >= self.max_pending
+
+    def submit(self, chat_id: str, turn: Turn):
+        """
+        Queue a turn on the chat's lane, starting the lane if it is idle.
+
+        The turn callable is responsible for its own error handling; exceptions
+        it raises are logged and do not stop the lane.
+
+        Args:
+            chat_id (str): The chat the turn belongs to
+            turn (Turn): Zero-argument coroutine function running the turn
+
+        Raises:
+            SchedulerBusy: If `max_pending` turns are already parked or running
+        """
+        if self.is_saturated():
+            self._shed_total += 1
+            raise SchedulerBusy(f"{self._pending} turns pending (limit {self.max_pending})")
+        self._pending += 1
+        lane = self._lanes.get(chat_id)
+        if lane is not None:
+            lane.append(turn)
+            return
+        lane = self._lanes[chat_id] = deque([turn])
+        self._track(self._drain(chat_id, lane))
+
+    def run_without_slot(self, turn: Turn):
+        """
+        Run a turn that does not call the model (e.g. a fixed reply) right
+        away, outside the chat's lane and without taking a turn slot.
+
+        Args:
+            turn (Turn): Zero-argument coroutine function running the turn
+        """
+        self._unslotted_total += 1
+        self._track(turn())
+
+    def _track(self, coroutine: Awaitable[Any]):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Cancel running and parked turns; their callers' cleanup decides what happens to them."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _drain(self, chat_id: str, lane: Deque[Turn]):
+        """Run a lane's turns one at a time until it is empty."""
+        try:
+            while lane:
+                next_turn = lane[0]
+                try:
+                    await self._acquire(chat_id)
+                    self._running += 1
+                    try:
+                        await next_turn()
+                    finally:
+                        self._running -= 1
+                        self._release()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Turn for chat {chat_id} failed: {str(e)}")
+                finally:
+                    lane.popleft()
+                    self._pending -= 1
+        finally:
+            # On cancellation the parked turns are dropped along with the lane
+            self._pending -= len(lane)
+            del self._lanes[chat_id]
+
+    async def _acquire(self, chat_id: str):
+        """Wait for a turn slot, queued by the chat's priority."""
+        if self._free_slots > 0 and not self._waiters:
+            self._free_slots -= 1
+            return
+        granted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (self.priority(chat_id), next(self._arrivals), granted))
+        try:
+            await granted
+        except asyncio.CancelledError:
+            if granted.done() and not granted.cancelled():
+                self._release()  # Handed a slot just as it was cancelled
+            raise
+
+    def _release(self):
+        """Hand a finished turn's slot to the first waiter, or free it."""
+        while self._waiters:
+            _, _, granted = heapq.heappop(self._waiters)
+            if not granted.done():
+                granted.set_result(None)
+                return
+        self._free_slots += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Lane and concurrency figures for monitoring."""
+        return {
+            "pending": self._pending,
+            "running": self._running,
+            "waiting_for_slot": sum(1 for _, _, granted in self._waiters if not granted.done()),
+            "active_lanes": len(self._lanes),
+            "max_concurrent": self.max_concurrent,
+            "max_pending": self.max_pending,
+            "shed_total": self._shed_total,
+            "unslotted_total": self._unslotted_total,
+        }
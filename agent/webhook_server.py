@@ -1,12 +1,28 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 import asyncio
 import logging
-from typing import Dict, Any
+import secrets
+import time
+from typing import Dict, Any, List, Optional
 import os
-from agent import call_agent_async, initialize_agent_and_runner
+from agent import APP_NAME, call_agent_async, context_cache, initialize_agent_and_runner, record_exchange, session_service, whatsapp_mcp
+from budgets import user_budgets
+from command_router import route_command, router_stats
+from compaction import compaction_stats
+from dedup import IdempotencyCache, idempotency_key
+from ingest import WEBHOOK_RECORD_PATH, chat_id_from_body, ingest_stats, loads, log_dropped, might_be_query, record_body
+from metrics import ERRORS, STAGE_SECONDS, register_stats, render_metrics, timed
+from mcp_cache import tool_result_cache
+from message_index import message_index, MESSAGE_INDEX_ENABLED
+from tool_executor import tool_stats
+from tracing import trace_buffer
+from streaming import STREAM_REPLIES, StreamingReply, record_buffered_reply, streaming_stats
 from contextlib import asynccontextmanager
-import httpx
+from job_queue import Job, JobQueue, QueueFull
+from turn_scheduler import TurnScheduler, SchedulerBusy
+from whatsapp_client import WhatsAppSender
+from task_scheduler import ScheduledTask, task_scheduler
 
 # Configure logging
 logging.basicConfig(
@@ -17,98 +33,342 @@ logger = logging.getLogger(__name__)
 
 # Get message prefix from environment variable or use default
 QUERY_PREFIX = os.getenv("QUERY_PREFIX", "/query ")
-WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
-WHATSAPP_API_KEY = os.getenv("WHATSAPP_API_KEY")
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "4"))
+BUSY_REPLY = os.getenv("BUSY_REPLY", "I'm busy with too many requests right now, please try again in a few minutes.")
+# Seconds clients are asked to wait before retrying a shed webhook
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "30"))
+# How long a warm-up (on start, or ahead of a busy minute) waits for the MCP connection
+MCP_WARMUP_TIMEOUT_SECONDS = float(os.getenv("MCP_WARMUP_TIMEOUT_SECONDS", "10"))
+# On shutdown, running turns get this long to finish; unfinished and queued jobs are kept for the next start
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+# /debug/traces shows user queries and tool arguments, so it is off unless this token is set
+# and sent as "Authorization: Bearer <token>"
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
+# Cold-start figures: time until the service accepts webhooks, time until workers start
+# (sessions restored, MCP connected), and duration of the first agent turn
+startup_stats = {
+    "startup_seconds": None,
+    "warmup_seconds": None,
+    "sessions_restored": None,
+    "first_query_seconds": None,
+}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    started = time.perf_counter()
     runner, agent  = await initialize_agent_and_runner()
     app.state.runner = runner
     app.state.agent = agent
     logger.info("Agent and runner initialized and stored in app.state.")
+    sender = WhatsAppSender()
+    sender.start()
+    app.state.sender = sender
+    job_queue = JobQueue()
+    job_queue.open()
+    app.state.job_queue = job_queue
+    app.state.turn_scheduler = TurnScheduler(priority=user_budgets.priority)
+    app.state.idempotency = IdempotencyCache()
+    app.state.warm = asyncio.Event()
+    app.state.draining = False
+    register_stats(collect_stats)
+    warming = asyncio.create_task(warm_up(started))
+    workers = [asyncio.create_task(queue_worker(i)) for i in range(WORKER_COUNT)]
+    logger.info(f"Started {WORKER_COUNT} queue worker(s).")
+    task_scheduler.start(fire_scheduled_task, prewarm_scheduled_tasks)
+    if MESSAGE_INDEX_ENABLED:
+        message_index.start()
+    startup_stats["startup_seconds"] = time.perf_counter() - started
+    logger.info(f"Started in {startup_stats['startup_seconds']:.2f}s; sessions and MCP connection warming up in the background.")
     yield
-    logger.info("Agent and runner resources closed.")
+    # Drain: no new turns are started, running ones get SHUTDOWN_DRAIN_SECONDS to finish
+    stopping = time.perf_counter()
+    app.state.draining = True
+    await task_scheduler.stop()
+    if not await job_queue.wait_idle(SHUTDOWN_DRAIN_SECONDS):
+        logger.warning(f"{job_queue.stats()['in_flight']} turn(s) still running after {SHUTDOWN_DRAIN_SECONDS:g}s; stopping them")
+    for task in (warming, *workers):
+        task.cancel()
+    await asyncio.gather(warming, *workers, return_exceptions=True)
+    await app.state.turn_scheduler.close()
+    released = job_queue.release_all()
+    if released:
+        logger.info(f"Kept {released} unfinished job(s) for the next start")
+    await message_index.stop()
+    message_index.close()
+    await job_queue.close()
+    task_scheduler.close()
+    await whatsapp_mcp.close()
+    await sender.close()
+    hot_sessions = await session_service.snapshot_hot()
+    await session_service.close()
+    logger.info(f"Drained in {time.perf_counter() - stopping:.2f}s and saved {hot_sessions} hot session(s); agent and runner resources closed.")
 
 app = FastAPI(title="WhatsApp Butler Webhook", lifespan=lifespan)
 
+async def warm_up(started: float):
+    """
+    Reload the sessions that were hot at the last shutdown and wait for the
+    MCP connection, then let the queue workers start, so recovered and new
+    jobs do not pay for a cold start
+    
+    Args:
+        started (float): perf_counter() value at the start of the lifespan
+    """
+    try:
+        startup_stats["sessions_restored"] = await session_service.restore_hot()
+    except Exception as e:
+        logger.error(f"Could not restore hot sessions: {str(e)}")
+    try:
+        if not await whatsapp_mcp.wait_ready(MCP_WARMUP_TIMEOUT_SECONDS):
+            logger.warning(f"MCP connection not ready after {MCP_WARMUP_TIMEOUT_SECONDS:g}s; starting workers anyway")
+        startup_stats["warmup_seconds"] = time.perf_counter() - started
+        logger.info(f"Warmed up in {startup_stats['warmup_seconds']:.2f}s with {startup_stats['sessions_restored']} restored session(s)")
+    finally:
+        app.state.warm.set()
+
+async def fire_scheduled_task(task: ScheduledTask):
+    """
+    Queue a due scheduled task as an agent query from the user's past self,
+    and wait for its turn to finish so the scheduler can cap concurrent runs
+    
+    Args:
+        task (ScheduledTask): The task that is due
+    """
+    job_queue = app.state.job_queue
+    job_id = await job_queue.put({
+        "name": "My past self",
+        "from": task.user_id,
+        "message": f"{QUERY_PREFIX}{task.message}"
+    })
+    logger.info(f"Fired scheduled task {task.id} for {task.user_id}")
+    await job_queue.wait(job_id)
+
+async def prewarm_scheduled_tasks(tasks: List[ScheduledTask]):
+    """
+    Get ready for a minute with many scheduled tasks: make sure the MCP
+    connection is up and load the users' sessions into the hot cache
+    
+    Args:
+        tasks (List[ScheduledTask]): The tasks due in that minute
+    """
+    if not await whatsapp_mcp.wait_ready(MCP_WARMUP_TIMEOUT_SECONDS):
+        logger.warning("MCP connection still not ready ahead of scheduled tasks")
+    user_ids = list(dict.fromkeys(task.user_id for task in tasks))
+    # Loading more sessions than the hot cache holds would only evict the first ones again
+    for user_id in user_ids[:session_service.cache_size]:
+        await session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=user_id)
+
+@timed("send")
 async def send_message_to_whatsapp(response: str, chat_id: str):
     """
-    Send a message to WhatsApp
+    Send a message to WhatsApp, split into several messages if it is too long
     Args:
         response (str): The message to send
         chat_id (str): The chat ID of the message
     """
-    # Send the message to the WHATSAPP_API_URL
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{WHATSAPP_API_URL}/send", 
-                          headers={"Authorization": f"Bearer {WHATSAPP_API_KEY}"},
-                          json={"message": response, "number": chat_id})
+    try:
+        await app.state.sender.send(response, chat_id)
+    except Exception:
+        ERRORS.labels("send").inc()
+        raise
     logger.info(f"Message sent to WhatsApp: {response} to {chat_id}")
 
-async def process_message(message: Dict[str, Any]) -> Dict[str, Any]:
+def is_agent_query(message: Dict[str, Any]) -> bool:
     """
-    Process incoming WhatsApp message and call agent
+    Check whether an incoming WhatsApp message is addressed to the agent
     
     Args:
         message (Dict[str, Any]): The incoming message data
         
     Returns:
-        Dict[str, Any]: Response containing status and agent response   
+        bool: True if the message starts with QUERY_PREFIX
     """
-    try:
-        # Extract message content
-        content = message.get("message", "")
-        sender = message.get("name", "")
-        chat_id = message.get("from", "")
-        if not content:
-            return JSONResponse(
-                status_code=200,
-                content={"status": "success"}
-            )
+    content = message.get("message", "")
+    return bool(content) and content.startswith(QUERY_PREFIX)
 
-        # Skip if the message is not from the bot
-        if not content.startswith(QUERY_PREFIX):
-            return JSONResponse(
-                status_code=200,
-                content={"status": "success"}
-            )
-            
-        logger.info(f"Processing message from {sender} in chat {chat_id}")
-        
-        # Use runner from app.state
-        runner = app.state.runner
-        response = await call_agent_async(content, runner, chat_id, chat_id)
-        logger.info(f"Agent response: {response}")
+@timed("turn")
+async def process_message(message: Dict[str, Any], degraded: bool = False):
+    """
+    Call the agent for a queued WhatsApp message and send back its reply
+    
+    Args:
+        message (Dict[str, Any]): The incoming message data
+        degraded (bool): The user is over their hard budget; only simple
+            commands are answered, everything else gets the budget reply
+    """
+    content = message.get("message", "")
+    sender = message.get("name", "")
+    chat_id = message.get("from", "")
+
+    logger.info(f"Processing message from {sender} in chat {chat_id}")
+
+    # Simple commands are answered directly, without a model round trip
+    started = time.perf_counter()
+    response = await route_command(content, chat_id)
+    if response is not None:
         await send_message_to_whatsapp(response, chat_id)
-        return JSONResponse(
-            status_code=200,
-            content={"status": "success"}
-        )
+        record_buffered_reply(time.perf_counter() - started)
+        await record_exchange(chat_id, chat_id, content, response)
+        return
+
+    # Users over their hard budget get a fixed reply instead of a model turn
+    response = user_budgets.degraded_reply(chat_id) if degraded else user_budgets.admit(chat_id)
+    if response is not None:
+        await send_message_to_whatsapp(response, chat_id)
+        record_buffered_reply(time.perf_counter() - started)
+        return
+    
+    # Use runner from app.state
+    runner = app.state.runner
+    first_query = startup_stats["first_query_seconds"] is None
+    if STREAM_REPLIES:
+        reply = StreamingReply(lambda text: send_message_to_whatsapp(text, chat_id))
+        await reply.ack()
+        started = time.perf_counter()
+        response = await call_agent_async(content, runner, chat_id, chat_id, stream=reply)
+        if first_query:
+            startup_stats["first_query_seconds"] = time.perf_counter() - started
+        logger.info(f"Agent response: {response}")
+        await reply.finish()
+        return
+
+    started = time.perf_counter()
+    response = await call_agent_async(content, runner, chat_id, chat_id)
+    if first_query:
+        startup_stats["first_query_seconds"] = time.perf_counter() - started
+    logger.info(f"Agent response: {response}")
+    await send_message_to_whatsapp(response, chat_id)
+    record_buffered_reply(time.perf_counter() - started)
+
+async def run_job(job: Job, degraded: bool = False):
+    """
+    Run a queued job as one agent turn and mark it done
+    
+    Args:
+        job (Job): The job taken from the queue
+        degraded (bool): Answer without the model; see process_message
+    """
+    job_queue = app.state.job_queue
+    if app.state.draining:
+        # Shutting down: keep it for the next start instead of starting a turn now
+        job_queue.release(job)
+        return
+    try:
+        await process_message(job.payload, degraded=degraded)
+        job_queue.done(job)
+    except asyncio.CancelledError:
+        # Leave the job on disk so it is picked up again after a restart; see lifespan
+        raise
     except Exception as e:
-        logger.error(f"Error processing message: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Job {job.id} failed: {str(e)}")
+        ERRORS.labels("job").inc()
+        job_queue.done(job, failed=True)
+
+async def queue_worker(worker_id: int):
+    """
+    Drain the job queue, once warm-up is over, handing each job to its chat's lane in the turn scheduler
+
+    Workers do not wait for the turns they hand over, so every chat with
+    queued work competes for turn slots by budget priority rather than in
+    queue order.
+    
+    Args:
+        worker_id (int): Index of this worker, used in logs
+    """
+    job_queue = app.state.job_queue
+    turn_scheduler = app.state.turn_scheduler
+    await app.state.warm.wait()
+    while True:
+        job = await job_queue.get()
+        chat_id = job.payload.get("from", "")
+        if user_budgets.over_hard_limit(chat_id):
+            # Answered without the model, so it neither waits in the chat's lane nor takes a turn slot
+            turn_scheduler.run_without_slot(lambda job=job: run_job(job, degraded=True))
+            continue
+        try:
+            turn_scheduler.submit(chat_id, lambda job=job: run_job(job))
+        except SchedulerBusy as e:
+            logger.warning(f"Worker {worker_id} shed job {job.id} for chat {chat_id}: {str(e)}")
+            job_queue.done(job, failed=True)
+            try:
+                await send_message_to_whatsapp(BUSY_REPLY, chat_id)
+            except Exception as send_error:
+                logger.error(f"Could not send busy reply to {chat_id}: {str(send_error)}")
 
 @app.post("/webhook")
 async def webhook(request: Request):
     """
-    Webhook endpoint for receiving WhatsApp messages
+    Webhook endpoint for receiving WhatsApp messages.
+    Agent queries are queued and acknowledged with 202; the agent runs in
+    the background and replies through the WhatsApp API. Redeliveries of a
+    message already accepted get the original response and are not queued
+    again.
     
     Args:
         request (Request): The incoming request
         
     Returns:
-        JSONResponse: Response containing status and agent response
+        JSONResponse: Response containing status and queued job ID
     """
     try:
-        data = await request.json()
+        body = await request.body()
+        ingest_stats["received_total"] += 1
+        if WEBHOOK_RECORD_PATH:
+            record_body(body)
+        maybe_query = might_be_query(body)
+        if not maybe_query:
+            # A non-query message is not decoded here: cache invalidation only needs its
+            # chat ID, read off the raw bytes, and the message index decodes its batches
+            # (skipping redeliveries) in its writer thread
+            if len(tool_result_cache):
+                tool_result_cache.invalidate_chat(chat_id_from_body(body))
+            if MESSAGE_INDEX_ENABLED:
+                message_index.add_raw(body)
+            log_dropped(body, decoded=False)
+            return JSONResponse(
+                status_code=200,
+                content={"status": "success"}
+            )
+        with STAGE_SECONDS.labels("webhook_parse").time():
+            data = loads(body)
+        key = idempotency_key(data)
+        previous = app.state.idempotency.get(key) if key is not None else None
+        if previous is not None:
+            status_code, content = previous
+            logger.info(f"Suppressed duplicate webhook {key}")
+            return JSONResponse(status_code=status_code, content=content)
+        # Any new message makes cached MCP results for its chat stale
+        tool_result_cache.invalidate_chat(data.get("from"))
+        if MESSAGE_INDEX_ENABLED:
+            message_index.add(data)
+        if not is_agent_query(data):
+            log_dropped(body)
+            if key is not None:
+                app.state.idempotency.put(key, 200, {"status": "success"})
+            return JSONResponse(
+                status_code=200,
+                content={"status": "success"}
+            )
         logger.info(f"Received webhook: {data}")
-        await process_message(data)
+        job_id = await app.state.job_queue.put(data)
+        # Only accepted messages are remembered, so a retry after 429 or 500 is processed
+        if key is not None:
+            app.state.idempotency.put(key, 202, {"status": "queued", "job_id": job_id})
+        return JSONResponse(
+            status_code=202,
+            content={"status": "queued", "job_id": job_id}
+        )
+    except QueueFull as e:
+        logger.warning(f"Webhook shed: {str(e)}")
         return JSONResponse(
-            status_code=200,
-            content={"status": "success"}
+            status_code=429,
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            content={"status": "busy", "error": str(e)}
         )
     except Exception as e:
         logger.error(f"Webhook error: {str(e)}")
+        ERRORS.labels("webhook").inc()
         return JSONResponse(
             status_code=500,
             content={"status": "error", "error": str(e)}
@@ -124,16 +384,123 @@ async def health_check():
     """
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness endpoint: 200 once the agent is initialized, warm-up is over
+    and the WhatsApp MCP server is connected, 503 while it is still
+    (re)connecting or the service is draining.
+    /health only reports that the process is alive.
+    
+    Returns:
+        JSONResponse: Readiness status and MCP connection details
+    """
+    mcp = whatsapp_mcp.stats()
+    warm = getattr(app.state, "warm", None)
+    draining = getattr(app.state, "draining", False)
+    ready = (getattr(app.state, "runner", None) is not None and warm is not None and warm.is_set()
+             and mcp["ready"] and not draining)
+    status = "ready" if ready else "draining" if draining else "starting"
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": status, "mcp": mcp}
+    )
+
+def collect_stats() -> Dict[str, Any]:
+    """Current figures of every component, by section"""
+    return {
+        "queue": app.state.job_queue.stats(),
+        "startup": startup_stats,
+        "mcp": whatsapp_mcp.stats(),
+        "context_cache": context_cache.stats(),
+        "ingest": ingest_stats,
+        "dedup": app.state.idempotency.stats(),
+        "turns": app.state.turn_scheduler.stats(),
+        "sender": app.state.sender.stats(),
+        "sessions": session_service.stats(),
+        "compaction": compaction_stats,
+        "command_router": router_stats,
+        "budgets": user_budgets.stats(),
+        "scheduled_tasks": task_scheduler.stats(),
+        "tools": tool_stats,
+        "mcp_cache": tool_result_cache.stats(),
+        "message_index": message_index.stats(),
+        "time_to_first_message": streaming_stats(),
+        "tracing": trace_buffer.stats(),
+    }
+
+@app.get("/stats")
+async def stats():
+    """
+    Runtime statistics endpoint
+    
+    Returns:
+        Dict[str, Any]: Startup, MCP connection, context cache, job queue, ingest, duplicate suppression, turn scheduler, WhatsApp sender, session cache, compaction, command router, per-user budget, scheduled task, tool execution, MCP cache, message index, time-to-first-message and tracing figures
+    """
+    return collect_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics endpoint: per-stage, model and tool latency
+    histograms, token and error counters, and the /stats figures as gauges
+    
+    Returns:
+        Response: Metrics in the Prometheus text format
+    """
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/debug/traces")
+async def debug_traces(request: Request, kind: str = "slowest", format: str = "json", id: Optional[int] = None):
+    """
+    Recorded agent invocations: a timeline of runner events with the model
+    and tool spans, plus a stack profile for invocations that crossed
+    TRACE_PROFILE_THRESHOLD_SECONDS. Only served when DEBUG_TOKEN is set,
+    to requests that send it as a bearer token
+    
+    Args:
+        request (Request): The request, for its Authorization header
+        kind (str): "slowest" or "recent"
+        format (str): "json", or "chrome" for chrome://tracing and Perfetto
+        id (Optional[int]): Return only this trace
+    
+    Returns:
+        JSONResponse: The traces
+    """
+    if not DEBUG_TOKEN:
+        return JSONResponse(status_code=404, content={"error": "Not found"})
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {DEBUG_TOKEN}".encode()):
+        return JSONResponse(status_code=401, content={"error": "Unauthorized"},
+                            headers={"WWW-Authenticate": "Bearer"})
+    if id is not None:
+        trace = trace_buffer.get(id)
+        if trace is None:
+            return JSONResponse(status_code=404, content={"error": f"Trace {id} not found"})
+        traces = [trace]
+    elif kind in ("slowest", "recent"):
+        traces = trace_buffer.slowest() if kind == "slowest" else list(reversed(trace_buffer.recent))
+    else:
+        return JSONResponse(status_code=400, content={"error": "kind must be 'slowest' or 'recent'"})
+
+    if format == "chrome":
+        return JSONResponse(content={"traceEvents": [event for trace in traces for event in trace.to_chrome()]})
+    if format != "json":
+        return JSONResponse(status_code=400, content={"error": "format must be 'json' or 'chrome'"})
+    return JSONResponse(content={"traces": [trace.to_dict() for trace in traces]})
+
 if __name__ == "__main__":
     import uvicorn
     
     # Get port from environment variable or use default
     port = int(os.getenv("WEBHOOK_PORT", "8000"))
+    host = os.getenv("WEBHOOK_HOST", "0.0.0.0")
     
     # Run the server
     uvicorn.run(
         app,
-        host="0.0.0.0",
+        host=host,
         port=port,
         log_level="info"
     ) 
\ No newline at end of file
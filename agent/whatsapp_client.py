@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
+WHATSAPP_API_KEY = os.getenv("WHATSAPP_API_KEY")
+# WhatsApp accepts longer texts, but long messages are truncated behind "Read more"
+WHATSAPP_MAX_MESSAGE_CHARS = int(os.getenv("WHATSAPP_MAX_MESSAGE_CHARS", "4096"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+SEND_BACKOFF_SECONDS = float(os.getenv("SEND_BACKOFF_SECONDS", "0.5"))
+SEND_TIMEOUT_SECONDS = float(os.getenv("SEND_TIMEOUT_SECONDS", "10"))
+SEND_MAX_CONNECTIONS = int(os.getenv("SEND_MAX_CONNECTIONS", "20"))
+
+
+class SendError(Exception):
+    """Raised when a message could not be delivered to the WhatsApp API."""
+
+
+def split_message(text: str, limit: int = WHATSAPP_MAX_MESSAGE_CHARS) -> List[str]:
+    """
+    Split a long text into chunks of at most `limit` characters.
+
+    Chunks break at the last paragraph, line, sentence or word boundary that
+    fits, falling back to a hard cut only for unbroken runs of text.
+
+    Args:
+        text (str): The text to split
+        limit (int): Maximum characters per chunk
+
+    Returns:
+        List[str]: The chunks, in order
+    """
+    chunks = []
+    rest = text.strip()
+    while len(rest) > limit:
+        window = rest[:limit]
+        cut = -1
+        for separator in ("\n\n", "\n", ". ", " "):
+            cut = window.rfind(separator)
+            if cut > limit // 4:
+                cut += len(separator)
+                break
+        if cut <= limit // 4:
+            cut = limit
+        chunks.append(rest[:cut].rstrip())
+        rest = rest[cut:].lstrip()
+    if rest:
+        chunks.append(rest)
+    return chunks
+
+
+class WhatsAppSender:
+    """
+    Sends replies through the WhatsApp API over one pooled HTTP client.
+
+    The client is created by `start` and closed by `close`, both driven by the
+    FastAPI lifespan, so connections are kept alive and reused across replies.
+    """
+
+    def __init__(self, base_url: Optional[str] = WHATSAPP_API_URL, api_key: Optional[str] = WHATSAPP_API_KEY):
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client: Optional[httpx.AsyncClient] = None
+        self._messages_total = 0
+        self._chunks_total = 0
+        self._retries_total = 0
+        self._failures_total = 0
+        self._latency_seconds_total = 0.0
+        self._latency_seconds_max = 0.0
+
+    def start(self):
+        """Create the pooled HTTP client."""
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url or "",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=httpx.Timeout(SEND_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=SEND_MAX_CONNECTIONS,
+                max_keepalive_connections=SEND_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+
+    async def close(self):
+        """Close the HTTP client and its connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def send(self, text: str, chat_id: str):
+        """
+        Send a reply to a chat, split into several messages if it is too long.
+
+        Args:
+            text (str): The message to send
+            chat_id (str): The chat ID to send it to
+
+        Raises:
+            SendError: If a chunk could not be delivered after all retries
+        """
+        start = time.perf_counter()
+        try:
+            for chunk in split_message(text) or [text]:
+                await self._post_with_retry(chunk, chat_id)
+                self._chunks_total += 1
+        except SendError:
+            self._failures_total += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._latency_seconds_total += elapsed
+            self._latency_seconds_max = max(self._latency_seconds_max, elapsed)
+        self._messages_total += 1
+
+    async def _post_with_retry(self, chunk: str, chat_id: str):
+        """Post one message, retrying timeouts, transport errors and 5xx with jittered backoff."""
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            try:
+                response = await self._client.post("/send", json={"message": chunk, "number": chat_id})
+                if response.status_code < 500:
+                    if response.is_error:
+                        raise SendError(f"WhatsApp API rejected message: {response.status_code} {response.text}")
+                    return
+                error = f"WhatsApp API error: {response.status_code}"
+            except httpx.TransportError as e:
+                error = f"WhatsApp API unreachable: {type(e).__name__}: {str(e)}"
+            if attempt == SEND_MAX_RETRIES:
+                raise SendError(error)
+            delay = random.uniform(0, SEND_BACKOFF_SECONDS * 2 ** attempt)
+            logger.warning(f"{error}; retrying in {delay:.2f}s")
+            self._retries_total += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Send counters and latency figures for monitoring."""
+        return {
+            "messages_total": self._messages_total,
+            "chunks_total": self._chunks_total,
+            "retries_total": self._retries_total,
+            "failures_total": self._failures_total,
+            "latency_seconds_avg": self._latency_seconds_total / max(self._messages_total + self._failures_total, 1),
+            "latency_seconds_max": self._latency_seconds_max,
+        }